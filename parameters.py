@@ -31,14 +31,18 @@ master_para = {
             # What is the order or concurrence in which foraging (predation), growth (reproduction and mortality),
             # direct impact, and dispersal should be resolved?
 
-            "MAX_CENTRALITY_MEASURE": 10,  # Max amount of NxN matrix multiplication when determining patch.centrality
-            "ASSUMED_MAX_PATH_LENGTH": 3,  # used for shortcuts in rebuilding paths AND multiplying adjacency matrix!
+            "MAX_CENTRALITY_MEASURE": 10,  # Max path length (steps) counted when determining harmonic patch.centrality
+            "ASSUMED_MAX_PATH_LENGTH": 3,  # used for shortcuts in rebuilding paths AND the search for affected patches!
             # THIS VALUE NEEDS TO BE AT LEAST EQUAL TO THE MAXIMUM MAX_DISPERSAL_PATH_LENGTH ACROSS ALL SPECIES!!!
             # and IF YOU CHANGE THIS then "IS_LOAD_ADJ_VARIABLES" BELOW MUST BE "FALSE" AS WE NEED TO REBUILD THEM!!!
             #
             # Note that saving the adjacency variables does seem to be extremely slow in DEBUG mode.
             "IS_SAVE_ADJ_VARIABLES": False,  # Save patch.stepping_stone_list,.species_movement_scores,.adjacency_lists?
             "IS_LOAD_ADJ_VARIABLES": False,  # Load patch.stepping_stone_list,.species_movement_scores,.adjacency_lists?
+            "IS_DENSE_ADJACENCY": False,  # hold the patch adjacency as a full NxN array? Only sensible for small networks,
+            # otherwise only the non-zero entries are stored (which is essential for very large spatial networks).
+            "IS_DEBUG_CHECK_REMOVED_PATCHES": False,  # debugging only: check each step that removed patches are still
+            # unpopulated, and halt if not (as some stale path, interaction or dispersal target must remain to them).
 
             # ------------- Generation data - needs to be set before spatial habitat generation ------------- #
             "SPECIES_TYPES": {
@@ -93,8 +97,16 @@ master_para = {
             # if the following is None then probabilities are treated as uniform when combined with auto-correlation
             "INITIAL_HABITAT_BASE_PROBABILITIES": None,
 
-            # do we load the hurst module and attempt to calculate Hurst exponents?
+            # do we attempt to calculate Hurst exponents (of the local population histories)?
             "IS_CALCULATE_HURST": False,
+            "HURST_NUM_PROCESSES": 1,  # >1 to calculate the Hurst exponents in parallel (with identical results)
+
+            # Accumulate the end-of-run local population statistics (averages, st. dev., source/sink etc.) online during
+            # the NUM_RECORD_STEPS window, rather than from the full histories? If so, then each local population only
+            # keeps the most recent LOCAL_HISTORY_BUFFER_STEPS of its histories (used for the periodicity and Hurst
+            # exponent), and the time-series outputs that require the full histories are not produced.
+            "IS_STREAMING_LOCAL_STATISTICS": False,
+            "LOCAL_HISTORY_BUFFER_STEPS": 500,
 
             # When conducting distance metric, network and complexity analyses that include linear regressions, do we
             # record the vectors of values, to reconstruct the raw data scatter plots against the fitted models later?
@@ -104,12 +116,20 @@ master_para = {
             "COMPLEXITY_ANALYSIS": {
                 "NUM_CLUSTER_DRAWS": 100,  # how many samples do we try to draw for each delta?
                 "NUM_CLUSTER_DRAW_ATTEMPTS": 20,  # how many attempts to draw each sample (may fail if disconnected)?
+                "IS_ADAPTIVE_SAMPLING": False,  # stop drawing the clusters for each delta once the means of diversity
+                    # and complexity have converged (the full NUM_CLUSTER_DRAWS budget remains the maximum)?
+                "ADAPTIVE_CI_WIDTH": 0.05,  # the required half-width of the 95% CI, relative to the mean
+                "ADAPTIVE_MIN_CLUSTER_DRAWS": 20,  # minimum number of successful clusters before convergence is checked
                 "MAX_DELTA": 64,  # maximum delta is min(num_patches_in_subnetwork/2 , this_value)
                 "IS_PARTITION_ANALYSIS": True,  # toggle partition analysis to determine resolution for max complexity
                 "NUM_EVO_PARTITIONS": 10,
                 "NUM_REG_PARTITIONS": 10,
                 "PARTITION_SUCCESS_THRESHOLD": 0.8,  # what fraction (of the max possible) patches must be in clusters
                     # of precisely the required size, for the partition to be considered a success?
+                "NUM_PROCESSES": 1,  # >1 to draw the clusters and partitions of each (sub-network, delta) in parallel.
+                    # Each task is then separately seeded, so results differ from (but are as reproducible as) serial
+                    # runs. The power law fits to the complexity of the sub-networks are then also conducted in
+                    # parallel (with results identical to serial runs).
             },
         },
     "graph_para":
@@ -262,6 +282,12 @@ master_para = {
             # WITHOUT threshold and path-length restriction (crowded plot if species able to traverse most habitats).
             "IS_BIODIVERSITY_ANALYSIS": False,  # produce a species-area curve
             "MIN_BIODIVERSITY_ATTEMPTS": 100,  # used in the estimation of the SAR for very high numbers of patches
+            "IS_ADAPTIVE_BIODIVERSITY_SAMPLING": False,  # stop the additional random attempts at each scale once the
+            # mean diversity has converged to within BIODIVERSITY_CI_WIDTH (relative half-width of the 95% CI)?
+            "BIODIVERSITY_CI_WIDTH": 0.05,
+            "MIN_ADAPTIVE_BIODIVERSITY_SETS": 20,  # minimum number of sets of patches before convergence is checked
+            "BIODIVERSITY_NUM_PROCESSES": 1,  # >1 to sample the scales of the species-area curve in parallel (each
+            # scale is then separately seeded, so results differ from, but are as reproducible as, serial runs)
         },
     "pop_dyn_para":
         {
@@ -315,7 +341,7 @@ master_para = {
                     "adjacency_change": None,
                     "is_reserves_overwrite": False,
                     "clusters_must_be_separated": True,
-                    "proximity_to_previous": 0,  # 0, 1, 2, 3 - will not apply to removal perturbations
+                    "proximity_to_previous": 0,  # 0, 1, 2, 3, ... - will not apply to removal perturbations
                     # [relative_weight, alpha, beta, gamma] or None - preference of total distance from last pert.
                     "prev_weighting": [1, 1, 5, 0],
                     # [relative_weight, alpha, beta, gamma] or None - preference function of previously pert. patches
@@ -386,7 +412,7 @@ master_para = {
 #         "adjacency_change": None,
 #         "is_reserves_overwrite": False,
 #         "clusters_must_be_separated": True,
-#         "proximity_to_previous": 0,  # 0, 1, 2, 3 - will not apply to removal perturbations
+#         "proximity_to_previous": 0,  # 0, 1, 2, 3, ... - will not apply to removal perturbations
 #         # [relative_weight, alpha, beta, gamma] or None - preference of total distance from last pert.
 #         "prev_weighting": [1, 1, 5, 0],
 #         # [relative_weight, alpha, beta, gamma] or None - preference function of previously pert. patches
@@ -4,7 +4,8 @@ import numpy as np
 import os
 import networkx  # https://networkx.org/documentation/stable/reference/generators.html
 import random
-from source_code.cluster_functions import cluster_next_element
+from source_code.cluster_functions import Cluster_frontier
+from source_code.patch_adjacency import Patch_adjacency
 
 # ----------------------------- FOLDER PREPARATION ----------------------- #
 
@@ -523,7 +524,7 @@ def generate_habitat_type(generated_habitat_set, num_patches, generated_habitat_
 
     elif is_clusters:
         # In this case (compatible with "grid" layout), we build clusters of the required size
-        # using cluster_functions.cluster_next_element() from a choice of box, star,
+        # using a cluster_functions.Cluster_frontier from a choice of box, star,
         # chain, or also (not useful for this application) random or disconnected.
         #
         if cluster_type_str == "chess_box":
@@ -534,7 +535,6 @@ def generate_habitat_type(generated_habitat_set, num_patches, generated_habitat_
         else:
             is_chess = False
 
-        unassigned_patches = [x for x in range(num_patches)]
         cluster_habitat_num = -1
         cluster_size_num = 0
         cluster_min_x = 0
@@ -558,27 +558,30 @@ def generate_habitat_type(generated_habitat_set, num_patches, generated_habitat_
             else:
                 raise Exception("Wrong input form for habitat cluster size - should be single integer, or a list.")
 
-        while len(unassigned_patches) > 0:
+        # wrap the array once, and keep a single frontier of the unassigned patches for all of the clusters
+        cluster_adjacency = Patch_adjacency(adjacency_array=adjacency_array, is_dense=True)
+        cluster_frontier = Cluster_frontier(adjacency_matrix=cluster_adjacency,
+                                            candidate_patch_nums=[x for x in range(num_patches)],
+                                            cluster_arch_type=cluster_type_str)
+        while cluster_frontier.num_candidates() > 0:
             # note that this does not need to be "< cluster_size" as the fail-mechanisms here will also cover the
             # remainder patches that need to be assigned
 
-            # draw first patch in each cluster, then get the rest from repeated calls to cluster_next_element()
+            # draw first patch in each cluster, then get the rest from the updated frontier
+            unassigned_patches = cluster_frontier.remaining_candidates()
             if is_chess:
                 # for chessboard, draw the lowest numbered patch - i.e. we fill from the lower-left of the lattice
                 draw_num = unassigned_patches[0]
             else:
                 # draw first patch in each cluster randomly
                 draw_num = random.choice(unassigned_patches)
-            current_cluster = [draw_num]
-            unassigned_patches.remove(draw_num)  # not occurring within a loop over unassigned_patches strictly
+            cluster_frontier.start_cluster()
+            cluster_frontier.add_member(draw_num)
+            current_cluster = cluster_frontier.current_cluster
 
             while len(current_cluster) < cluster_size_list[cluster_size_num]:
                 # draw next elements
-                possible_nums = cluster_next_element(adjacency_matrix=adjacency_array,
-                                                patch_list=None,
-                                                current_cluster=current_cluster,
-                                                actual_patch_nums=unassigned_patches,
-                                                cluster_arch_type=cluster_type_str)
+                possible_nums = cluster_frontier.next_element_choices()
                 if len(possible_nums) == 0:
                     break
                 else:
@@ -643,8 +646,7 @@ def generate_habitat_type(generated_habitat_set, num_patches, generated_habitat_
                                 draw_num = random.choice(possible_nums)
                     else:
                         draw_num = random.choice(possible_nums)
-                    current_cluster.append(draw_num)
-                    unassigned_patches.remove(draw_num)  # deletion does not occur strictly within a loop over the list
+                    cluster_frontier.add_member(draw_num)  # also removes it from the unassigned patches
 
             # When cluster is full size or no possible new members could be found, determine a habitat type
             first_patch_num = current_cluster[0]
@@ -1,143 +1,230 @@
 import random
 import numpy as np
+from source_code.spatial_index import Spatial_index
+from source_code.difference_cache import Difference_cache
 
 
-def cluster_next_element(adjacency_matrix, patch_list, current_cluster: list,
-                         actual_patch_nums: list, cluster_arch_type: str):
-    # This method offers much more control on how to specify the topology of clusters to be generated.
+class Cluster_frontier:
+    # This offers much more control on how to specify the topology of clusters to be generated.
     # It is used in:
-    # - Perturbations: called only by cluster_builder()
-    # - Sample_spatial_data: called by generate_habitat_type() for cluster-based variants only when specified.
+    # - Perturbations: by cluster_builder()
+    # - Sample_spatial_data: by generate_habitat_type() for cluster-based variants only when specified.
     #
-    # Returns the list of patches eligible to be drawn as the next element of the cluster being iteratively constructed
-    # in the list current_cluster.
-
-    type_patch_nums = []
-    if cluster_arch_type == "random":
-        type_patch_nums = actual_patch_nums
-
-    elif cluster_arch_type == "star":
-        # try to choose a neighbour of the initial node
-        for patch_num in actual_patch_nums:
-            if adjacency_matrix[current_cluster[0], patch_num] > 0 \
-                    or adjacency_matrix[patch_num, current_cluster[0]] > 0:
-                type_patch_nums.append(patch_num)
-
-    elif cluster_arch_type == "chain":
-        # try to choose a neighbour of the final node
-        for patch_num in actual_patch_nums:
-            if adjacency_matrix[current_cluster[-1], patch_num] > 0 \
-                    or adjacency_matrix[patch_num, current_cluster[-1]] > 0:
-                type_patch_nums.append(patch_num)
-
-    elif cluster_arch_type == "disconnected":
-        # try to choose a neighbour of None of the current nodes
-        for patch_num in actual_patch_nums:
-            for already_chosen_num in current_cluster:
-                if adjacency_matrix[already_chosen_num, patch_num] == 0 \
-                        and adjacency_matrix[patch_num, already_chosen_num] == 0:
-                    type_patch_nums.append(patch_num)
-
-    elif cluster_arch_type == "box":
-        # try to choose a neighbour of multiple current nodes
-        adjacency_counter = []
-        for patch_num in actual_patch_nums:
-            num_adjacent = 0
-            for already_chosen_num in current_cluster:
-                if adjacency_matrix[already_chosen_num, patch_num] > 0 \
-                        or adjacency_matrix[patch_num, already_chosen_num] > 0:
-                    num_adjacent += 1
-            adjacency_counter.append([patch_num, num_adjacent])
-        # what was the greatest adjacency?
-        if len(adjacency_counter) > 0:
-            max_adjacency = max([x[1] for x in adjacency_counter])
-            # choose from those with greatest adjacency only
-            type_patch_nums = [x[0] for x in adjacency_counter if x[1] == max_adjacency]
-
-    elif cluster_arch_type == "position_box":
-        # choose a box consisting of positionally-close patches, regardless of actual connectivity
-        # although this should be used sparingly as we typically take patch.position to just be about the visualisation
-        # whilst adjacency represents the "real" physical connections that matter to the simulation.
-        distance_counter = []
-        for patch_num in actual_patch_nums:
-            summative_distance = 0.0
-            for already_chosen_num in current_cluster:
-                summative_distance += np.linalg.norm(patch_list[patch_num].position
-                                                     - patch_list[already_chosen_num].position)
-            distance_counter.append([patch_num, summative_distance])
-        # what was minimum total positional distance of any acceptable patch to the existing members of the cluster?
-        min_distance = min([x[1] for x in distance_counter])
-        # choose from those with the least distance only
-        type_patch_nums = [x[0] for x in distance_counter if x[1] == min_distance]
-
-    else:
-        raise "Cluster arch-type not recognised."
-    return type_patch_nums
+    # Holds the remaining candidate patches (in their given order) and the cluster currently being grown from them one
+    # element at a time. Rather than re-evaluating every candidate against every member for each new element, the
+    # boundary of the cluster is updated as each member is added, from the neighbour arrays of the cached CSR links of
+    # the Patch_adjacency object (adjacency_matrix):
+    # - "star" and "chain" only require the neighbours of the first or last member,
+    # - "box" and "disconnected" keep the number of members adjacent to each patch, and "box" also keeps the candidates
+    #   in buckets by this count so that those of greatest adjacency are found directly, all in O(degree) per member,
+    # - "position_box" keeps the total distance of every patch to the members, adding the distances to each new member
+    #   as a single array operation (as all of these totals change, there is no ordering to maintain between members).
+    # The "position_box" type uses the Spatial_index of the patch positions (built here if one is not provided).
+    #
+    # The candidates for the next element are always returned in the order of candidate_patch_nums, so that the
+    # subsequent draws are unchanged. Removed candidates are only marked in the is_candidate mask, and compacted out of
+    # the ordered list when it is next required by remaining_candidates() - so removal is O(1) rather than a list scan.
+    # Several clusters can be grown in turn by calling start_cluster() between them.
+
+    def __init__(self, adjacency_matrix, candidate_patch_nums, cluster_arch_type, patch_list=None,
+                 spatial_index=None):
+        if cluster_arch_type not in ["random", "star", "chain", "disconnected", "box", "position_box"]:
+            raise ValueError(f"Cluster arch-type {cluster_arch_type} not recognised.")
+        self.adjacency_matrix = adjacency_matrix
+        self.cluster_arch_type = cluster_arch_type
+        self.candidate_patch_nums = list(candidate_patch_nums)  # in order, but includes any not yet compacted out
+        self.candidate_order = {patch_num: patch_index for patch_index, patch_num in enumerate(
+            self.candidate_patch_nums)}
+        self.is_candidate = np.zeros(adjacency_matrix.num_patches, dtype=bool)
+        self.is_candidate[self.candidate_patch_nums] = True
+        self.num_removed = 0  # the number of removed candidates still in candidate_patch_nums
+        if cluster_arch_type == "position_box" and spatial_index is None:
+            spatial_index = Spatial_index(positions=[patch.position for patch in patch_list])
+        self.spatial_index = spatial_index
+        self.current_cluster = []
+        self.adjacency_count = {}  # {patch_num: number of current members adjacent to it}
+        self.count_buckets = {}  # {count: set of the candidates with this (non-zero) adjacency count} - "box" only
+        self.summed_distances = None  # total distance of every patch to the current members - "position_box" only
+
+    def start_cluster(self):
+        # the remaining candidates are kept, but the next member added will be the first of a new cluster
+        self.current_cluster = []
+        self.adjacency_count = {}
+        self.count_buckets = {}
+        self.summed_distances = None
+
+    def remove_candidate(self, patch_num):
+        if self.is_candidate[patch_num]:
+            self.is_candidate[patch_num] = False
+            self.num_removed += 1
+            if self.cluster_arch_type == "box" and patch_num in self.adjacency_count:
+                self.count_buckets[self.adjacency_count[patch_num]].discard(patch_num)
+
+    def num_candidates(self):
+        return len(self.candidate_patch_nums) - self.num_removed
+
+    def remaining_candidates(self):
+        # the list of the remaining candidates in order, first compacting out those removed since last required
+        if self.num_removed > 0:
+            candidate_array = np.asarray(self.candidate_patch_nums, dtype=int)
+            self.candidate_patch_nums = candidate_array[self.is_candidate[candidate_array]].tolist()
+            self.num_removed = 0
+        return self.candidate_patch_nums
+
+    def add_member(self, patch_num):
+        self.remove_candidate(patch_num)
+        self.current_cluster.append(patch_num)
+        if self.cluster_arch_type in ["box", "disconnected"]:
+            for neighbour_num in self.adjacency_matrix.neighbour_array(patch_num).tolist():
+                previous_count = self.adjacency_count.get(neighbour_num, 0)
+                self.adjacency_count[neighbour_num] = previous_count + 1
+                if self.cluster_arch_type == "box" and self.is_candidate[neighbour_num]:
+                    if previous_count > 0:
+                        self.count_buckets[previous_count].discard(neighbour_num)
+                    self.count_buckets.setdefault(previous_count + 1, set()).add(neighbour_num)
+        elif self.cluster_arch_type == "position_box":
+            # accumulated over the members in the order they were added, so that tied totals are identical to those
+            # of Spatial_index.summed_distances()
+            all_patch_nums = np.arange(len(self.spatial_index.positions))
+            member_distances = self.spatial_index.distances_between(
+                all_patch_nums, np.full(len(all_patch_nums), patch_num))
+            if self.summed_distances is None:
+                self.summed_distances = np.zeros(len(all_patch_nums))
+            self.summed_distances += member_distances
+
+    def ordered_candidates(self, patch_nums):
+        # the given patches that are current candidates, in the order of the candidates
+        return sorted([x for x in patch_nums if self.is_candidate[x]], key=lambda x: self.candidate_order[x])
+
+    def next_element_choices(self):
+        # Returns the list of patches eligible to be drawn as the next element of the current cluster.
+        type_patch_nums = []
+        if self.cluster_arch_type == "random":
+            type_patch_nums = list(self.remaining_candidates())
+
+        elif self.cluster_arch_type == "star":
+            # try to choose a neighbour of the initial node
+            type_patch_nums = self.ordered_candidates(
+                self.adjacency_matrix.neighbour_array(self.current_cluster[0]).tolist())
+
+        elif self.cluster_arch_type == "chain":
+            # try to choose a neighbour of the final node
+            type_patch_nums = self.ordered_candidates(
+                self.adjacency_matrix.neighbour_array(self.current_cluster[-1]).tolist())
+
+        elif self.cluster_arch_type == "disconnected":
+            # try to choose a neighbour of None of the current nodes (each patch is listed once per non-adjacent member)
+            num_members = len(self.current_cluster)
+            for patch_num in self.remaining_candidates():
+                type_patch_nums.extend([patch_num] * (num_members - self.adjacency_count.get(patch_num, 0)))
+
+        elif self.cluster_arch_type == "box":
+            # try to choose a neighbour of multiple current nodes - choose from those with greatest adjacency only
+            occupied_counts = [x for x in self.count_buckets if len(self.count_buckets[x]) > 0]
+            if len(occupied_counts) > 0:
+                type_patch_nums = self.ordered_candidates(self.count_buckets[max(occupied_counts)])
+            else:
+                # no candidate is adjacent to any member, so all are of the greatest (zero) adjacency
+                type_patch_nums = list(self.remaining_candidates())
+
+        elif self.cluster_arch_type == "position_box":
+            # choose a box consisting of positionally-close patches, regardless of actual connectivity
+            # although this should be used sparingly as we typically take patch.position to just be about the
+            # visualisation whilst adjacency represents the "real" physical connections that matter to the simulation.
+            if self.num_candidates() > 0:
+                candidate_array = np.asarray(self.remaining_candidates(), dtype=int)
+                candidate_distances = self.summed_distances[candidate_array]
+                # what was minimum total positional distance of any acceptable patch to the existing members?
+                min_distance = np.min(candidate_distances)
+                # choose from those with the least distance only
+                type_patch_nums = candidate_array[candidate_distances == min_distance].tolist()
+        return type_patch_nums
 
 
 def generate_fast_cluster(sub_network, size, max_attempts, admissible_elements, num_species,
                           box_uniform_state=None, is_uniform=False, is_box=False,
                           all_elements_admissible=False, initial_patch=None,
-                          return_undersized_cluster=False, is_normalised=False):
+                          return_undersized_cluster=False, is_normalised=False, difference_cache=None):
     # This is a more limited, but more efficient method to generate entire clusters of the specified size.
     # Used during complexity_analysis() when we requiring rapidly drawing many 100's of clusters.
+    # If is_uniform, the differences between patches are taken from the difference_cache (of the target array).
+    #
+    # The frontier (the eligible neighbours of the cluster) is held in pre-allocated arrays of slots, in the order in
+    # which the neighbours were found. Drawn elements are marked as no longer live rather than deleted, so that the live
+    # slots are always in the same order as the list of potential neighbours would be, and hence the same draws are
+    # made for the same random state.
 
     cluster = []
     is_success = False
     num_attempts = 0
     internal_complexity = 0.0
     neighbour_dict = sub_network["neighbour_dict"]
-    if is_uniform:
+    if is_uniform and difference_cache is None:
         if is_normalised:
             target_array = sub_network["normalised_population_arrays"][0]
         else:
             target_array = sub_network["population_arrays"][0]
+        difference_cache = Difference_cache(target_array=target_array)
+    if not all_elements_admissible:
+        # a set may be given directly (e.g. the unpartitioned elements of draw_partition) to avoid copying it
+        if isinstance(admissible_elements, set):
+            admissible_set = admissible_elements
+        else:
+            admissible_set = set(admissible_elements)
     else:
-        target_array = None
+        admissible_set = None
 
     # is it possible in principle?
     if size <= sub_network["num_patches"]:
+        # frontier slot arrays (extended if ever required)
+        frontier_elements = np.zeros(8 * size, dtype=int)
+        adjacency_counter = np.zeros(8 * size)
+        difference_sum = np.zeros(8 * size)
+        is_live = np.zeros(8 * size, dtype=bool)
+
         while num_attempts < max_attempts and not is_success:
             is_success = True
             num_attempts += 1
 
-            # initialise lists
+            # initialise the cluster and the (empty) frontier
             cluster = []  # will store the row-column indices relative to the current sub_network
-            potential_neighbours = []
-            # initialise arrays of length equal to the possible_neighbours list
-            adjacency_counter = np.array([])
-            difference_sum = np.array([])
+            cluster_set = set()
+            frontier_slot = {}  # the slot of each element currently in the frontier
+            num_slots = 0
             internal_complexity = 0.0
 
             # loop through drawing the 1st to Nth elements of the sample
             for num_element in range(size):
 
-                if len(potential_neighbours) > 0:
+                if len(frontier_slot) > 0:
                     # for all except the first element, draw from list according to cluster criteria in arrays
+                    live_slots = np.nonzero(is_live[:num_slots])[0]
+                    live_adjacency = adjacency_counter[live_slots]
+                    live_difference = difference_sum[live_slots]
                     #
                     # at the most base level, all neighbours of the cluster are eligible
-                    base_score = np.ones(len(potential_neighbours))
+                    base_score = np.ones(len(live_slots))
 
                     # Modifiers
                     # if either is_box or is_uniform or both, need to specify implementation with box_uniform_state
                     if box_uniform_state == "balance" and is_box and is_uniform:
-                        if np.max(adjacency_counter) - np.min(adjacency_counter) != 0.0:
-                            adj_modifier = 1.0 + ((adjacency_counter - np.min(adjacency_counter)) /
-                                            (np.max(adjacency_counter) - np.min(adjacency_counter)))
+                        if np.max(live_adjacency) - np.min(live_adjacency) != 0.0:
+                            adj_modifier = 1.0 + ((live_adjacency - np.min(live_adjacency)) /
+                                            (np.max(live_adjacency) - np.min(live_adjacency)))
                             base_score = base_score * adj_modifier
-                        if np.max(difference_sum) - np.min(difference_sum) != 0.0:
-                            uni_modifier = 2.0 - ((difference_sum - np.min(difference_sum)) /
-                                            (np.max(difference_sum) - np.min(difference_sum)))
+                        if np.max(live_difference) - np.min(live_difference) != 0.0:
+                            uni_modifier = 2.0 - ((live_difference - np.min(live_difference)) /
+                                            (np.max(live_difference) - np.min(live_difference)))
                             base_score = base_score * uni_modifier
                     elif box_uniform_state == "ensure_box" and is_box:
                         # FIRST restrict to only the greatest adjacency
-                        base_score = base_score * (adjacency_counter == np.max(adjacency_counter))
+                        base_score = base_score * (live_adjacency == np.max(live_adjacency))
                         if is_uniform:
                             # if applicable, THEN further scale by the highest score (min. 1) for uniformity
-                            base_score = base_score * (1.0 + np.max(difference_sum) - difference_sum)
+                            base_score = base_score * (1.0 + np.max(live_difference) - live_difference)
                     elif box_uniform_state == "ensure_uniform" and is_uniform:
                         # FIRST restrict to the highest score (i.e. lowest difference) for intra-cluster uniformity
-                        base_score = base_score * (difference_sum == np.min(difference_sum))
+                        base_score = base_score * (live_difference == np.min(live_difference))
                         # note this should work, since "difference_sum" is only associated with ACTUAL candidates
                         # (i.e. it would be a problem if the vector was the length of all possible patches, with 0
                         # score for patches that are not actually eligible neighbours and no actual candidates
@@ -145,7 +232,7 @@ def generate_fast_cluster(sub_network, size, max_attempts, admissible_elements,
                         # the apparent "best" minimum added complexity).
                         if is_box:
                             # if applicable, THEN further scale by the adjacency (min. 1)
-                            base_score = base_score * adjacency_counter
+                            base_score = base_score * live_adjacency
                     else:
                         # no box or uniform restrictions/preferences
                         # check options are consistent:
@@ -154,29 +241,32 @@ def generate_fast_cluster(sub_network, size, max_attempts, admissible_elements,
                                             "box_uniform_state is specified.")
                         pass
 
-
                     # after possible modifications, draw one of the best
                     short_list = np.where(base_score == np.max(base_score))[0]
-                    draw_index = np.random.choice(short_list)
-                    draw_num = potential_neighbours[draw_index]
+                    draw_slot = live_slots[np.random.choice(short_list)]
+                    draw_num = int(frontier_elements[draw_slot])
                     cluster.append(draw_num)
-                    potential_neighbours.pop(draw_index)
-                    adjacency_counter = np.delete(adjacency_counter, draw_index)
+                    cluster_set.add(draw_num)
+                    is_live[draw_slot] = False
+                    del frontier_slot[draw_num]
                     if is_uniform:
                         # update internal complexity with difference between the newly-added element and all current
-                        internal_complexity += difference_sum[draw_index]
-                    difference_sum = np.delete(difference_sum, draw_index)
+                        internal_complexity += difference_sum[draw_slot]
                 else:
                     if len(cluster) == 0:
                         # draw of initial element
                         if initial_patch is not None:
-                            if all_elements_admissible or initial_patch in admissible_elements:
+                            if all_elements_admissible or initial_patch in admissible_set:
                                 draw_num = initial_patch
                             else:
                                 raise Exception("Initial element not admissible.")
                         else:
-                            draw_num = random.choice(admissible_elements)
+                            if isinstance(admissible_elements, set):
+                                draw_num = random.choice(sorted(admissible_elements))
+                            else:
+                                draw_num = random.choice(admissible_elements)
                         cluster.append(draw_num)
+                        cluster_set.add(draw_num)
                     else:
                         # cluster has failed to attain required size
                         is_success = False
@@ -188,63 +278,69 @@ def generate_fast_cluster(sub_network, size, max_attempts, admissible_elements,
                 # check the neighbours of new member (applies to first element also) and update set of possibilities
                 for potential_element in neighbour_dict[draw_num]:
                     # don't consider patches already chosen!
-                    if potential_element not in cluster:
+                    if potential_element not in cluster_set:
                         if not all_elements_admissible:
-                            if potential_element not in admissible_elements:
+                            if potential_element not in admissible_set:
                                 continue
 
                         # separate treatment required only for those who are NEW eligible neighbours
-                        if potential_element not in potential_neighbours:
-                            potential_neighbours.append(potential_element)
-                            # increase size of all tracking arrays
-                            adjacency_counter = np.pad(adjacency_counter, (0,1), mode='constant', constant_values=0)
-                            difference_sum = np.pad(difference_sum, (0, 1), mode='constant', constant_values=0)
-                            potential_index = len(potential_neighbours) - 1
+                        if potential_element not in frontier_slot:
+                            if num_slots == len(frontier_elements):
+                                # extend all slot arrays
+                                frontier_elements = np.concatenate((frontier_elements, np.zeros(num_slots, dtype=int)))
+                                adjacency_counter = np.concatenate((adjacency_counter, np.zeros(num_slots)))
+                                difference_sum = np.concatenate((difference_sum, np.zeros(num_slots)))
+                                is_live = np.concatenate((is_live, np.zeros(num_slots, dtype=bool)))
+                            potential_slot = num_slots
+                            num_slots += 1
+                            frontier_slot[potential_element] = potential_slot
+                            frontier_elements[potential_slot] = potential_element
+                            is_live[potential_slot] = True
+                            adjacency_counter[potential_slot] = 0.0
+                            difference_sum[potential_slot] = 0.0
 
                             # calculate difference of new neighbour to all except the newest member of the cluster
                             if is_uniform and len(cluster) > 1:
-                                for cluster_member in cluster[0:-1]:
-                                    difference_sum[potential_index] += determine_difference(
-                                        cluster_member, potential_element, target_array, num_species)
+                                for member_difference in difference_cache.differences(potential_element, cluster[0:-1]):
+                                    difference_sum[potential_slot] += member_difference
                         else:
-                            # find the existing index for this neighbour
-                            potential_index = potential_neighbours.index(potential_element)
+                            # find the existing slot for this neighbour
+                            potential_slot = frontier_slot[potential_element]
 
                         if is_box:
                             # for box style, must update all neighbours of the added patch with their additional
                             # adjacency, which may go from 0 to 1 (for new neighbours) or simply be incremented
-                            adjacency_counter[potential_index] += 1
+                            adjacency_counter[potential_slot] += 1
 
                 # now if necessary, update ALL neighbours (including new neighbours) with ADDITIONAL difference to the
                 # newly-added member of the cluster
                 if is_uniform:
-                    for potential_index, potential_neighbour in enumerate(potential_neighbours):
-                        difference_sum[potential_index] += determine_difference(
-                            cluster[-1], potential_neighbour, target_array, num_species)
+                    live_slots = np.nonzero(is_live[:num_slots])[0]
+                    difference_sum[live_slots] += difference_cache.differences(cluster[-1],
+                                                                              frontier_elements[live_slots])
 
     # normalise internal complexity
     if is_uniform:
         internal_complexity = internal_complexity * 4.0 / (num_species * (size ** 2 - np.mod(size, 2)))
     return cluster, is_success, internal_complexity
 
-def determine_difference(patch_1, patch_2, target_array, num_species):
-    total_difference = 0.0
-    for species_index in range(num_species):
-        total_difference += np.abs(target_array[patch_1, species_index] - target_array[patch_2, species_index])
-    return total_difference
-
 def draw_partition(sub_network, size, num_species, is_normalised, partition_success_threshold,
-                   initial_patch=None, is_evo=False):
+                   initial_patch=None, is_evo=False, difference_cache=None):
     # As far as possible, cluster the elements of the network into highly-uniform clusters of the given size.
     # Note that we opt for box-clusters only as this is less ambiguous in what we 'expect' to see, and it feels like
     # a more natural interpretation of the space than the visually-strange but topologically-admissible patterns that
     # *could* get detected otherwise - i.e. it seeks more obvious approximately-square 2D clusters, rather than
     # recognising two clusters joined by a long thin string as a single 'cluster' even though topologically equivalent.
+    #
+    # The elements still to be partitioned are held as a set (which is also passed directly as the admissible elements
+    # of each cluster) and a boolean mask (for the ordered draws of initial elements), so that committing a cluster
+    # only costs the size of the cluster rather than a search of the whole list of remaining elements.
 
     # partition consists of a numbered dictionary of cluster lists
     partition = {}
     total_patches = sub_network["num_patches"]
-    elements_to_partition = [_ for _ in range(total_patches)]
+    unpartitioned_set = set(range(total_patches))
+    is_unpartitioned = np.ones(total_patches, dtype=bool)
     partition_lookup = np.zeros(sub_network["num_patches"])  # returns cluster of the patch
     cluster_num = 0
     total_elements_partitioned = 0
@@ -253,12 +349,19 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
     partition_target_base = size * np.divmod(total_patches, size)[0]  # the amount which COULD be precisely partitioned
     partition_target = partition_success_threshold * np.floor(partition_target_base)
     cluster_init_patch = initial_patch
+    if difference_cache is None:
+        # shared by all of the clusters drawn for this partition
+        if is_normalised:
+            target_array = sub_network["normalised_population_arrays"][0]
+        else:
+            target_array = sub_network["population_arrays"][0]
+        difference_cache = Difference_cache(target_array=target_array)
 
-    while len(elements_to_partition) > 0:
+    while len(unpartitioned_set) > 0:
 
         if is_evo:
             # number of attempts
-            if len(elements_to_partition) > size:
+            if len(unpartitioned_set) > size:
                 how_many_cluster_draws = 5
             else:
                 how_many_cluster_draws = 1
@@ -267,14 +370,14 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
             best_cluster = []
             best_success = False
             for try_cluster in range(how_many_cluster_draws):
-                cluster_init_patch = np.random.choice(elements_to_partition)
+                cluster_init_patch = np.random.choice(np.flatnonzero(is_unpartitioned))
 
                 # generate each box cluster
                 cluster, is_success, internal_complexity = generate_fast_cluster(
                     sub_network=sub_network,
                     size=size,
                     max_attempts=1,
-                    admissible_elements=elements_to_partition,
+                    admissible_elements=unpartitioned_set,
                     num_species=num_species,
                     box_uniform_state="balance",  # depends on topological restrictions desired, but best results here
                     is_box=True,                  # from a balance which avoids the most 'obvious' undesirable outcomes
@@ -283,6 +386,7 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
                     initial_patch=cluster_init_patch,
                     return_undersized_cluster=True,
                     is_normalised=is_normalised,
+                    difference_cache=difference_cache,
                 )
 
                 if is_success and internal_complexity < best_internal_complexity:
@@ -300,7 +404,7 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
                 sub_network=sub_network,
                 size=size,
                 max_attempts=1,
-                admissible_elements=elements_to_partition,
+                admissible_elements=unpartitioned_set,
                 num_species=num_species,
                 box_uniform_state="balance",
                 # depends on topological restrictions desired, but we obtain the best results
@@ -310,6 +414,7 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
                 initial_patch=cluster_init_patch,
                 return_undersized_cluster=True,
                 is_normalised=is_normalised,
+                difference_cache=difference_cache,
             )
 
         # choose the best one
@@ -322,28 +427,24 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
             partition_failed_elements += len(best_cluster)
 
         for element in best_cluster:
-            elements_to_partition.remove(element)
+            unpartitioned_set.remove(element)
             partition_lookup[element] = cluster_num
+        is_unpartitioned[best_cluster] = False
         partition[cluster_num] = best_cluster
 
         if partition_failed_elements >= total_patches - partition_target:
             # cannot possibly succeed now, no point continuing
             break
 
-        if not is_evo and len(elements_to_partition) > 0:
+        if not is_evo and len(unpartitioned_set) > 0:
             # choose next largest element from the smallest in the cluster to start with if possible,
             # otherwise choose the smallest overall from those eligible
-            temp_init_upper = float('inf')
-            temp_init_lower = elements_to_partition[0]
-            min_cluster_element = min(best_cluster)
-            for element in elements_to_partition:
-                temp_init_lower = min(temp_init_lower, element)
-                if element > min_cluster_element:
-                    temp_init_upper = min(temp_init_upper, element)
-            if temp_init_upper < float('inf'):
-                cluster_init_patch = int(temp_init_upper)
+            remaining_elements = np.flatnonzero(is_unpartitioned)
+            larger_elements = remaining_elements[remaining_elements > min(best_cluster)]
+            if len(larger_elements) > 0:
+                cluster_init_patch = int(larger_elements[0])
             else:
-                cluster_init_patch = temp_init_lower
+                cluster_init_patch = int(remaining_elements[0])
 
         # set up for next cluster
         cluster_num += 1
@@ -352,51 +453,111 @@ def draw_partition(sub_network, size, num_species, is_normalised, partition_succ
     is_partition_success = (total_elements_partitioned > partition_target)
     return partition, partition_lookup, is_partition_success, partition_internal_complexity
 
-def partition_analysis(sub_network, partition, partition_lookup, num_species, is_normalised):
+
+def neighbour_edge_arrays(neighbour_dict):
+    # the (element, neighbour) pairs of a sub-network's neighbour_dict as two parallel arrays, for vectorised look-ups
+    num_neighbours = [len(neighbour_dict[element]) for element in range(len(neighbour_dict))]
+    edge_sources = np.repeat(np.arange(len(neighbour_dict)), num_neighbours)
+    edge_targets = np.fromiter((neighbour for element in range(len(neighbour_dict))
+                                for neighbour in neighbour_dict[element]), dtype=int, count=int(np.sum(num_neighbours)))
+    return edge_sources, edge_targets
+
+
+def partition_analysis(sub_network, partition, partition_lookup, num_species, is_normalised, neighbour_edges=None):
     # Determine the per-species patch-mean value in each cluster, and the adjacency relationships between clusters,
     # then calculate the mean difference across neighbouring clusters.
+    #
+    # The adjacent cluster pairs are found together from the arrays of neighbour edges (which can be given if already
+    # built for this sub-network) and the partition_lookup, rather than by looping over the elements of each cluster.
     if is_normalised:
         target_array_str = "normalised_population_arrays"
     else:
         target_array_str = "population_arrays"
+    target_array = sub_network[target_array_str][0]
+    if neighbour_edges is None:
+        neighbour_edges = neighbour_edge_arrays(sub_network["neighbour_dict"])
+    edge_sources, edge_targets = neighbour_edges
 
     num_clusters = len(partition)
-    partition_values = {}
-    partition_adjacency = np.zeros((num_clusters, num_clusters))
+    partition_values = np.zeros((num_clusters, num_species))
+    element_cluster = np.full(len(partition_lookup), -1)
     for cluster_num in range(num_clusters):
         cluster = partition[cluster_num]
-        cluster_species_values = {x: 0.0 for x in range(num_species)}
-        for species_index in range(num_species):
-            cluster_species_values[species_index] = np.mean([sub_network[target_array_str][0][
-                                                                _, species_index] for _ in cluster])
-        partition_values[cluster_num] = cluster_species_values
-
-        # determine cluster adjacency in the partition
-        for element in cluster:
-            for neighbour in sub_network["neighbour_dict"][element]:
-                neighbour_cluster = int(partition_lookup[neighbour])
-                if neighbour_cluster != cluster_num:
-                    partition_adjacency[cluster_num, neighbour_cluster] = 1
+        # per-species mean over the cluster (each species a contiguous row, as for the mean of a list)
+        partition_values[cluster_num, :] = np.mean(np.ascontiguousarray(
+            target_array[cluster, :num_species].T), axis=1)
+        element_cluster[cluster] = cluster_num
+
+    # determine the unique pairs (lower, upper) of adjacent clusters in the partition, in ascending order
+    is_partitioned_edge = element_cluster[edge_sources] >= 0
+    from_cluster = element_cluster[edge_sources[is_partitioned_edge]]
+    to_cluster = partition_lookup[edge_targets[is_partitioned_edge]].astype(int)
+    is_upper_pair = from_cluster < to_cluster
+    pair_codes = np.unique(from_cluster[is_upper_pair] * num_clusters + to_cluster[is_upper_pair])
+    cluster_1 = pair_codes // num_clusters
+    cluster_2 = pair_codes % num_clusters
 
     # now determine min, mean, max species-averaged difference across adjacent clusters (i.e. partition complexity)
-    total_difference = 0.0
-    min_difference = float('inf')
-    max_difference = 0.0
-    num_pairs = 0
-    for cluster_1 in range(num_clusters-1):
-        for cluster_2 in range(cluster_1+1, num_clusters):
-            if partition_adjacency[cluster_1, cluster_2] != 0:
-                num_pairs += 1
-                pair_difference = 0.0
-                for species_index in range(num_species):
-                    pair_difference += np.abs(partition_values[cluster_1][species_index
-                                              ] - partition_values[cluster_2][species_index])
-                spec_ave_pair_difference = pair_difference / num_species
-                total_difference += spec_ave_pair_difference
-                min_difference = min(min_difference, spec_ave_pair_difference)
-                max_difference = max(max_difference, spec_ave_pair_difference)
+    num_pairs = len(pair_codes)
     if num_pairs > 0:
+        pair_difference = np.zeros(num_pairs)
+        for species_index in range(num_species):
+            pair_difference += np.abs(partition_values[cluster_1, species_index]
+                                      - partition_values[cluster_2, species_index])
+        spec_ave_pair_difference = pair_difference / num_species
+        total_difference = np.cumsum(spec_ave_pair_difference)[-1]
+        min_difference = np.min(spec_ave_pair_difference)
+        max_difference = max(0.0, np.max(spec_ave_pair_difference))
         mean_difference = total_difference / num_pairs
     else:
+        min_difference = float('inf')
+        max_difference = 0.0
         mean_difference = 0.0
-    return min_difference, mean_difference, max_difference
\ No newline at end of file
+    return min_difference, mean_difference, max_difference
+
+
+def partition_draw_results(sub_network, delta, num_species, is_normalised, partition_success_threshold,
+                           num_reg_partitions, num_evo_partitions, difference_cache=None, seed=None):
+    # One (sub-network, delta) unit of the partition part of complexity_analysis(): draw the regular and then the
+    # evolutionary partitions, and return for each (in order) the partition_lookup, whether it was successful, the list
+    # of intra-cluster complexities and (if successful) the inter-cluster complexity from partition_analysis().
+    #
+    # If a seed is given then the random draws are re-seeded, for when this is executed in a separate process.
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+    if difference_cache is None:
+        if is_normalised:
+            target_array = sub_network["normalised_population_arrays"][0]
+        else:
+            target_array = sub_network["population_arrays"][0]
+        difference_cache = Difference_cache(target_array=target_array)
+    neighbour_edges = neighbour_edge_arrays(sub_network["neighbour_dict"])
+
+    # iterate over multiple attempts to draw successful partitions overall
+    draw_results = []
+    for i in range(num_reg_partitions + num_evo_partitions):
+        if i < num_reg_partitions:
+            # draw some partitions in the regular way, stepping over the starting patches
+            initial_patch = i * int(sub_network["num_patches"] / num_reg_partitions)
+            is_evo = False
+        else:
+            # draw some partitions using the evolutionary method
+            initial_patch = None
+            is_evo = True
+
+        (partition, partition_lookup, is_partition_success, partition_intra_complexity
+         ) = draw_partition(sub_network=sub_network, size=delta, num_species=num_species, is_normalised=is_normalised,
+                            partition_success_threshold=partition_success_threshold, initial_patch=initial_patch,
+                            is_evo=is_evo, difference_cache=difference_cache)
+
+        # We require at least half the elements to have been placed in clusters of the desired size for the partition
+        # to be acceptable, and only then is the inter-cluster complexity required:
+        if is_partition_success:
+            inter_complexity = partition_analysis(sub_network=sub_network, partition=partition,
+                                                  partition_lookup=partition_lookup, num_species=num_species,
+                                                  is_normalised=is_normalised, neighbour_edges=neighbour_edges)
+        else:
+            inter_complexity = None
+        draw_results.append((partition_lookup, is_partition_success, partition_intra_complexity, inter_complexity))
+    return draw_results
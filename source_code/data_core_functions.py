@@ -4,6 +4,8 @@ import json
 import pickle
 import sys
 import random
+from source_code.patch_adjacency import Patch_adjacency
+from collections import deque
 
 # ----------------------------- AUXILIARY FUNCTIONS FOR FILE SAVING AND OBJECT HANDLING ----------------------------- #
 
@@ -55,9 +57,15 @@ def set_default(obj):
     # use this option to convert any nested sets (e.g. in the parameters) to a list for the JSON serialising
     if isinstance(obj, set):
         return list(obj)
+    # the (bounded) recent local population histories if streaming statistics
+    if isinstance(obj, deque):
+        return list(obj)
     # convert numpy arrays to nest lists
     if isinstance(obj, np.ndarray):
         return obj.tolist()
+    # patch adjacency is saved as either the full array or the list of non-zero entries
+    if isinstance(obj, Patch_adjacency):
+        return obj.json_serialisable()
 
 
 def format_dictionary_to_JSON_string(input_string, is_final_item, is_indenting):
@@ -131,38 +139,41 @@ def format_dictionary_to_JSON_string(input_string, is_final_item, is_indenting):
 def create_adjacency_path_list(patch_list, patch_adjacency_matrix):
     path_list = []
     for patch_1 in range(len(patch_list)):
-        for patch_2 in range(len(patch_list)):
-            if patch_1 != patch_2 and patch_adjacency_matrix[patch_1, patch_2] != 0.0:
+        for patch_2 in sorted(patch_adjacency_matrix.row_items(patch_1)):
+            if patch_1 != patch_2:
                 path_list.append((patch_1, patch_2, None, []))
     return path_list
 
 
-def find_connected_sets(patch_list, starting_node, scale, list_of_lists):
+def grow_connected_set(neighbour_sets, starting_node, scale):
+    # Randomly grow a connected set of patches from the starting node: repeatedly choose one of the reachable patches
+    # (those adjacent to the set but not in it), add it to the set, and add its own adjacent patches to the reachable
+    # patches. Returns the frozenset of patches if it reaches the required scale, otherwise None.
+    #
+    # neighbour_sets[patch_num] is an iterable of the adjacent patches. The reachable patches are held separately (as
+    # a list with the position of each patch, so that a random one is removed in constant time) and so the adjacency
+    # sets themselves are not modified.
     this_set = {starting_node}
-    reachable_patches = patch_list[starting_node].set_of_adjacent_patches
-    if starting_node in reachable_patches:
-        reachable_patches.remove(starting_node)  # should be unnecessary
-    for next_node in range(1, scale):
-        # choose the next one and add
-        if len(reachable_patches) == 0:
-            break
-        else:
-            node = random.choice(list(reachable_patches))
-            this_set.add(node)
-            reachable_patches.remove(node)
-            for x in patch_list[node].set_of_adjacent_patches:
-                if x not in this_set:
-                    reachable_patches.add(x)
+    reachable_patches = []
+    reachable_position = {}
+    for x in neighbour_sets[starting_node]:
+        if x != starting_node and x not in reachable_position:
+            reachable_position[x] = len(reachable_patches)
+            reachable_patches.append(x)
+    while len(this_set) < scale and len(reachable_patches) > 0:
+        # choose the next one, remove it from the reachable patches (swapping in the last) and add it to the set
+        node_position = random.randrange(len(reachable_patches))
+        node = reachable_patches[node_position]
+        last_node = reachable_patches.pop()
+        if last_node != node:
+            reachable_patches[node_position] = last_node
+            reachable_position[last_node] = node_position
+        del reachable_position[node]
+        this_set.add(node)
+        for x in neighbour_sets[node]:
+            if x not in this_set and x not in reachable_position:
+                reachable_position[x] = len(reachable_patches)
+                reachable_patches.append(x)
     if len(this_set) == scale:
-        is_new = True
-        # check it is not a duplicate
-        if len(list_of_lists) > 0:
-            for prev_list in list_of_lists:
-                if set(prev_list) == this_set:
-                    is_new = False
-                    break
-        if is_new:
-            temp_list = list(this_set)
-            temp_list.sort()
-            list_of_lists.append(temp_list)  # list of sorted lists of patches
-    return list_of_lists
+        return frozenset(this_set)
+    return None
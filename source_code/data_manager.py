@@ -227,12 +227,15 @@ def save_all_data(simulation_obj):
     # Low-detail output on species behaviours:
     write_average_population_data(patch_list=patch_list, sim_path=sim_path, step=step)
     write_perturbation_history_data(perturbation_history=perturbation_history, sim_path=sim_path, step=step)
-    global_species_time_series_properties(patch_list=patch_list, species_set=species_set, parameters=parameters,
-                                          sim_path=sim_path, step=step,
-                                          current_num_patches_history=current_num_patches_history,
-                                          is_save_plots=False, is_save_data=True)
+    # (the time-series outputs require the full local population histories, which are not kept if streaming)
+    is_full_histories = not parameters["main_para"].get("IS_STREAMING_LOCAL_STATISTICS", False)
+    if is_full_histories:
+        global_species_time_series_properties(patch_list=patch_list, species_set=species_set, parameters=parameters,
+                                              sim_path=sim_path, step=step,
+                                              current_num_patches_history=current_num_patches_history,
+                                              is_save_plots=False, is_save_data=True)
     # All species full local population size, internal change, and dispersal in .CSVs for each local_pop object:
-    if simulation_obj.parameters["plot_save_para"]["IS_SAVE_LOCAL_POP_HISTORY_CSV"]:
+    if simulation_obj.parameters["plot_save_para"]["IS_SAVE_LOCAL_POP_HISTORY_CSV"] and is_full_histories:
         write_population_history_data(patch_list=patch_list, sim_path=sim_path, step=step)
     # JSON file of system_state with distance-metrics and histories of network-average properties (e.g. local
     # biodiversity, patch size and quality) and perturbation history:
@@ -414,12 +417,15 @@ def all_plots(simulation_obj):
                                        species=species, sim_path=sim_path, step=step)
 
     # ---- Type IV: Species-specific time-series ---- #
-    global_species_time_series_properties(patch_list=patch_list, species_set=species_set, parameters=parameters,
-                                          sim_path=sim_path, step=step,
-                                          current_num_patches_history=current_num_patches_history,
-                                          is_save_plots=True, is_save_data=False)
+    # (these require the full local population histories, which are not kept if streaming)
+    is_full_histories = not parameters["main_para"].get("IS_STREAMING_LOCAL_STATISTICS", False)
+    if is_full_histories:
+        global_species_time_series_properties(patch_list=patch_list, species_set=species_set, parameters=parameters,
+                                              sim_path=sim_path, step=step,
+                                              current_num_patches_history=current_num_patches_history,
+                                              is_save_plots=True, is_save_data=False)
     is_local_plots = parameters["plot_save_para"]["LOCAL_PLOTS"]  # individual plot files per patch?
-    if parameters["plot_save_para"]["IS_PLOT_LOCAL_TIME_SERIES"]:
+    if parameters["plot_save_para"]["IS_PLOT_LOCAL_TIME_SERIES"] and is_full_histories:
         from source_code.data_plot_functions import plot_local_time_series
         plot_local_time_series(patch_list=patch_list, species_set=species_set, parameters=parameters,
                                sim_path=sim_path, step=step, is_local_plots=is_local_plots)
@@ -1,6 +1,8 @@
 from numpy.distutils.fcompiler import none
 
 from source_code.data_core_functions import *
+from source_code.running_statistics import Running_statistics
+from source_code.system_state_functions import run_parallel_tasks, spawn_task_seeds
 import matplotlib.cm as cm
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
@@ -877,10 +879,8 @@ def plot_adjacency_sub_graphs(system_state, sim_path):
         not_checked = [starting_patch]
         while len(not_checked) > 0:
             for patch_from in list(not_checked):  # iterate over DUMMY COPY of list
-                for patch_to in range(max_patches):
-                    if patch_from != patch_to and (patch_adjacency_matrix[patch_from, patch_to] != 0.0 or
-                                                   patch_adjacency_matrix[patch_to, patch_from] != 0.0) and \
-                            patch_to not in current_list and patch_to not in not_checked:
+                for patch_to in sorted(patch_adjacency_matrix.neighbours(patch_from)):
+                    if patch_from != patch_to and patch_to not in current_list and patch_to not in not_checked:
                         not_checked.append(patch_to)
                 not_checked.remove(patch_from)
                 current_list.append(patch_from)
@@ -1294,72 +1294,113 @@ def plot_degree_distribution(degree_distribution_history, degree_dist_power_law_
 
 # --------------------------------------- PRODUCING SPECIES-AREA CURVES (SAR) --------------------------------------- #
 
+def patch_occupancy_bitmasks(patch_list, species_set):
+    # For each patch, an integer bitmask of the species (by position in the species list) that are present above their
+    # minimum population size, so that the diversity of a set of patches is the number of bits in the union of masks.
+    species_bit = {species: 1 << species_index for species_index, species in enumerate(species_set["list"])}
+    occupancy_bitmasks = []
+    for patch in patch_list:
+        occupancy_bitmask = 0
+        for local_pop in patch.local_populations.values():
+            if local_pop.population > local_pop.species.minimum_population_size:
+                occupancy_bitmask |= species_bit[local_pop.species]
+        occupancy_bitmasks.append(occupancy_bitmask)
+    return occupancy_bitmasks
+
+
+def biodiversity_scale_analysis(neighbour_sets, occupancy_bitmasks, num_patches, scale, minimum_tries, is_adaptive,
+                                relative_ci_width, min_adaptive_sets, seed=None):
+    # One scale of biodiversity_analysis():
+    # - Attempt to grow a connected set of patches of this size from every patch as the starting patch
+    # - If fewer unique sets than minimum_tries are found, make minimum_tries more attempts from random patches
+    #       (if adaptive, only until the mean diversity has converged)
+    # - Sets of patches are only counted once (identified by hashing the frozensets)
+    # Returns the mean diversity of the unique sets, the number of them, and the precision of their mean.
+    #
+    # If a seed is given then the random draws are re-seeded, for when this is executed in a separate process.
+    if seed is not None:
+        random.seed(seed)
+    found_sets = set()
+    diversity_sum = 0
+    diversity_statistics = Running_statistics()
+    for attempt in range(num_patches + minimum_tries):
+        if attempt < num_patches:
+            # try once starting from every patch
+            starting_node = attempt
+        elif (attempt == num_patches and len(found_sets) >= minimum_tries) or (
+                is_adaptive and diversity_statistics.is_converged(relative_ci_width=relative_ci_width,
+                                                                  min_samples=min_adaptive_sets)):
+            # only make the extra attempts if there were not enough sets from the first pass
+            break
+        else:
+            starting_node = random.randint(0, num_patches - 1)
+        connected_set = grow_connected_set(neighbour_sets=neighbour_sets, starting_node=starting_node, scale=scale)
+        if connected_set is not None and connected_set not in found_sets:
+            found_sets.add(connected_set)
+            # count the unique species in the set of patches
+            occupancy_bitmask = 0
+            for patch_num in connected_set:
+                occupancy_bitmask |= occupancy_bitmasks[patch_num]
+            set_diversity = bin(occupancy_bitmask).count("1")
+            diversity_sum += set_diversity
+            diversity_statistics.update(set_diversity)
+    if len(found_sets) > 0:
+        ave_diversity = float(diversity_sum) / float(len(found_sets))
+    else:
+        # set to zero by default
+        ave_diversity = 0.0
+    return ave_diversity, len(found_sets), diversity_statistics.relative_ci_width()
+
+
 def biodiversity_analysis(patch_list, species_set, parameters, sim_path, step):
     #
     # This conducts a slightly more comprehensive SAR investigation, for plotting, than the version included as part of
     # the network complexity analysis in system_state.complexity_analysis() (that is,
     # species_diversity += system_state.count_diversity()).
-
-    # note that this can take a long time if there is a large number (>200) of patches
+    #
+    # Consider biodiversity over a sample of areas with size from 1-N patches (where N is the total number of patches).
+    # At each scale, choosing every patch at least once as the starting patch:
+    # - Build a list of reachable patches which is initially just the adjacent patches to the starting patch
+    # - Randomly choose one and add it to the set of visited patches, remove it from the reachable patches, and
+    #       add any of its adjacent patches to the reachable patches(not including repeats or already visited)
+    # - Repeat until the size is reached or there are no reachable patches
+    # - Finally check that the same set of patches is not repeated, and count the species present in each set.
+    # The scales are independent, so can be conducted in a pool of BIODIVERSITY_NUM_PROCESSES processes (each with its
+    # own random seed, so the results differ from, but are as reproducible as, those of serial execution).
     max_patches = parameters["main_para"]["NUM_PATCHES"]
-    minimum_tries = parameters["plot_save_para"]["MIN_BIODIVERSITY_ATTEMPTS"]
-    biodiversity_output = np.zeros([max_patches, 3])
-
-    # consider biodiversity over a sample of areas with size from 1-N patches (where N is the total number of patches)
-    for scale in range(1, max_patches + 1):
-        # Choosing every patch at least once as the starting patch:
-        # - Build a list of reachable patches which is initially just the adjacent patches to the starting patch
-        # - Randomly choose one and add it to the set of visited patches, remove it from the reachable patches, and
-        #       add any of its adjacent patches to the reachable patches(not including repeats or already visited)
-        # - Repeat until the size is reached or there are no reachable patches
-        # - Finally order the sets of patches, and check that the same set of patches are not repeated.
-
-        list_of_lists = []
-        # try once starting from every patch
-        for starting_node in range(max_patches):
-            list_of_lists = find_connected_sets(patch_list=patch_list,
-                                                starting_node=starting_node,
-                                                scale=scale,
-                                                list_of_lists=list_of_lists)
-        # if don't have as many as desired, try some more random attempts
-        if len(list_of_lists) < minimum_tries:
-            for attempt in range(minimum_tries):
-                starting_node = random.randint(0, max_patches - 1)
-                list_of_lists = find_connected_sets(patch_list=patch_list,
-                                                    starting_node=starting_node,
-                                                    scale=scale,
-                                                    list_of_lists=list_of_lists)
-        if len(list_of_lists) > 0:
-            # count the unique species
-            ave_diversity = 0.0
-            for current_patch_list in list_of_lists:
-
-                # Count the biodiversity in a given connected subgraph:
-                unique_species_set = set({})  # of species objects (not names)
-                break_loop = False
-                for patch_num in current_patch_list:
-                    for local_pop in patch_list[patch_num].local_populations.values():
-                        if local_pop.species not in unique_species_set and local_pop.population \
-                                > local_pop.species.minimum_population_size:
-                            unique_species_set.add(local_pop.species)
-                            # stop if we have now found all species in the system
-                            if len(unique_species_set) == len(species_set["list"]):
-                                break_loop = True
-                                break
-                    if break_loop:
-                        break
-
-                actual_diversity = len(unique_species_set)
+    num_processes = parameters["plot_save_para"].get("BIODIVERSITY_NUM_PROCESSES", 1)
+    biodiversity_output = np.zeros([max_patches, 4])
+
+    # copies of the adjacency, and the species present in each patch, which are all that the sampling requires - these
+    # are common to all scales, so are only sent once to each process
+    shared_kwargs = {
+        "neighbour_sets": [tuple(patch.set_of_adjacent_patches) for patch in patch_list],
+        "occupancy_bitmasks": patch_occupancy_bitmasks(patch_list=patch_list, species_set=species_set),
+        "num_patches": max_patches,
+        "minimum_tries": parameters["plot_save_para"]["MIN_BIODIVERSITY_ATTEMPTS"],
+        "is_adaptive": parameters["plot_save_para"].get("IS_ADAPTIVE_BIODIVERSITY_SAMPLING", False),
+        "relative_ci_width": parameters["plot_save_para"].get("BIODIVERSITY_CI_WIDTH", 0.05),
+        "min_adaptive_sets": parameters["plot_save_para"].get("MIN_ADAPTIVE_BIODIVERSITY_SETS", 20),
+    }
+    scale_kwargs_list = [{"scale": scale} for scale in range(1, max_patches + 1)]
+    if num_processes > 1:
+        for scale_kwargs, seed in zip(scale_kwargs_list, spawn_task_seeds(len(scale_kwargs_list))):
+            scale_kwargs["seed"] = seed
+        # the scales are submitted in chunks, several per process so that the larger (slower) scales are shared out
+        scale_results = run_parallel_tasks(task_function=biodiversity_scale_analysis,
+                                           task_kwargs_list=scale_kwargs_list, num_processes=num_processes,
+                                           shared_kwargs=shared_kwargs,
+                                           chunk_size=int(np.ceil(max_patches / (4 * num_processes))))
+    else:
+        scale_results = [biodiversity_scale_analysis(**shared_kwargs, **scale_kwargs)
+                         for scale_kwargs in scale_kwargs_list]
 
-                ave_diversity += float(actual_diversity)
-            ave_diversity = ave_diversity / float(len(list_of_lists))
-        else:
-            # set to zero by default
-            ave_diversity = 0.0
-        # record results including how many unique sets of patches were tested
+    # record results including how many unique sets of patches were tested, and the precision of their mean
+    for scale, (ave_diversity, num_sets, relative_ci_width) in zip(range(1, max_patches + 1), scale_results):
         biodiversity_output[scale - 1, 0] = scale
         biodiversity_output[scale - 1, 1] = ave_diversity
-        biodiversity_output[scale - 1, 2] = len(list_of_lists)
+        biodiversity_output[scale - 1, 2] = num_sets
+        biodiversity_output[scale - 1, 3] = relative_ci_width
 
     # plot the species-area curve
     x_data = biodiversity_output[:, 0]
@@ -1376,3 +1417,10 @@ def biodiversity_analysis(patch_list, species_set, parameters, sim_path, step):
     ax2.set_ylabel('Average biodiversity', color=ax2_color)
     file_path = f"{sim_path}/{step}/figures/species_area_curve.png"
     print_and_close(fig, file_path)
+
+    # save all four columns: scale, average biodiversity, sets of patches tested, and achieved relative CI half-width
+    file_path = f"{sim_path}/{step}/data/species_area_curve.csv"
+    with safe_open_w(file_path) as f:
+        # noinspection PyTypeChecker
+        np.savetxt(f, biodiversity_output, delimiter=', ', newline='\n', fmt='%.20f')
+    return biodiversity_output
@@ -1,14 +1,36 @@
-from scipy.optimize import curve_fit
+from functools import lru_cache
 import numpy as np
 
 
-def linear_func_to_fit(x, a, b):
-    return b * x + a
+def linear_least_squares(x, y):
+    # analytic least-squares fit of y = b * x + a, returning [a, b] and the covariance of the parameters as estimated
+    # by scipy.optimize.curve_fit() (i.e. scaled by the residual variance)
+    x_deviation = x - np.mean(x)
+    sum_squared_x_deviation = np.dot(x_deviation, x_deviation)
+    if sum_squared_x_deviation == 0.0 or len(x) < 3:
+        raise RuntimeError("Degenerate linear least squares fit.")
+    b = np.dot(x_deviation, y - np.mean(y)) / sum_squared_x_deviation
+    a = np.mean(y) - b * np.mean(x)
+    residuals = y - (b * x + a)
+    residual_variance = np.dot(residuals, residuals) / (len(x) - 2)
+    covariance = residual_variance * np.array([[np.dot(x, x) / len(x), -np.mean(x)],
+                                               [-np.mean(x), 1.0]]) / sum_squared_x_deviation
+    return [np.array([a, b]), covariance]
 
 
 def power_law_curve_fit(degree_distribution_list):
     # pass in the degree distribution as a list of [freq. k=0, freq. k=1, ... , freq. k=k_max]
-    # then this function will shift it into the (x>0, y>0) interior and fit a power law decay
+    # then this function will shift it into the (x>0, y>0) interior and fit a power law decay.
+    # The degree distribution often does not change between steps, so the fits are cached by the distribution.
+    fit_success, a, b, start_x, opt_para_covariance = cached_power_law_curve_fit(tuple(degree_distribution_list))
+    # copy the covariance so that history entries do not share the cached array
+    return [fit_success, a, b, start_x, np.copy(opt_para_covariance) if isinstance(
+        opt_para_covariance, np.ndarray) else list(opt_para_covariance)]
+
+
+@lru_cache(maxsize=1024)
+def cached_power_law_curve_fit(degree_distribution_tuple):
+    degree_distribution_list = list(degree_distribution_tuple)
 
     # default (failure) values
     found_non_zero = False
@@ -38,10 +60,10 @@ def power_law_curve_fit(degree_distribution_list):
         # attempt the linear curve fit of the transformed function
         if len(y2) > 2:
             try:
-                [optimal_parameters, opt_para_covariance] = curve_fit(linear_func_to_fit, x2, y2, p0=[5, -2.5])
+                [optimal_parameters, opt_para_covariance] = linear_least_squares(x2, y2)
                 a, b = [np.exp(optimal_parameters[0]), optimal_parameters[1]]
                 fit_success = 1
             except (Warning, RuntimeError, TypeError):
                 # optimal parameters or co-variance are not found
                 pass
-    return [fit_success, a, b, start_x, opt_para_covariance]
+    return fit_success, a, b, start_x, opt_para_covariance
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+class Difference_cache:
+    # The pairwise L1 (taxicab) differences between the patches (rows) of a sub-network's population array, which are
+    # summed over species. These are required repeatedly for the same pairs of patches when drawing uniform clusters
+    # and partitions, and when determining the complexity of clusters, during complexity_analysis().
+    #
+    # The differences of a patch to ALL patches of the sub-network are calculated together (vectorised over patches)
+    # and stored the first time that they are needed. For very large sub-networks (above max_cached_patches) the full
+    # NxN block would require too much memory, so then only the requested differences are calculated on each call.
+    #
+    # The sum over species is accumulated in species order, and the sum over cluster pairs in pair order, so that the
+    # values are identical to those from iterating over the species and the pairs.
+
+    def __init__(self, target_array, max_cached_patches=4096):
+        self.target_array = np.asarray(target_array, dtype=float)
+        self.num_patches = np.shape(self.target_array)[0]
+        self.is_cached = self.num_patches <= max_cached_patches
+        self.rows = {}
+
+    def calculate_differences(self, patch_index, other_indices):
+        difference = np.zeros(len(other_indices))
+        for species_index in range(np.shape(self.target_array)[1]):
+            difference += np.abs(self.target_array[patch_index, species_index]
+                                 - self.target_array[other_indices, species_index])
+        return difference
+
+    def differences(self, patch_index, other_indices):
+        # array of the differences between this patch and each of the other patches (given as a list of indices)
+        other_indices = np.asarray(other_indices, dtype=int)
+        if self.is_cached:
+            if patch_index not in self.rows:
+                self.rows[patch_index] = self.calculate_differences(patch_index, np.arange(self.num_patches))
+            return self.rows[patch_index][other_indices]
+        return self.calculate_differences(patch_index, other_indices)
+
+    def cluster_total(self, cluster):
+        # sum of the differences over all unique pairs of patches in the cluster
+        if len(cluster) < 2:
+            return 0.0
+        pair_differences = np.concatenate([self.differences(cluster[lower_position], cluster[lower_position + 1:])
+                                           for lower_position in range(len(cluster) - 1)])
+        return np.cumsum(pair_differences)[-1]
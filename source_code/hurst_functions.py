@@ -0,0 +1,97 @@
+from source_code.system_state_functions import run_parallel_tasks
+import numpy as np
+import math
+
+
+# ------------------------ HURST EXPONENTS OF LOCAL POPULATION HISTORIES ------------------------ #
+#
+# The simplified rescaled-range (R/S) analysis of hurst.compute_Hc(series, kind="random_walk", simplified=True), which
+# estimates H and c in E(R/S) = c * T^H, for many series of the same length at once. Each series is divided into
+# non-overlapping windows of each size, and for all windows (of all series) together:
+# - R is the range of the series in the window and S is the st. dev. (ddof=1) of its increments,
+# - windows with R = 0 or S = 0 are skipped, and R/S is averaged over the remaining windows of each size,
+# - H and c are then fitted by least squares to log10(mean R/S) against log10(window size).
+# Instead of trapping the warnings (and so errors) raised for unsuitable series, the failures are identified
+# explicitly and reported for each series.
+
+def hurst_window_sizes(series_length, min_window=10):
+    # window sizes of equal spacing in log10 from min_window to series_length - 1, and then the full series
+    max_window = series_length - 1
+    window_sizes = list(map(
+        lambda x: int(10 ** x),
+        np.arange(math.log10(min_window), math.log10(max_window), 0.25)))
+    window_sizes.append(series_length)
+    return window_sizes
+
+
+def rescaled_range_hurst(series_array, min_window=10):
+    # For the (series x time) array of series of the same length, returns a list of (result, failure) for each series,
+    # where result is (H, c, [window_sizes, RS]) as returned by hurst.compute_Hc(), or None with the failure reason.
+    series_array = np.asarray(series_array, dtype=float)
+    num_series, series_length = np.shape(series_array)
+    if series_length < 100:
+        return [(None, "Series length must be greater or equal to 100") for _ in range(num_series)]
+    is_nan = np.any(np.isnan(series_array), axis=1)
+    window_sizes = hurst_window_sizes(series_length=series_length, min_window=min_window)
+
+    mean_rescaled_range = np.zeros((num_series, len(window_sizes)))
+    is_constant = np.zeros(num_series, dtype=bool)
+    with np.errstate(all='ignore'):
+        for window_index, window_size in enumerate(window_sizes):
+            num_windows = series_length // window_size
+            windows = series_array[:, 0:num_windows * window_size].reshape(num_series, num_windows, window_size)
+            window_range = np.max(windows, axis=2) - np.min(windows, axis=2)
+            window_st_dev = np.std(np.diff(windows, axis=2), axis=2, ddof=1)
+            rescaled_range = window_range / window_st_dev
+            is_valid = (window_range != 0) & (window_st_dev != 0)
+            # mean over the valid windows (over the full contiguous rows where all are valid, so that the summation
+            # order matches that of the individual calculation)
+            is_all_valid = np.all(is_valid, axis=1)
+            mean_rescaled_range[is_all_valid, window_index] = np.mean(rescaled_range[is_all_valid, :], axis=1)
+            for series_index in np.flatnonzero(~is_all_valid):
+                if np.any(is_valid[series_index, :]):
+                    mean_rescaled_range[series_index, window_index] = np.mean(
+                        rescaled_range[series_index, is_valid[series_index, :]])
+                else:
+                    # no windows of this size have a defined R/S (e.g. the series is constant)
+                    is_constant[series_index] = True
+
+    results = []
+    design_matrix = np.vstack([np.log10(window_sizes), np.ones(len(window_sizes))]).T
+    for series_index in range(num_series):
+        if is_nan[series_index]:
+            results.append((None, "Series contains NaNs"))
+        elif is_constant[series_index]:
+            results.append((None, "Undefined rescaled range (constant series or windows)"))
+        else:
+            rescaled_ranges = list(mean_rescaled_range[series_index, :])
+            hurst_exponent, c = np.linalg.lstsq(design_matrix, np.log10(rescaled_ranges), rcond=-1)[0]
+            results.append(((hurst_exponent, 10 ** c, [window_sizes, rescaled_ranges]), None))
+    return results
+
+
+def hurst_exponents(series_list, num_processes=1, max_series_per_task=1000):
+    # Hurst exponent analysis of a list of series (which may differ in length): the series are grouped by length and
+    # divided into tasks, which are conducted in a pool of processes if num_processes > 1. Returns the list of
+    # (result, failure) in the same order as the series.
+    length_groups = {}
+    for series_index, series in enumerate(series_list):
+        length_groups.setdefault(len(series), []).append(series_index)
+    task_indices = []
+    task_kwargs_list = []
+    for series_indices in length_groups.values():
+        for chunk_start in range(0, len(series_indices), max_series_per_task):
+            chunk_indices = series_indices[chunk_start: chunk_start + max_series_per_task]
+            task_indices.append(chunk_indices)
+            task_kwargs_list.append({"series_array": np.array([list(series_list[x]) for x in chunk_indices],
+                                                              dtype=float).reshape(len(chunk_indices), -1)})
+    if num_processes > 1 and len(task_kwargs_list) > 1:
+        task_results = run_parallel_tasks(task_function=rescaled_range_hurst, task_kwargs_list=task_kwargs_list,
+                                          num_processes=num_processes)
+    else:
+        task_results = [rescaled_range_hurst(**task_kwargs) for task_kwargs in task_kwargs_list]
+    results = [None for _ in series_list]
+    for chunk_indices, chunk_results in zip(task_indices, task_results):
+        for series_index, result in zip(chunk_indices, chunk_results):
+            results[series_index] = result
+    return results
@@ -1,4 +1,7 @@
 from source_code.population_dynamics import temporal_function
+from source_code.recent_statistics import Recent_statistics
+from collections import deque
+from functools import partial
 import numpy as np
 
 
@@ -44,6 +47,200 @@ def functional_response_ratio_dependent(attack_rate, predation_para, predator_po
     return func_res
 
 
+# ------------------------ RECENT TIME AVERAGES ------------------------ #
+
+def recent_population_periods(population_history, st_dev_population, current_step, back_steps, history_length,
+                              history_offset=0, max_block_elements=4000000):
+    # Periodicity: n is a period (at each strength) if X_{n-M} and X_{n-2M} ~ X_{n}, X_{n-M-1} and X_{n-2M-1} ~ X_{n-1},
+    # ..., X_{n-M-9} and X_{n-2M-9} ~ X_{n-9}, for the first (smallest) possible period n for which the history is
+    # sufficiently long for the 3N check. The maximum divergences are determined for blocks of possible periods at
+    # once, for only those populations which have not yet been assigned all of their periods.
+    #
+    # population_history is the (population x record) array of the records from number history_offset onwards (e.g.
+    # the buffered recent histories) of the full history_length records. Returns the (weak, med, strong) x population
+    # array of periods.
+    period_epsilon = np.array([
+        np.maximum(0.0001, st_dev_population * 0.01),  # weak
+        np.maximum(0.00000001, st_dev_population * 0.001),  # med
+        np.maximum(0.000000000001, st_dev_population * 0.0001),  # strong
+    ])
+    num_populations = np.shape(population_history)[0]
+    periods = np.zeros((3, num_populations), dtype=int)
+    max_period = min(back_steps - 1, (history_length - 10) // 3)
+    if history_offset > 0:
+        # only check those periods for which all of the compared records are still held
+        max_period = min(max_period, (current_step - 9 - history_offset) // 2)
+    if max_period < 1 or num_populations == 0:
+        return periods
+    reverse_steps = np.arange(10)
+    recent_ten = population_history[:, current_step - history_offset - reverse_steps]
+    block_size = max(1, max_block_elements // (20 * num_populations))
+    for block_start in range(1, max_period + 1, block_size):
+        is_unfinished = np.any(periods == 0, axis=0)
+        if not np.any(is_unfinished):
+            break
+        block_periods = np.arange(block_start, min(block_start + block_size, max_period + 1))
+        unfinished_history = population_history[is_unfinished, :]
+        max_divergence = np.zeros((np.sum(is_unfinished), len(block_periods)))
+        for reverse_period in [1, 2]:
+            lagged_steps = current_step - history_offset - reverse_period * block_periods[:, np.newaxis] - reverse_steps
+            max_divergence = np.maximum(max_divergence, np.max(np.abs(
+                unfinished_history[:, lagged_steps] - recent_ten[is_unfinished, np.newaxis, :]), axis=2))
+        for strength_index in range(3):
+            is_period = max_divergence < period_epsilon[strength_index, is_unfinished, np.newaxis]
+            first_period = block_periods[np.argmax(is_period, axis=1)]
+            is_assigned = np.any(is_period, axis=1) & (periods[strength_index, is_unfinished] == 0)
+            unfinished_periods = periods[strength_index, is_unfinished]
+            unfinished_periods[is_assigned] = first_period[is_assigned]
+            periods[strength_index, is_unfinished] = unfinished_periods
+    return periods
+
+
+def build_recent_time_averages_batch(local_populations, current_step, back_steps, max_block_elements=4000000):
+    # Local_population.build_recent_time_averages() for many local populations at once: their histories are stacked
+    # into (population x step) arrays, separately for each group of populations with the same length of history, and
+    # all of the recent averages, variations and periods are calculated together. The sums are taken over each row (or
+    # sequentially in the original order of steps) so the values are identical to those of the individual calculation.
+    #
+    # For local populations with streaming statistics (see Recent_statistics), the values are instead taken from their
+    # online accumulators, and only the periods are determined from their buffered recent population histories.
+    history_groups = {}
+    for local_population in local_populations:
+        history_groups.setdefault((local_population.recent_statistics is not None,
+                                   local_population.num_history_records,
+                                   len(local_population.population_history)), []).append(local_population)
+    for (is_streaming, history_length, buffer_length), group in history_groups.items():
+        if is_streaming:
+            streaming_recent_time_averages(group=group, current_step=current_step, back_steps=back_steps,
+                                           history_length=history_length, buffer_length=buffer_length,
+                                           max_block_elements=max_block_elements)
+            continue
+        population_history = np.array([x.population_history for x in group], dtype=float)
+        internal_change_history = np.array([x.internal_change_history for x in group], dtype=float)
+        population_enter_history = np.array([x.population_enter_history for x in group], dtype=float)
+        population_leave_history = np.array([x.population_leave_history for x in group], dtype=float)
+        potential_dispersal_history = np.array([x.potential_dispersal_history for x in group], dtype=float)
+        min_pop = np.array([x.species.minimum_population_size for x in group], dtype=float)[:, np.newaxis]
+        # the averages are taken over the slice [current_step - back_steps: current_step], whilst the variations and
+        # the source/sink are taken over the steps current_step - n for n in [0, back_steps)
+        recent_window = slice(current_step - back_steps, current_step)
+        recent_steps = current_step - np.arange(back_steps)
+
+        # Mean and standard deviation of recent population history
+        average_population = np.sum(population_history[:, recent_window], axis=1) / back_steps
+        st_dev_population = np.std(population_history[:, recent_window], axis=1)
+
+        # Recent variations in the local population - maximum absolute variation, occupancy change:
+        max_abs_var = np.max(np.abs(population_history[:, recent_steps] - average_population[:, np.newaxis]), axis=1)
+        new_pop = population_history[:, recent_steps[1:]]
+        old_pop = population_history[:, recent_steps[:-1]]
+        num_occupancy_changes = np.sum(((new_pop < min_pop) & (min_pop <= old_pop)) |
+                                       ((new_pop >= min_pop) & (min_pop > old_pop)), axis=1)
+
+        periods = recent_population_periods(population_history=population_history,
+                                            st_dev_population=st_dev_population, current_step=current_step,
+                                            back_steps=back_steps, history_length=history_length,
+                                            max_block_elements=max_block_elements)
+
+        # Average population change due to the internal ODE/Difference Equation (including possibly distant foraging
+        # by this species and distant predation upon this species) AND direct impact (i.e. everything except
+        # dispersal), average population emigrated and immigrated during dispersal, and average net immigration:
+        average_internal_change = np.sum(internal_change_history[:, recent_window], axis=1) / back_steps
+        average_population_leave = np.sum(population_leave_history[:, recent_window], axis=1) / back_steps
+        average_population_enter = np.sum(population_enter_history[:, recent_window], axis=1) / back_steps
+        recent_net_enter = population_enter_history[:, recent_window] - population_leave_history[:, recent_window]
+        average_net_enter = np.sum(recent_net_enter, axis=1) / back_steps
+        # Average net internal (see description in update_local_nets())
+        sum_abs_internal_change = np.sum(np.abs(internal_change_history[:, recent_window]), axis=1)
+        total_change = sum_abs_internal_change + np.sum(np.abs(recent_net_enter), axis=1)
+
+        # Average sink detection and source detection:
+        # Sink = proportion of of net positive population growth from migration vs. other net processes
+        # Source = proportion of population that dispersed when actually given the chance
+        net_enter = population_enter_history[:, recent_steps] - population_leave_history[:, recent_steps]
+        net_leave = population_leave_history[:, recent_steps] - population_enter_history[:, recent_steps]
+        internal_change = internal_change_history[:, recent_steps]
+        potential_dispersal = potential_dispersal_history[:, recent_steps]
+        positive_net_enter = np.where(net_enter > 0.0, net_enter, 0.0)
+        positive_change = positive_net_enter + np.where(internal_change > 0.0, internal_change, 0.0)
+        sink_change = np.divide(positive_net_enter, positive_change, out=np.zeros(np.shape(positive_change)),
+                                where=positive_change > 0.0)
+        is_zero_potential = potential_dispersal == 0.0
+        source_change = np.divide(np.where(net_leave > 0.0, net_leave, 0.0), potential_dispersal,
+                                  out=np.zeros(np.shape(potential_dispersal)), where=~is_zero_potential)
+        # cumulative sums to accumulate in the same (sequential) order as the individual calculation
+        if back_steps > 0:
+            sum_sink_change = np.cumsum(sink_change, axis=1)[:, -1]
+            sum_source_change = np.cumsum(source_change, axis=1)[:, -1]
+        else:
+            sum_sink_change = np.zeros(len(group))
+            sum_source_change = np.zeros(len(group))
+
+        for index, local_population in enumerate(group):
+            local_population.average_population = average_population[index]
+            local_population.st_dev_population = st_dev_population[index]
+            local_population.population_period_strong = int(periods[2, index])
+            local_population.population_period_med = int(periods[1, index])
+            local_population.population_period_weak = int(periods[0, index])
+            local_population.max_abs_population = max_abs_var[index]
+            if back_steps > 1:
+                local_population.recent_occupancy_change_frequency = int(
+                    num_occupancy_changes[index]) / (back_steps - 1.0)
+            else:
+                local_population.recent_occupancy_change_frequency = 0.0
+            local_population.average_internal_change = average_internal_change[index]
+            local_population.average_population_leave = average_population_leave[index]
+            local_population.average_population_enter = average_population_enter[index]
+            local_population.average_net_enter = average_net_enter[index]
+            if total_change[index] == 0.0:
+                local_population.average_net_internal = 0.0
+            else:
+                local_population.average_net_internal = sum_abs_internal_change[index] / total_change[index]
+            if np.any(is_zero_potential[index, :]):
+                local_population.source = 0.0
+            local_population.average_sink = (1.0 / back_steps) * float(sum_sink_change[index])
+            local_population.average_source = (1.0 / back_steps) * float(sum_source_change[index])
+
+
+def streaming_recent_time_averages(group, current_step, back_steps, history_length, buffer_length,
+                                   max_block_elements):
+    # finalise the recent time averages of a group of local populations with streaming statistics, which have the same
+    # number of history records and of buffered records
+    recent_statistics = [x.recent_statistics for x in group]
+    population_history = np.array([list(x.population_history) for x in group], dtype=float)
+    average_population = np.array([x.sum_population for x in recent_statistics]) / back_steps
+    st_dev_population = np.array([x.st_dev_population() for x in recent_statistics])
+    periods = recent_population_periods(population_history=population_history, st_dev_population=st_dev_population,
+                                        current_step=current_step, back_steps=back_steps,
+                                        history_length=history_length, history_offset=history_length - buffer_length,
+                                        max_block_elements=max_block_elements)
+    for index, local_population in enumerate(group):
+        statistics = local_population.recent_statistics
+        local_population.average_population = average_population[index]
+        local_population.st_dev_population = st_dev_population[index]
+        local_population.population_period_strong = int(periods[2, index])
+        local_population.population_period_med = int(periods[1, index])
+        local_population.population_period_weak = int(periods[0, index])
+        local_population.max_abs_population = statistics.max_abs_population(average_population[index])
+        if back_steps > 1:
+            local_population.recent_occupancy_change_frequency = statistics.num_occupancy_changes / (back_steps - 1.0)
+        else:
+            local_population.recent_occupancy_change_frequency = 0.0
+        local_population.average_internal_change = statistics.sum_internal_change / back_steps
+        local_population.average_population_leave = statistics.sum_population_leave / back_steps
+        local_population.average_population_enter = statistics.sum_population_enter / back_steps
+        local_population.average_net_enter = statistics.sum_net_enter / back_steps
+        total_change = statistics.sum_abs_internal_change + statistics.sum_abs_net_enter
+        if total_change == 0.0:
+            local_population.average_net_internal = 0.0
+        else:
+            local_population.average_net_internal = statistics.sum_abs_internal_change / total_change
+        if statistics.is_zero_potential_dispersal:
+            local_population.source = 0.0
+        local_population.average_sink = (1.0 / back_steps) * statistics.sum_sink_change
+        local_population.average_source = (1.0 / back_steps) * statistics.sum_source_change
+
+
 # ------------------------ CLASS: LOCAL POPULATION ------------------------ #
 
 class Local_population:
@@ -72,7 +269,19 @@ class Local_population:
         }
         self.leaving_array = None
         self.interacting_populations = []
-        self.population_history = []
+        # If streaming, the end-of-run statistics are accumulated online and only the recent histories are kept
+        self.num_history_records = 0
+        if parameters["main_para"].get("IS_STREAMING_LOCAL_STATISTICS", False):
+            self.recent_statistics = Recent_statistics(
+                current_step=parameters["main_para"]["NUM_TRANSIENT_STEPS"] + parameters[
+                    "main_para"]["NUM_RECORD_STEPS"] - 1,
+                back_steps=parameters["main_para"]["NUM_RECORD_STEPS"],
+                minimum_population_size=species.minimum_population_size)
+            history_type = partial(deque, maxlen=parameters["main_para"]["LOCAL_HISTORY_BUFFER_STEPS"])
+        else:
+            self.recent_statistics = None
+            history_type = list
+        self.population_history = history_type()
         self.population_leave = 0.0
         self.population_enter = 0.0
         self.net_enter = 0.0
@@ -80,13 +289,14 @@ class Local_population:
         self.net_internal = 0.0
         self.sink = 0.0
         self.source = 0.0
-        self.internal_change_history = []
-        self.population_enter_history = []
-        self.population_leave_history = []
+        self.internal_change_history = history_type()
+        self.population_enter_history = history_type()
+        self.population_leave_history = history_type()
         self.potential_dispersal = 0.0  # record temporarily during the dispersal() sub-step
-        self.potential_dispersal_history = []  # then update this list at the same time as the other histories
+        self.potential_dispersal_history = history_type()  # then update this at the same time as the other histories
         self.record_population_history()  # need this so that the initial population is recorded
         self.population_history_hurst_exponent = 0.0
+        self.population_history_hurst_failure = None  # reason that the Hurst exponent could not be calculated
         self.average_population = 0.0
         self.population_period_strong = 0.0
         self.population_period_med = 0.0
@@ -199,6 +409,13 @@ class Local_population:
         self.carrying_capacity = self.species.growth_para["CARRYING_CAPACITY"] * patch.size
 
     def record_population_history(self):
+        if self.recent_statistics is not None:
+            self.recent_statistics.update(record_number=self.num_history_records, population=self.population,
+                                          internal_change=self.internal_change,
+                                          population_enter=self.population_enter,
+                                          population_leave=self.population_leave,
+                                          potential_dispersal=self.potential_dispersal)
+        self.num_history_records += 1
         self.population_history.append(self.population)
         self.internal_change_history.append(self.internal_change)
         self.population_leave_history.append(self.population_leave)
@@ -626,111 +843,9 @@ class Local_population:
     def build_recent_time_averages(self, current_step, back_steps):
         # Can be called at any step to calculate the recent averages of population changes that are being stored in
         # full arrays of the history (but it would be needlessly inefficient to calculate them every time-step, so we
-        # only call this in anticipation of upcoming plots - i.e. mainly at the end of the simulation)
-        #
-        # Mean and standard deviation of recent population history
-        self.average_population = np.sum(self.population_history[current_step - back_steps: current_step]) / back_steps
-        self.st_dev_population = np.std(self.population_history[current_step - back_steps: current_step])
-
-        # Recent variations in the local population - periodicity, maximum absolute variation, occupancy change:
-        period_strong = 0
-        period_med = 0
-        period_weak = 0
-        period_epsilon_strong = max(0.000000000001, self.st_dev_population * 0.0001)
-        period_epsilon_med = max(0.00000001, self.st_dev_population * 0.001)
-        period_epsilon_weak = max(0.0001, self.st_dev_population * 0.01)
-        max_abs_var = np.abs(self.population_history[current_step] - self.average_population)
-        num_occupancy_changes = 0
-        min_pop = self.species.minimum_population_size
-        for n in range(1, back_steps):
-            # did the occupancy change?
-            new_pop = self.population_history[current_step - n]
-            old_pop = self.population_history[current_step - n + 1]
-            if (new_pop < min_pop <= old_pop) or (new_pop >= min_pop > old_pop):
-                num_occupancy_changes += 1
-            # update greatest absolute deviation from the mean
-            max_abs_var = max(max_abs_var, np.abs(self.population_history[current_step - n] - self.average_population))
-            # periodicity check
-            # n is possible period
-            if (period_strong == 0 or period_weak == 0 or period_med == 0) and len(
-                    self.population_history) >= 3 * n + 10:
-                # only check if vector sufficiently long for 3N check
-                if abs(self.population_history[current_step - n] -
-                       self.population_history[current_step]) < period_epsilon_weak:
-                    # if we think we have a period M (that is X_{n-M} ~ X_{n}), only record it if we can confirm:
-                    # X_{n-3M} and X_{n-2M} ~ X_{n}
-                    # X_{n-3M-1} and X_{n-2M-1} ~ X_{n-1}
-                    # X_{n-3M-2} and X_{n-2M-2} ~ X_{n-2}
-                    # X_{n-3M-3} and X_{n-2M-3} ~ X_{n-3}
-                    max_divergence = 0.0
-                    for reverse_period in range(3):  # -M, -2M, -3M
-                        for reverse_step in range(10):  # -0, -1, -2, -3, ..., -9
-                            max_divergence = max(max_divergence, abs(
-                                self.population_history[current_step - reverse_period * n - reverse_step] -
-                                self.population_history[current_step - reverse_step]))
-                    if period_weak == 0 and max_divergence < period_epsilon_weak:
-                        period_weak = n
-                    if period_med == 0 and max_divergence < period_epsilon_med:
-                        period_med = n
-                    if period_strong == 0 and max_divergence < period_epsilon_strong:
-                        period_strong = n
-        self.population_period_strong = period_strong
-        self.population_period_med = period_med
-        self.population_period_weak = period_weak
-        self.max_abs_population = max_abs_var
-        if back_steps > 1:
-            self.recent_occupancy_change_frequency = num_occupancy_changes / (back_steps - 1.0)
-        else:
-            self.recent_occupancy_change_frequency = 0.0
-
-        # Average population change due to the internal ODE/Difference Equation (including possibly distant foraging by
-        # this species and distant predation upon this species) AND direct impact (i.e. everything except dispersal):
-        self.average_internal_change = np.sum(
-            self.internal_change_history[current_step - back_steps: current_step]) / back_steps
-        # Average population emigrated during dispersal
-        self.average_population_leave = np.sum(
-            self.population_leave_history[current_step - back_steps: current_step]) / back_steps
-        # Average population immigrated during dispersal
-        self.average_population_enter = np.sum(
-            self.population_enter_history[current_step - back_steps: current_step]) / back_steps
-        # Average net immigration during dispersal
-        self.average_net_enter = np.sum(
-            np.array(self.population_enter_history[current_step - back_steps: current_step]) -
-            np.array(self.population_leave_history[current_step - back_steps: current_step])) / back_steps
-        # Average net internal (see description below)
-        total_change = np.sum(
-            np.abs(self.internal_change_history[current_step - back_steps: current_step])) + np.sum(
-            np.abs(np.array(self.population_enter_history[current_step - back_steps: current_step]) -
-                   np.array(self.population_leave_history[current_step - back_steps: current_step])))
-        if total_change == 0.0:
-            self.average_net_internal = 0.0
-        else:
-            self.average_net_internal = np.sum(np.abs(self.internal_change_history[
-                                                      current_step - back_steps: current_step])) / total_change
-        # Average sink detection and source detection:
-        # Sink = proportion of of net positive population growth from migration vs. other net processes
-        # Source = proportion of population that dispersed when actually given the chance
-        sum_sink_change = 0.0
-        sum_source_change = 0.0
-
-        for n in range(back_steps):
-            this_step = current_step - n
-
-            positive_change = max(0.0, self.population_enter_history[this_step] - self.population_leave_history[
-                this_step]) + max(0.0, self.internal_change_history[this_step])
-
-            if positive_change > 0.0:
-                sum_sink_change += max(0.0, self.population_enter_history[this_step] - self.population_leave_history[
-                    this_step]) / positive_change
-
-            if self.potential_dispersal_history[this_step] == 0.0:
-                self.source = 0.0
-            else:
-                sum_source_change += max(0.0, self.population_leave_history[this_step] - self.population_enter_history[
-                    this_step]) / self.potential_dispersal_history[this_step]
-
-        self.average_sink = (1.0 / back_steps) * sum_sink_change
-        self.average_source = (1.0 / back_steps) * sum_source_change
+        # only call this in anticipation of upcoming plots - i.e. mainly at the end of the simulation). To do so for
+        # many local populations, use build_recent_time_averages_batch() directly.
+        build_recent_time_averages_batch(local_populations=[self], current_step=current_step, back_steps=back_steps)
 
     def update_local_nets(self):
         # occupancy of patch
@@ -32,6 +32,7 @@ class Patch:
         self.local_clustering = []  # can change, takes a list of three values - LCC for all/same/different habitats
         self.position = position  # cannot change
         self.adjacency_lists = {}  # to reduce computational waste
+        self.reverse_adjacency_lists = {}  # {species name: {patch num: position of this patch in its adjacency list}}
         self.sum_competing_for_resources = 0.0
         self.set_of_adjacent_patches = set({})
         self.set_of_xy_adjacent_patches = set({})
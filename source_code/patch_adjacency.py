@@ -0,0 +1,192 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class Patch_adjacency:
+    # Holds the (potentially weighted and directed) adjacency between patches, replacing the full NxN array for
+    # large spatial networks. By default only the non-zero entries are stored, in a dictionary for each row and each
+    # column, so that the neighbours of a patch are found in O(degree) rather than by scanning a full row and column.
+    # Small networks can instead keep the dense array (is_dense=True) with the identical interface.
+    #
+    # Element access [x, y] and assignment [x, y] = value behave exactly as they did for the array, so that code such
+    # as "if patch_adjacency_matrix[x, y] != 0.0" is unchanged - but this should be avoided inside loops over all
+    # patches in favour of the neighbour and edge methods below.
+
+    def __init__(self, adjacency_array=None, num_patches=None, is_dense=False):
+        if adjacency_array is not None:
+            adjacency_array = np.asarray(adjacency_array, dtype=float)
+            num_patches = np.shape(adjacency_array)[0]
+        elif num_patches is None:
+            raise Exception("Patch adjacency requires either an initial array or the number of patches.")
+        self.num_patches = int(num_patches)
+        self.shape = (self.num_patches, self.num_patches)
+        self.is_dense = is_dense
+        self.csr_cache = None  # the CSR matrix is rebuilt only after the adjacency has changed
+        self.linked_csr_cache = None  # likewise for the symmetric boolean CSR matrix of links in either direction
+        if self.is_dense:
+            if adjacency_array is not None:
+                self.dense_array = np.array(adjacency_array, dtype=float)
+            else:
+                self.dense_array = np.zeros(self.shape)
+        else:
+            self.out_links = [{} for _ in range(self.num_patches)]  # out_links[x][y] = value of [x, y] if non-zero
+            self.in_links = [{} for _ in range(self.num_patches)]  # in_links[y][x] = value of [x, y] if non-zero
+            if adjacency_array is not None:
+                row_nums, column_nums = np.nonzero(adjacency_array)
+                for row_num, column_num in zip(row_nums.tolist(), column_nums.tolist()):
+                    value = float(adjacency_array[row_num, column_num])
+                    self.out_links[row_num][column_num] = value
+                    self.in_links[column_num][row_num] = value
+
+    def __getitem__(self, key):
+        row_num, column_num = key
+        if self.is_dense:
+            return self.dense_array[row_num, column_num]
+        return self.out_links[row_num].get(column_num, 0.0)
+
+    def __setitem__(self, key, value):
+        row_num, column_num = key
+        self.csr_cache = None
+        self.linked_csr_cache = None
+        if self.is_dense:
+            self.dense_array[row_num, column_num] = value
+        elif value != 0.0:
+            self.out_links[row_num][column_num] = float(value)
+            self.in_links[column_num][row_num] = float(value)
+        elif column_num in self.out_links[row_num]:
+            del self.out_links[row_num][column_num]
+            del self.in_links[column_num][row_num]
+
+    def __len__(self):
+        return self.num_patches
+
+    def __str__(self):
+        if self.is_dense:
+            return str(self.dense_array)
+        return f"Sparse patch adjacency of {self.num_patches} patches and {self.num_entries()} non-zero entries."
+
+    def num_entries(self):
+        if self.is_dense:
+            return int(np.count_nonzero(self.dense_array))
+        return sum([len(x) for x in self.out_links])
+
+    def row_items(self, patch_num):
+        # dictionary of {y: value} for all non-zero [patch_num, y] - i.e. the patches that can be entered from here
+        if self.is_dense:
+            column_nums = np.nonzero(self.dense_array[patch_num, :])[0]
+            return {int(y): self.dense_array[patch_num, y] for y in column_nums}
+        return self.out_links[patch_num]
+
+    def column_items(self, patch_num):
+        # dictionary of {x: value} for all non-zero [x, patch_num] - i.e. the patches from which this can be entered
+        if self.is_dense:
+            row_nums = np.nonzero(self.dense_array[:, patch_num])[0]
+            return {int(x): self.dense_array[x, patch_num] for x in row_nums}
+        return self.in_links[patch_num]
+
+    def neighbours(self, patch_num):
+        # set of all patches adjacent (in EITHER direction) to the given patch, including itself if self-adjacent
+        if self.is_dense:
+            return set(np.nonzero((self.dense_array[patch_num, :] != 0.0) |
+                                  (self.dense_array[:, patch_num] != 0.0))[0].tolist())
+        return set(self.out_links[patch_num]).union(self.in_links[patch_num])
+
+    def is_adjacent(self, patch_num_1, patch_num_2):
+        return self[patch_num_1, patch_num_2] != 0.0 or self[patch_num_2, patch_num_1] != 0.0
+
+    def diagonal(self):
+        if self.is_dense:
+            return np.diagonal(self.dense_array).copy()
+        return np.asarray([self.out_links[x].get(x, 0.0) for x in range(self.num_patches)])
+
+    def to_csr(self):
+        if self.csr_cache is None:
+            if self.is_dense:
+                self.csr_cache = csr_matrix(self.dense_array)
+            else:
+                row_nums = []
+                column_nums = []
+                values = []
+                for row_num, row in enumerate(self.out_links):
+                    row_nums.extend([row_num] * len(row))
+                    column_nums.extend(row.keys())
+                    values.extend(row.values())
+                self.csr_cache = csr_matrix((values, (row_nums, column_nums)), shape=self.shape, dtype=float)
+        return self.csr_cache
+
+    def linked_csr(self):
+        # symmetric boolean CSR matrix of the links in EITHER direction, so that the row of a patch holds the same
+        # patches as neighbours() in sorted order: indices[indptr[x]:indptr[x + 1]]
+        if self.linked_csr_cache is None:
+            is_linked = self.to_csr() != 0.0
+            self.linked_csr_cache = (is_linked + is_linked.T).tocsr()
+            self.linked_csr_cache.sort_indices()
+        return self.linked_csr_cache
+
+    def neighbour_array(self, patch_num):
+        # sorted array of the same patches as neighbours(), from the cached CSR links (so O(degree) even if dense)
+        is_linked = self.linked_csr()
+        return is_linked.indices[is_linked.indptr[patch_num]: is_linked.indptr[patch_num + 1]]
+
+    def hop_distances(self, source_patch_nums, max_hops, is_intermediate_permitted=None):
+        # Bounded multi-source breadth-first search over the links (in EITHER direction, as for neighbours()). Returns
+        # the array of the least number of links from any of the source patches to each patch, or -1 if this is more
+        # than max_hops. The sources are always passed through, but other patches are only passed through (i.e. used
+        # as stepping stones) if permitted by the optional boolean array is_intermediate_permitted.
+        is_linked = self.linked_csr()
+        hop_distance = np.full(self.num_patches, -1, dtype=int)
+        frontier = np.unique(np.asarray(list(source_patch_nums), dtype=int))
+        hop_distance[frontier] = 0
+        for hop in range(1, max_hops + 1):
+            if hop > 1 and is_intermediate_permitted is not None:
+                frontier = frontier[is_intermediate_permitted[frontier]]
+            if len(frontier) == 0:
+                break
+            reached = np.unique(is_linked[frontier].indices)
+            frontier = reached[hop_distance[reached] < 0]
+            hop_distance[frontier] = hop
+        return hop_distance
+
+    def to_dense(self):
+        if self.is_dense:
+            return self.dense_array.copy()
+        return self.to_csr().toarray()
+
+    def sub_array(self, patch_nums):
+        # dense array of the adjacency restricted to the given patches, in the given order
+        patch_nums = np.asarray(patch_nums, dtype=int)
+        if self.is_dense:
+            return self.dense_array[np.ix_(patch_nums, patch_nums)].copy()
+        return self.to_csr()[patch_nums, :][:, patch_nums].toarray()
+
+    def json_serialisable(self):
+        # used when saving the system state: the full array for dense storage, otherwise the list of non-zero entries
+        if self.is_dense:
+            return self.dense_array.tolist()
+        return {"num_patches": self.num_patches,
+                "entries": [[x, y, value] for x, row in enumerate(self.out_links) for y, value in row.items()]}
+
+
+def load_patch_adjacency(filename, is_dense=False):
+    # read the patch_adjacency.csv file. For sparse storage this is done line-by-line, so that the full NxN array of
+    # a very large network is never held in memory.
+    if is_dense:
+        adjacency_array = np.genfromtxt(filename, dtype='float', delimiter=',', autostrip=True)
+        if np.ndim(adjacency_array) < 2:
+            adjacency_array = np.array([[adjacency_array, 0.0], [0.0, 0.0]])
+        return Patch_adjacency(adjacency_array=adjacency_array, is_dense=True)
+    row_entries = []
+    with open(filename) as f:
+        for line in f:
+            if len(line.strip()) > 0:
+                row_values = np.asarray([float(x) for x in line.strip().rstrip(',').split(',')])
+                column_nums = np.nonzero(row_values)[0]
+                row_entries.append((column_nums, row_values[column_nums]))
+    if len(row_entries) == 1:
+        # a single patch is extended (as for the other arrays) so that it can be correctly sliced
+        row_entries.append((np.zeros(0, dtype=int), np.zeros(0)))
+    patch_adjacency = Patch_adjacency(num_patches=len(row_entries), is_dense=False)
+    for row_num, (column_nums, values) in enumerate(row_entries):
+        for column_num, value in zip(column_nums.tolist(), values.tolist()):
+            patch_adjacency[row_num, column_num] = value
+    return patch_adjacency
@@ -1,6 +1,6 @@
 from source_code.population_dynamics import (build_interacting_populations_list, build_actual_dispersal_targets, \
     reset_dispersal_values, pre_dispersal_of_local_population)
-from source_code.cluster_functions import cluster_next_element
+from source_code.cluster_functions import Cluster_frontier
 import numpy as np
 from copy import deepcopy
 
@@ -179,6 +179,10 @@ def perturbation(system_state, parameters, pert_paras, perturbation_name):
 
     elif pert_paras["perturbation_type"] == "population_perturbation":
 
+        if system_state.perturbation_transaction is not None:
+            # dispersal must use the paths and targets of the current patches, so complete any staged rebuild first
+            close_perturbation_transaction(system_state=system_state, parameters=parameters)
+            open_perturbation_transaction(system_state=system_state)
         affected_patch_list = population_perturbation(
                                 perturbation_name=perturbation_name,
                                 system_state=system_state,
@@ -243,22 +247,26 @@ def contagion(perturbation_name, system_state, current_patch_numbers,
     #
     # eiter contagion probability is a float (universal) or a list (probability of spreading to patch of given habitat)
     target_time = system_state.step + contagion_delay
+    # the frontier of the current round of impacted patches: their neighbours (each time they are listed) which are not
+    # within the cooldown period, with sets so that the membership checks do not scan the growing lists
+    excluded_patch_nums = set(current_patch_numbers)
     if type(contagion_probability) in [float, np.float64]:
         if np.sum(contagion_probability) > 0.0:
             # base probability independent of habitat type
+            frontier_patch_nums = []
             for patch_num in current_patch_numbers:
                 patch = system_state.patch_list[patch_num]
-                # find neighbours - ensure counted only once and cannot be in the current round of impacted patches
                 for neighbour in patch.set_of_adjacent_patches:
-                    if perturbation_name in system_state.patch_list[neighbour].perturbation_type_latest:
-                        time_elapsed = target_time - system_state.patch_list[
-                            neighbour].perturbation_type_latest[perturbation_name]
-                    else:
-                        time_elapsed = contagion_cooldown + 1
-                    if time_elapsed > contagion_cooldown:
-                        if (np.random.binomial(n=1, p=contagion_probability) and neighbour not in
-                                contagion_patch_nums and neighbour not in current_patch_numbers):
-                            contagion_patch_nums.append(neighbour)
+                    if contagion_time_elapsed(perturbation_name, system_state.patch_list[neighbour],
+                                              target_time, contagion_cooldown) > contagion_cooldown:
+                        frontier_patch_nums.append(neighbour)
+            # a draw for every listed neighbour (as the draws are independent of each other), then ensure counted only
+            # once and cannot be in the current round of impacted patches
+            is_spread = np.random.binomial(n=1, p=contagion_probability, size=len(frontier_patch_nums))
+            for neighbour, spread in zip(frontier_patch_nums, is_spread.tolist()):
+                if spread and neighbour not in excluded_patch_nums:
+                    contagion_patch_nums.append(neighbour)
+                    excluded_patch_nums.add(neighbour)
 
     elif type(contagion_probability) == list and len(contagion_probability) == len(
             system_state.habitat_type_dictionary):
@@ -269,16 +277,13 @@ def contagion(perturbation_name, system_state, current_patch_numbers,
                 patch = system_state.patch_list[patch_num]
                 # find neighbours - ensure counted only once and cannot be in the current round of impacted patches
                 for neighbour in patch.set_of_adjacent_patches:
-                    if neighbour not in contagion_patch_nums and neighbour not in current_patch_numbers:
-                        if perturbation_name in system_state.patch_list[neighbour].perturbation_type_latest:
-                            time_elapsed = target_time - system_state.patch_list[
-                                neighbour].perturbation_type_latest[perturbation_name]
-                        else:
-                            time_elapsed = contagion_cooldown + 1
-                        if time_elapsed > contagion_cooldown:
+                    if neighbour not in excluded_patch_nums:
+                        if contagion_time_elapsed(perturbation_name, system_state.patch_list[neighbour],
+                                                  target_time, contagion_cooldown) > contagion_cooldown:
                             neighbour_habitat_num = system_state.patch_list[neighbour].habitat_type_num
                             if np.random.binomial(n=1, p=contagion_probability[neighbour_habitat_num]):
                                 contagion_patch_nums.append(neighbour)
+                                excluded_patch_nums.add(neighbour)
     else:
         raise Exception("Patch perturbation contagion_probability incorrectly specified.")
     # reporting
@@ -290,6 +295,14 @@ def contagion(perturbation_name, system_state, current_patch_numbers,
         return None
 
 
+def contagion_time_elapsed(perturbation_name, patch, target_time, contagion_cooldown):
+    # time from the latest perturbation of this name of the patch to the target time of the contagion
+    if perturbation_name in patch.perturbation_type_latest:
+        return target_time - patch.perturbation_type_latest[perturbation_name]
+    else:
+        return contagion_cooldown + 1
+
+
 
 #
 # ----------------------------------------- PERTURBATION TYPES: POPULATION ----------------------------------------- #
@@ -541,8 +554,8 @@ def patch_perturbation(
 
     # ------------- IMPLEMENTING THE PERTURBATION ------------- #
     #
-    # call the function
-    function_dictionary[perturbation_subtype](
+    # call the function, which returns the numbers of the patches whose values were genuinely changed
+    changed_patch_numbers = function_dictionary[perturbation_subtype](
         system_state=system_state,
         parameters=parameters,
         patches_to_change=patches_to_alter,
@@ -574,56 +587,126 @@ def patch_perturbation(
             # perturbation count is only non-restorations
             system_state.patch_list[patch_num].increment_perturbation_count()
 
+    # only the structures that depend upon the changed attribute need to be rebuilt, and only for the changed patches
+    if perturbation_subtype == "change_parameter":
+        changed_attribute = parameter_change_attr
+    else:
+        changed_attribute = SUBTYPE_CHANGED_ATTRIBUTE[perturbation_subtype]
+    dependencies = PATCH_ATTRIBUTE_DEPENDENCIES[changed_attribute]
+    reset_patch_numbers = changed_patch_numbers if "local_populations" in dependencies else set({})
+    repath_patch_numbers = changed_patch_numbers if "paths" in dependencies else set({})
+    if system_state.perturbation_transaction is None:
+        rebuild_perturbed_patches(system_state=system_state, parameters=parameters,
+                                  reset_patch_numbers=reset_patch_numbers, repath_patch_numbers=repath_patch_numbers,
+                                  rebuild_all_patches=rebuild_all_patches)
+    else:
+        # stage the rebuild until the perturbation transaction of this time-step is closed
+        system_state.perturbation_transaction["reset_patch_numbers"].update(reset_patch_numbers)
+        system_state.perturbation_transaction["repath_patch_numbers"].update(repath_patch_numbers)
+        if rebuild_all_patches:
+            system_state.perturbation_transaction["rebuild_all_patches"] = True
+    return altered_patch_numbers
+
+
+#
+# -------------------------------------------- PERTURBATION TRANSACTIONS -------------------------------------------- #
+#
+# Several perturbations may be enacted at the end of a single time-step (the species-induced removal, habitat, quality
+# and adjacency changes, and then the natural restoration). Each alters the patches immediately, but the rebuild of the
+# species paths, interacting populations and dispersal targets is only required once all have been applied. While a
+# transaction is open, patch perturbations stage the numbers of the patches that they changed, and closing it conducts
+# a single rebuild for the union of these patches.
+#
+# The mutable patch attribute changed by each patch perturbation subtype:
+SUBTYPE_CHANGED_ATTRIBUTE = {
+    "change_habitat": "habitat_type_num",
+    "remove_patch": "removal",
+    "change_adjacency": "adjacency",
+    # "change_parameter" changes its parameter_change_attr ("size" or "quality")
+}
+# The derived structures that depend upon each mutable patch attribute, and so must be rebuilt when it changes:
+# - "local_populations": the patch-dependent properties of its local populations (r_mod, carrying capacity, etc.),
+# - "paths": the species paths of the patches that may route through or reach it, and then the interacting
+#   populations and dispersal targets of all patches.
+PATCH_ATTRIBUTE_DEPENDENCIES = {
+    "quality": ["local_populations"],  # only enters the growth rate modifier, not the path costs or movement scores
+    "size": ["local_populations", "paths"],
+    "habitat_type_num": ["local_populations", "paths"],
+    "adjacency": ["paths"],
+    "removal": ["local_populations", "paths"],
+}
+
+
+def open_perturbation_transaction(system_state):
+    system_state.perturbation_transaction = {
+        "reset_patch_numbers": set({}),  # patches whose local population properties must be rebuilt
+        "repath_patch_numbers": set({}),  # patches whose changes require the paths to be rebuilt
+        "rebuild_all_patches": False,
+    }
+
+
+def close_perturbation_transaction(system_state, parameters):
+    transaction = system_state.perturbation_transaction
+    system_state.perturbation_transaction = None
+    if transaction is not None:
+        rebuild_perturbed_patches(system_state=system_state, parameters=parameters,
+                                  reset_patch_numbers=transaction["reset_patch_numbers"],
+                                  repath_patch_numbers=transaction["repath_patch_numbers"],
+                                  rebuild_all_patches=transaction["rebuild_all_patches"])
+
+
+def rebuild_perturbed_patches(system_state, parameters, reset_patch_numbers, repath_patch_numbers,
+                              rebuild_all_patches):
+    # after patch perturbation(s), rebuild the properties of the local populations of the reset patches, and if any
+    # patches require it, the species paths of all patches that may be affected by them and then the interacting
+    # populations and dispersal targets
+    #
     # pass only the non-duplicated, numbers of patches that have been changed, to rebuild purely internal properties
-    reset_local_population_attributes(patch_list=system_state.patch_list, altered_patch_numbers=altered_patch_numbers)
+    reset_local_population_attributes(patch_list=system_state.patch_list,
+                                      altered_patch_numbers=sorted(reset_patch_numbers))
+    if len(repath_patch_numbers) == 0:
+        return
+    altered_patch_numbers = sorted(repath_patch_numbers)
 
     # re-determining the species movement scores for both foraging and dispersal:
     if rebuild_all_patches:
         # (slow for large networks) rebuild for all patches rather than just the estimate of those closely impacted
         system_state.build_all_patches_species_paths_and_adjacency(parameters=parameters)
+        likely_affected_patches = None
     else:
         # start with the patches literally changed
-        likely_affected_patches = altered_patch_numbers
+        likely_affected_patches = set(altered_patch_numbers)
         # what patches had routes going through them?
+        altered_patch_set = set(altered_patch_numbers)
         for patch_to_check in system_state.patch_list:
-            for changed_patch_num in altered_patch_numbers:
-                if changed_patch_num in patch_to_check.stepping_stone_list:
-                    likely_affected_patches = list(set(likely_affected_patches + [patch_to_check.number]))
-        # now check those who are NOW (after the perturbation) the N-th degree neighbours (note that
-        # because the diagonal of the patch_adjacency_matrix are all 1, then an entry being non-zero indicates that
-        # we are identifying UP TO Nth Degree Neighbours (as we could also have an M < N degree neighbour, plus
-        # revisiting the same final node N-M times. So this does not tell us shortest paths but DOES identify the
-        # existence of any connections/reachability, as desired here.
+            if not altered_patch_set.isdisjoint(patch_to_check.stepping_stone_list):
+                likely_affected_patches.add(patch_to_check.number)
+        # now check those who are NOW (after the perturbation) within the same reach of the changed patches as the
+        # walks of up to 2^(N-1) steps previously identified by repeatedly squaring the N-th degree path matrix - found
+        # by a bounded breadth-first search from the changed patches, so in proportion to the perturbation's footprint.
+        # The changed patches include the former neighbours of removed patches and both ends of any altered links, so
+        # that patches reached only through links that have now been cut are also included.
         #
         # The point is that this catches anyone (anywhere) who MAY now have a route that uses this patch.
-        path_matrix = deepcopy(system_state.patch_adjacency_matrix)
-        for _ in range(parameters["main_para"]["ASSUMED_MAX_PATH_LENGTH"] - 1):
-            # matrix multiplication
-            path_matrix = np.matmul(path_matrix, path_matrix)
-            # this causes number of walks to grow exponentially so normalise - we only need to know when non-zero
-            for patch_x in range(len(system_state.patch_list)):
-                for patch_y in range(len(system_state.patch_list)):
-                    if path_matrix[patch_x, patch_y] != 0.0:
-                        path_matrix[patch_x, patch_y] = 1.0
-        # no point checking patch numbers we already consider affected
-        remaining_to_check = list(set([x for x in range(len(system_state.patch_list))]) - set(likely_affected_patches))
-        for patch_num_to_check in remaining_to_check:
-            for changed_patch_num in altered_patch_numbers:
-                if path_matrix[patch_num_to_check, changed_patch_num] > 0.0 \
-                        or path_matrix[changed_patch_num, patch_num_to_check] > 0.0:
-                    likely_affected_patches = list(set(likely_affected_patches + [patch_num_to_check]))
-        # pass list to rebuild function
+        hop_distance = system_state.patch_adjacency_matrix.hop_distances(
+            source_patch_nums=altered_patch_numbers,
+            max_hops=2 ** (parameters["main_para"]["ASSUMED_MAX_PATH_LENGTH"] - 1))
+        reaching_patches = set(np.flatnonzero(hop_distance >= 0).tolist())
+        likely_affected_patches = likely_affected_patches.union(reaching_patches)
+        # pass set to rebuild function
         system_state.build_all_patches_species_paths_and_adjacency(parameters=parameters,
                                                                    specified_patch_list=likely_affected_patches)
 
     is_nonlocal_foraging = parameters["pop_dyn_para"]["IS_NONLOCAL_FORAGING_PERMITTED"]
     is_local_foraging_ensured = parameters["pop_dyn_para"]["IS_LOCAL_FORAGING_ENSURED"]
+    # only the interactions and dispersal targets involving the repathed patches need to be rebuilt
     build_interacting_populations_list(
         patch_list=system_state.patch_list,
         species_list=system_state.species_set["list"],
         is_nonlocal_foraging=is_nonlocal_foraging,
         is_local_foraging_ensured=is_local_foraging_ensured,
         time=system_state.time,
+        specified_patch_list=likely_affected_patches,
     )
     is_dispersal = parameters["pop_dyn_para"]["IS_DISPERSAL_PERMITTED"]
     build_actual_dispersal_targets(
@@ -631,8 +714,8 @@ def patch_perturbation(
         species_list=system_state.species_set["list"],
         is_dispersal=is_dispersal,
         time=system_state.time,
+        specified_patch_list=likely_affected_patches,
     )
-    return altered_patch_numbers
 
 
 # ------------------------------------------- PATCH PERTURBATION SUBTYPES ------------------------------------------- #
@@ -652,6 +735,7 @@ def change_patch_to_habitat(system_state,
     # pass in a list of the numbers of the patches to change, and the habitats (as a name string) to change them to
     # remember that the patch numbers start at 0!
     habitat_types = parameters["main_para"]["HABITAT_TYPES"]
+    changed_patch_numbers = set({})
     if len(patches_to_change) != len(habitat_nums_to_change_to):
         raise "List of patches to alter is not the same length as the list of new habitats."
     else:
@@ -659,17 +743,22 @@ def change_patch_to_habitat(system_state,
             new_habitat_type_num = habitat_nums_to_change_to[num_in_temp_list]
             # count if it actually makes a difference
             if system_state.patch_list[patch_number].habitat_type_num != new_habitat_type_num:
+                changed_patch_numbers.add(patch_number)
                 if is_restoration:
                     system_state.patch_list[patch_number].increment_meaningful_restoration_count()
                 else:
                     system_state.patch_list[patch_number].increment_meaningful_perturbation_count()
+                old_habitat_type_num = system_state.patch_list[patch_number].habitat_type_num
                 system_state.patch_list[patch_number].habitat_type_num = new_habitat_type_num
                 system_state.patch_list[patch_number].habitat_type = habitat_types[new_habitat_type_num]
+                system_state.relabel_habitat_join_counts(patch_num=patch_number,
+                                                         old_habitat_type_num=old_habitat_type_num)
                 system_state.update_patch_habitat_based_properties(system_state.patch_list[patch_number])
                 # record history
                 system_state.patch_list[patch_number].habitat_history[system_state.step] = new_habitat_type_num
-    # record changes at a system_state level in the history
-    system_state.update_habitat_distributions_history()
+    # record changes at a system_state level in the history (join counts were updated incrementally above)
+    system_state.update_habitat_distributions_history(is_recount=False)
+    return changed_patch_numbers
 
 
 # Change patch floating point parameter value in range [0, 1] (quality or size)
@@ -684,6 +773,7 @@ def change_patch_parameter(system_state,
                            adjacency_change=None,
                            is_restoration=False,
                            ):
+    changed_patch_numbers = set({})
     if parameter_change_attr not in ["size", "quality"]:
         # ensure that either "size" or "quality" is specified:
         raise Exception(f"Perturbation parameter {parameter_change_attr} should be either 'size' or 'quality'.")
@@ -725,6 +815,7 @@ def change_patch_parameter(system_state,
                 system_state.patch_list[patch_number].quality_history[system_state.step] = new_parameter_value
             # record if real change
             if new_parameter_value != old_parameter_value:
+                changed_patch_numbers.add(patch_number)
                 if is_restoration:
                     system_state.patch_list[patch_number].increment_meaningful_restoration_count()
                 else:
@@ -734,6 +825,7 @@ def change_patch_parameter(system_state,
         system_state.update_size_history()
     elif parameter_change_attr == "quality":
         system_state.update_quality_history()
+    return changed_patch_numbers
 
 
 # Remove a patch
@@ -753,9 +845,18 @@ def remove_patch(system_state,
     # (a) it can be re-connected later,
     # (b) no need to resize the arrays,
     # (c) the patch numbers will remain constant in the patch_list. THIS IS ESSENTIAL!
+    #
+    # only sources within the centrality path length of a removed patch can have their harmonic centrality altered
+    centrality_affected_patches = system_state.find_centrality_affected_patches(
+        parameters=parameters, patch_nums=[x for x in patches_to_remove if system_state.is_current_patch(x)])
+    changed_patch_numbers = set({})
     for patch_number in patches_to_remove:
         # check not already "removed"
-        if patch_number not in system_state.current_patch_list:
+        if system_state.is_current_patch(patch_number):
+            changed_patch_numbers.add(patch_number)
+            # the former neighbours lose their links to this patch, so they must also be reset and repathed (and the
+            # search for other affected patches must start from them, as this patch will no longer reach any)
+            changed_patch_numbers.update(system_state.patch_adjacency_matrix.neighbours(patch_number))
             # count the change and proceed
             if is_restoration:
                 system_state.patch_list[patch_number].increment_meaningful_restoration_count()
@@ -765,8 +866,8 @@ def remove_patch(system_state,
             for local_population in system_state.patch_list[patch_number].local_populations.values():
                 local_population.population = 0.0
             for species_name in system_state.patch_list[patch_number].species_movement_scores:
-                system_state.patch_list[patch_number].species_movement_scores[species_name] = {
-                    x: {"best": (float('inf'), float('inf'), 0.0)} for x in range(len(system_state.patch_list))}
+                # no patch is reachable from here, so no travel costs are stored
+                system_state.patch_list[patch_number].species_movement_scores[species_name] = {}
 
             # set degree to zero and record new values
             system_state.patch_list[patch_number].degree = 0
@@ -774,39 +875,40 @@ def remove_patch(system_state,
 
             # set self-adjacency to zero, record history of set of adjacent patches to zero
             system_state.patch_adjacency_matrix[patch_number, patch_number] = 0
+            system_state.invalidate_neighbour_arrays(attribute_name="set_of_adjacent_patches")
             system_state.patch_list[patch_number].set_of_adjacent_patches = set({})
             system_state.patch_list[patch_number].set_of_adjacent_patches_history[system_state.step] = []
 
             # now look at other patches - need to set the corresponding row and column in the adjacency matrix to zero
             # and remove the patch number from the list of currently accessible patches:
-            for patch in system_state.patch_list:
+            for connected_patch_num in sorted(system_state.patch_adjacency_matrix.neighbours(patch_number)):
+                # Now look at all connected patches (but not the same patch again)
+                patch = system_state.patch_list[connected_patch_num]
                 if patch.number != patch_number:
-                    # Now look at all connected patches (but not the same patch again)
-                    if system_state.patch_adjacency_matrix[patch_number, patch.number] != 0.0 or \
-                            system_state.patch_adjacency_matrix[patch.number, patch_number] != 0.0:
-                        # record changes to degree
-                        patch.degree = max(0, patch.degree - 1)
-                        patch.degree_history[system_state.step] = patch.degree
-
-                        # record changes to sets of adjacent patches
-                        patch.set_of_adjacent_patches.remove(patch_number)  # not the list being iterated over
-                        patch.set_of_adjacent_patches_history[system_state.step] = list(patch.set_of_adjacent_patches)
-
-                        # record adjacency change and zero the corresponding patch adjacency matrix entries
-                        patch.adjacency_history_list.append([system_state.step, patch_number, 0])
-                        system_state.patch_list[patch_number].adjacency_history_list.append(
-                            [system_state.step, patch.number, 0])
-                        system_state.patch_adjacency_matrix[patch_number, patch.number] = 0
-                        system_state.patch_adjacency_matrix[patch.number, patch_number] = 0
+                    # record changes to degree
+                    patch.degree = max(0, patch.degree - 1)
+                    patch.degree_history[system_state.step] = patch.degree
+
+                    # record changes to sets of adjacent patches
+                    patch.set_of_adjacent_patches.remove(patch_number)  # not the list being iterated over
+                    patch.set_of_adjacent_patches_history[system_state.step] = list(patch.set_of_adjacent_patches)
+
+                    # record adjacency change and zero the corresponding patch adjacency matrix entries
+                    patch.adjacency_history_list.append([system_state.step, patch_number, 0])
+                    system_state.patch_list[patch_number].adjacency_history_list.append(
+                        [system_state.step, patch.number, 0])
+                    system_state.patch_adjacency_matrix[patch_number, patch.number] = 0
+                    system_state.patch_adjacency_matrix[patch.number, patch_number] = 0
 
             # only do this after reducing the degree of connected patches
-            system_state.current_patch_list.remove(patch_number)  # ok as iterating over "patches_to_remove", not this!
+            system_state.remove_current_patch(patch_num=patch_number)  # ok as iterating over "patches_to_remove"!
             system_state.patch_list[patch_number].removal_history[system_state.step] = 'removed'
-    # after removing a patch, update all patch centrality and record history of average properties for CURRENT patches
-    system_state.update_centrality_history(parameters=parameters)
+    # after removing a patch, update patch centrality and record history of average properties for CURRENT patches
+    system_state.update_centrality_history(parameters=parameters, affected_patch_nums=centrality_affected_patches)
     system_state.update_habitat_distributions_history()
     system_state.update_quality_history()
     system_state.update_degree_history()
+    return changed_patch_numbers
 
 
 # Add or remove corridors between specified patches
@@ -823,10 +925,19 @@ def change_patch_adjacency(system_state,
                            ):
     # patch_pairs_to_change should be a N-length list of 2x1 tuples containing the pairs of patches
     # adjacency_change should be a length N list of new adjacency values from the set {0,1}
+    changed_patch_numbers = set({})
     if len(patch_pairs_to_change) != len(adjacency_change):
         raise "List of patch pairs to alter is not the same length as the list of adjacency alterations."
     else:
+        # sources within the centrality path length of an altered pair, before or after the change, may be affected
+        altered_patch_nums = list(set([x[0] for x in patch_pairs_to_change] + [x[1] for x in patch_pairs_to_change]))
+        centrality_affected_patches = system_state.find_centrality_affected_patches(
+            parameters=parameters, patch_nums=altered_patch_nums)
+        system_state.invalidate_neighbour_arrays(attribute_name="set_of_adjacent_patches")
         for pair_num, pair in enumerate(patch_pairs_to_change):
+            if not (system_state.is_current_patch(pair[0]) and system_state.is_current_patch(pair[1])):
+                # removed patches are no longer adjacent to any, and are not re-connected as they are not current
+                continue
             # store previous values
             old_adjacency = [deepcopy(system_state.patch_adjacency_matrix[pair[0], pair[1]]),
                              deepcopy(system_state.patch_adjacency_matrix[pair[1], pair[0]])]
@@ -870,6 +981,7 @@ def change_patch_adjacency(system_state,
             # check actual change has occurred
             if old_adjacency[0] != system_state.patch_adjacency_matrix[pair[0], pair[1]] or \
                     old_adjacency[1] != system_state.patch_adjacency_matrix[pair[1], pair[0]]:
+                changed_patch_numbers.update([pair[0], pair[1]])
                 if is_restoration:
                     system_state.patch_list[pair[0]].increment_meaningful_restoration_count()
                     system_state.patch_list[pair[1]].increment_meaningful_restoration_count()
@@ -877,11 +989,13 @@ def change_patch_adjacency(system_state,
                     system_state.patch_list[pair[0]].increment_meaningful_perturbation_count()
                     system_state.patch_list[pair[1]].increment_meaningful_perturbation_count()
 
-    # after an adjacency change, update all patch centrality and habitat spatial auto-correlation
-    system_state.calculate_all_patches_centrality(parameters=parameters)
-    system_state.update_centrality_history(parameters=parameters)
+    # after an adjacency change, update patch centrality and habitat spatial auto-correlation
+    centrality_affected_patches = centrality_affected_patches.union(system_state.find_centrality_affected_patches(
+        parameters=parameters, patch_nums=altered_patch_nums))
+    system_state.update_centrality_history(parameters=parameters, affected_patch_nums=centrality_affected_patches)
     system_state.update_habitat_distributions_history()
     system_state.update_degree_history()
+    return changed_patch_numbers
 
 
 #
@@ -925,69 +1039,37 @@ def perturbation_patch_selection(system_state,
     # this function generates the list of patches to perturb in either a patch or population perturbation,
     # unless a specific priority set of patch numbers was passed in which case this function will not have been called.
 
-    eligible_patch_nums = system_state.current_patch_list
+    eligible_patch_nums = list(system_state.current_patch_list)  # a copy, as patches may be removed from this list
 
     if not is_reserves_overwrite:
         # we DO remove the reserves from final consideration
         set_of_reserve_patches = set([reserve for cluster in system_state.reserve_list for reserve in cluster])
         eligible_patch_nums = list(set(eligible_patch_nums) - set_of_reserve_patches)
 
-    # {0, 1, 2, 3} - (hard-permitted) PROXIMITY TO PREVIOUS PERTURBATION:
-    # [0 = can choose same, 1 = can be adj, 2 = not adj, 3 = cannot be adj to a patch adj to a previous choice]
+    # {0, 1, 2, 3, ...} - (hard-permitted) PROXIMITY TO PREVIOUS PERTURBATION:
+    # [0 = can choose same, 1 = can be adj, 2 = not adj, 3 = cannot be adj to a patch adj to a previous choice, ...]
+    # i.e. the least number of links from the most recently-perturbed patches, where any intermediate patches
+    # (stepping stones) must be current, found for all patches at once by a bounded breadth-first search.
     #
     # remove patches adjacent to prior clusters if necessary
     # Note that this does not apply in cases of removed patches - as they are now considered no longer adjacent to any!
     if len(system_state.perturbation_history) > 0 and proximity_to_previous > 0:
-        eligible_patch_nums_copy = deepcopy(eligible_patch_nums)
-        # need to use a copy as removing from the same list while iterating over it does not behave properly!
-        most_recently_perturbed_patch_nums = list(set([
+        most_recently_perturbed_patch_nums = set([
             patch_num for cluster in system_state.perturbation_history[
-                max(system_state.perturbation_history)] for patch_num in cluster]))
-
-        for patch_num in list(eligible_patch_nums_copy):  # create a DUMMY LIST to iterate over - removing elements!
-            keep_checking = True
-            for prev_patch in most_recently_perturbed_patch_nums:
-                if not keep_checking:
-                    # this is needed for the case of proximity_to_previous > 2 as there is a nested loop to escape
-                    break
-                if patch_num == prev_patch:
-                    # remove patches that were in previous choices
-                    eligible_patch_nums.remove(patch_num)
-                    break
-                # Check if ONE stepping stone required and applies here:
-                if proximity_to_previous > 1:
-                    # remove patches adjacent to those present in previous waves
-                    if system_state.patch_adjacency_matrix[prev_patch, patch_num] \
-                            > 0 or system_state.patch_adjacency_matrix[patch_num, prev_patch] > 0:
-                        eligible_patch_nums.remove(patch_num)
-                        break
-                # THEN (not "else") check if TWO stepping stones are required and applies here:
-                if proximity_to_previous > 2:
-                    # remove other patches adjacent to those adjacent to those present in previous waves
-                    for intermediate_patch_num in system_state.current_patch_list:
-                        if intermediate_patch_num != patch_num:
-                            if (system_state.patch_adjacency_matrix[prev_patch, intermediate_patch_num] > 0 or
-                                system_state.patch_adjacency_matrix[intermediate_patch_num, prev_patch] > 0) and \
-                                    (system_state.patch_adjacency_matrix[patch_num, intermediate_patch_num] > 0 or
-                                     system_state.patch_adjacency_matrix[intermediate_patch_num, patch_num] > 0):
-                                eligible_patch_nums.remove(patch_num)
-                                keep_checking = False
-                                break
-        del eligible_patch_nums_copy  # clear this variable as no longer required
+                max(system_state.perturbation_history)] for patch_num in cluster])
+        is_current = np.zeros(len(system_state.patch_list), dtype=bool)
+        is_current[list(system_state.current_patch_list)] = True
+        hop_distance = system_state.patch_adjacency_matrix.hop_distances(
+            source_patch_nums=most_recently_perturbed_patch_nums, max_hops=proximity_to_previous - 1,
+            is_intermediate_permitted=is_current)
+        is_too_close = hop_distance >= 0
+        eligible_patch_nums = [x for x in eligible_patch_nums if not is_too_close[x]]
 
     # Weighting the probability distribution of the eligible choices:
     if len(system_state.perturbation_history) > 0 and (prev_weighting is not None or all_weighting is not None):
         most_recently_perturbed_patch_nums = list(set([
             patch_num for cluster in system_state.perturbation_history[
                 max(system_state.perturbation_history)] for patch_num in cluster]))
-        base_weighting_auto = {}
-        base_weighting_history = {}
-        base_weighting_auto_sum = 0.0
-        base_weighting_history_sum = 0.0
-        max_distance = 0.0
-        min_distance = 999999999999999.0
-        max_num_perturbation = 0
-        min_num_perturbation = 999999999999999.0
         # prev_weighting: auto-correlation of perturbation events in space to MOST-RECENT previous ones
         # if +1 then 0% (in isolation from all_weighting) to choose a patch of minimal overall distance from most
         # recently-perturbed patches;
@@ -997,52 +1079,41 @@ def perturbation_patch_selection(system_state,
         # they accumulate or spread out?
         # if +1 then 0% (in isolation from prev_weighting) to choose least-perturbed patch,
         # if -1 then 0% to choose a most-perturbed patch
-        for patch_num in eligible_patch_nums:
-            weighted_distance = 0.0
-            for prev_patch_num in most_recently_perturbed_patch_nums:
-                weighted_distance += np.linalg.norm(
-                    system_state.patch_list[patch_num].position - system_state.patch_list[prev_patch_num].position)
-            min_distance = min(min_distance, weighted_distance)
-            max_distance = max(max_distance, weighted_distance)
-            base_weighting_auto[patch_num] = weighted_distance
-            max_num_perturbation = max(max_num_perturbation, system_state.patch_list[patch_num].num_times_perturbed)
-            min_num_perturbation = min(min_num_perturbation, system_state.patch_list[patch_num].num_times_perturbed)
-            base_weighting_history[patch_num] = system_state.patch_list[patch_num].num_times_perturbed
-
-        for patch_num in eligible_patch_nums:
-            # prev
-            if prev_weighting is not None and len(prev_weighting) > 0:
-                new_amount = weighting_amount_calc(max_val=max_distance, min_val=min_distance,
-                                                   actual_val=base_weighting_auto[patch_num], weighting=prev_weighting)
-            else:
-                new_amount = 0.0
-            base_weighting_auto[patch_num] = new_amount
-            base_weighting_auto_sum += new_amount
-            # all
-            if all_weighting is not None and len(all_weighting) > 0:
-                new_amount = weighting_amount_calc(max_val=max_num_perturbation, min_val=min_num_perturbation,
-                                                   actual_val=base_weighting_history[patch_num],
-                                                   weighting=all_weighting)
-            else:
-                new_amount = 0.0
-            base_weighting_history[patch_num] = new_amount
-            base_weighting_history_sum += new_amount
+        if prev_weighting is not None and len(prev_weighting) > 0:
+            summed_distances = system_state.spatial_index.summed_distances(
+                patch_nums=eligible_patch_nums, reference_patch_nums=most_recently_perturbed_patch_nums)
+            base_weighting_auto = weighting_amount_calc(
+                max_val=np.max(summed_distances, initial=0.0),
+                min_val=np.min(summed_distances, initial=999999999999999.0),
+                actual_val=summed_distances, weighting=prev_weighting)
+        else:
+            base_weighting_auto = np.zeros(len(eligible_patch_nums))
+        if all_weighting is not None and len(all_weighting) > 0:
+            num_times_perturbed = np.asarray([system_state.patch_list[x].num_times_perturbed
+                                              for x in eligible_patch_nums], dtype=int)
+            base_weighting_history = weighting_amount_calc(
+                max_val=np.max(num_times_perturbed, initial=0),
+                min_val=np.min(num_times_perturbed, initial=999999999999999),
+                actual_val=num_times_perturbed, weighting=all_weighting)
+        else:
+            base_weighting_history = np.zeros(len(eligible_patch_nums))
+        # sequential sums (rather than numpy's pairwise summation)
+        base_weighting_auto_sum = sum(base_weighting_auto.tolist(), 0.0)
+        base_weighting_history_sum = sum(base_weighting_history.tolist(), 0.0)
     else:
-        base_weighting_auto = {x: 1 for x in eligible_patch_nums}
+        base_weighting_auto = np.ones(len(eligible_patch_nums))
         base_weighting_auto_sum = max(1.0, len(eligible_patch_nums))
-        base_weighting_history = {x: 1 for x in eligible_patch_nums}
+        base_weighting_history = np.ones(len(eligible_patch_nums))
         base_weighting_history_sum = max(1.0, len(eligible_patch_nums))
 
     # update combined weightings to obtain final weighting which gets passed to the 'draw'
-    final_weighting = {}
-    for patch_num in eligible_patch_nums:
-        final_value_holder = 0.0
-        if prev_weighting is not None and len(prev_weighting) > 0 and base_weighting_auto_sum > 0.0:
-            # for the weighting lists, the first entry is their relative importance (to each other!)
-            final_value_holder += prev_weighting[0] * base_weighting_auto[patch_num] / base_weighting_auto_sum
-        if all_weighting is not None and len(all_weighting) > 0 and base_weighting_history_sum > 0.0:
-            final_value_holder += all_weighting[0] * base_weighting_history[patch_num] / base_weighting_history_sum
-        final_weighting[patch_num] = final_value_holder
+    final_weighting_array = np.zeros(len(eligible_patch_nums))
+    if prev_weighting is not None and len(prev_weighting) > 0 and base_weighting_auto_sum > 0.0:
+        # for the weighting lists, the first entry is their relative importance (to each other!)
+        final_weighting_array += prev_weighting[0] * base_weighting_auto / base_weighting_auto_sum
+    if all_weighting is not None and len(all_weighting) > 0 and base_weighting_history_sum > 0.0:
+        final_weighting_array += all_weighting[0] * base_weighting_history / base_weighting_history_sum
+    final_weighting = dict(zip(eligible_patch_nums, final_weighting_array.tolist()))
 
     perturbation_list = cluster_builder(system_state=system_state,
                                         cluster_spec=patches_affected,
@@ -1069,11 +1140,16 @@ def weighting_amount_calc(max_val, min_val, actual_val, weighting: list):
     # - Quadratic increase from (0,0) to (1,1): [0, 2, 0]
     # - Quadratic decrease from (1,1) to (0,0): [1, 2, 0]
     #
+    # The actual values are passed as an array, and the array of amounts is returned. Note that the power is taken
+    # element-by-element, as the vectorised power can differ from the scalar power in the last bit.
+    #
+    actual_val = np.asarray(actual_val)
     if max_val - min_val > 0.0:
         normalised_val = (actual_val - min_val) / (max_val - min_val)
-        new_amount = np.abs(weighting[1] - normalised_val) ** weighting[2] + weighting[3]
+        base_amount = np.abs(weighting[1] - normalised_val)
+        new_amount = np.asarray([x ** weighting[2] for x in base_amount], dtype=float) + weighting[3]
     else:
-        new_amount = 1.0
+        new_amount = np.ones(len(actual_val))
     return new_amount
 
 
@@ -1083,6 +1159,7 @@ def cluster_builder(system_state, cluster_spec, eligible_patch_nums, clusters_mu
     # This is used both by perturbation_patch_selection() AND by reserve_construction()
     #
     cluster_list = []
+    prior_cluster_neighbours = set()
     for cluster_num, cluster in enumerate(cluster_spec):
         current_cluster = []
 
@@ -1099,42 +1176,45 @@ def cluster_builder(system_state, cluster_spec, eligible_patch_nums, clusters_mu
 
             # remove patches adjacent to prior clusters if necessary (i.e. separation of 2 steps - one stepping stone!)
             if cluster_num > 0 and clusters_must_be_separated:
-                actual_patch_nums_copy = deepcopy(actual_patch_nums)
-                # need to use a copy as removing from the same list while iterating over it does not behave properly!
-                current_patches = list(set([patch for cluster in cluster_list for patch in cluster]))
-                for patch_num in actual_patch_nums_copy:
-                    for prev_patch in current_patches:
-                        if system_state.patch_adjacency_matrix[prev_patch, patch_num] \
-                                > 0 or system_state.patch_adjacency_matrix[patch_num, prev_patch] > 0:
-                            actual_patch_nums.remove(patch_num)
-                            break
-                del actual_patch_nums_copy  # clear this variable as no longer required
+                actual_patch_nums = [x for x in actual_patch_nums if x not in prior_cluster_neighbours]
+
+            # the frontier holds the remaining choices, and the boundary of the cluster as it is grown
+            cluster_frontier = Cluster_frontier(adjacency_matrix=system_state.patch_adjacency_matrix,
+                                                candidate_patch_nums=actual_patch_nums,
+                                                cluster_arch_type=cluster["arch_type"],
+                                                patch_list=system_state.patch_list,
+                                                spatial_index=system_state.spatial_index)
 
             # now choose the first reserve patch in this cluster
             type_patch_nums = initial_cluster_choice(system_state=system_state,
-                                                     actual_patch_nums=actual_patch_nums,
+                                                     actual_patch_nums=cluster_frontier.remaining_candidates(),
                                                      cluster_initial=cluster["initial"])
 
             # draw one if possible
-            draw_num = int(cluster_draw(type_patch_nums, actual_patch_nums, probability=probability_weighting))
-            current_cluster.append(draw_num)
-            actual_patch_nums.remove(draw_num)
+            draw_num = int(cluster_draw(type_patch_nums, cluster_frontier.remaining_candidates(),
+                                        probability=probability_weighting))
+            cluster_frontier.add_member(draw_num)
 
             # Now generate the rest of the cluster
             if cluster["num_patches"] >= 2:
                 for next_reserve in range(cluster["num_patches"] - 1):
-                    type_patch_nums = cluster_next_element(adjacency_matrix=system_state.patch_adjacency_matrix,
-                                                           patch_list=system_state.patch_list,
-                                                           actual_patch_nums=actual_patch_nums,
-                                                           current_cluster=current_cluster,
-                                                           cluster_arch_type=cluster["arch_type"])
+                    type_patch_nums = cluster_frontier.next_element_choices()
 
-                    # draw one if possible
-                    draw_num = int(cluster_draw(type_patch_nums, actual_patch_nums, probability=probability_weighting))
-                    current_cluster.append(draw_num)
-                    actual_patch_nums.remove(draw_num)
+                    # draw one if possible - the remaining candidates are only needed (and so compacted) if there
+                    # are no choices of the desired type
+                    if len(type_patch_nums) > 0:
+                        fallback_patch_nums = []
+                    else:
+                        fallback_patch_nums = cluster_frontier.remaining_candidates()
+                    draw_num = int(cluster_draw(type_patch_nums, fallback_patch_nums,
+                                                probability=probability_weighting))
+                    cluster_frontier.add_member(draw_num)
+            current_cluster = cluster_frontier.current_cluster
 
         cluster_list = cluster_list + [current_cluster]
+        if clusters_must_be_separated:
+            for patch_num in current_cluster:
+                prior_cluster_neighbours.update(system_state.patch_adjacency_matrix.neighbour_array(patch_num).tolist())
     return cluster_list
 
 
@@ -2,6 +2,10 @@ import copy
 import random
 import numpy as np
 
+# travel costs of a patch that cannot be reached - the infinite cost gives zero score whatever the target search cost
+UNREACHED_MOVEMENT_SCORES = {"routes": {"best": (float('inf'), float('inf'), 0.0, [])},
+                             "target_patch_size": 0.0, "target_patch_traversal": 1.0}
+
 
 def reset_temp_values(patch_list):
     # reset all movement and feeding values
@@ -288,6 +292,12 @@ def pre_dispersal_of_local_population(
                 local_pop.leaving_array[patch_to_num])
 
 
+def movement_scores_to(patch, species_name, patch_to_num):
+    # The potential travel costs are only stored for the patches actually reached when the paths were built (in
+    # system_state.build_species_paths_and_adjacency()), so any other patch is returned as unreachable at infinite cost.
+    return patch.species_movement_scores[species_name].get(patch_to_num, UNREACHED_MOVEMENT_SCORES)
+
+
 def find_best_actual_scores(local_pop, target, query_attr, max_path_attr, mobility_scaling_attr,
                             heaviside_threshold_attr, is_heaviside_manual, heaviside_manual_value,
                             home_patch_traversal_score):
@@ -337,9 +347,11 @@ def find_best_actual_scores(local_pop, target, query_attr, max_path_attr, mobili
     return score, path_length
 
 
-def build_actual_dispersal_targets(patch_list, species_list, is_dispersal, time):
+def build_actual_dispersal_targets(patch_list, species_list, is_dispersal, time, specified_patch_list=None):
     # Determine a dictionary of which locations can ACTUALLY be reached and with what movement score, given
-    # the current dispersal mobility score, minimum link strength, and path length restriction
+    # the current dispersal mobility score, minimum link strength, and path length restriction.
+    # The targets of each local population depend only upon the paths of its own patch, so if specified_patch_list is
+    # given (e.g. those patches repathed after a perturbation) then only the local populations of these are rebuilt.
     if is_dispersal:
 
         # initialise if running for the first time
@@ -360,6 +372,8 @@ def build_actual_dispersal_targets(patch_list, species_list, is_dispersal, time)
                 species.current_coefficients_lists = temporal_function(
                     species.dispersal_para, 'COEFFICIENTS_LISTS', None, time)
         for patch in patch_list:
+            if specified_patch_list is not None and patch.number not in specified_patch_list:
+                continue
             for local_pop in patch.local_populations.values():
                 # reset them
                 local_pop.actual_dispersal_targets = {}
@@ -375,7 +389,8 @@ def build_actual_dispersal_targets(patch_list, species_list, is_dispersal, time)
                         # don't include same patch
                         if reachable_patch_num != patch.number:
 
-                            z = patch.species_movement_scores[local_pop.name][reachable_patch_num]
+                            z = movement_scores_to(patch=patch, species_name=local_pop.name,
+                                                   patch_to_num=reachable_patch_num)
                             target_score, unused_path_length = find_best_actual_scores(
                                 local_pop=local_pop,
                                 target=z,
@@ -395,10 +410,14 @@ def build_actual_dispersal_targets(patch_list, species_list, is_dispersal, time)
                 local_pop.actual_dispersal_targets = temp_dict
 
 
-def build_interacting_populations_list(patch_list, species_list, is_nonlocal_foraging, is_local_foraging_ensured, time):
+def build_interacting_populations_list(patch_list, species_list, is_nonlocal_foraging, is_local_foraging_ensured, time,
+                                       specified_patch_list=None):
     # this function should NOT be only looking at non-zero population sizes, as the list will not be rebuilt
     # if they are populated at a later time. It also involves the within-patch predator-prey interactions, so
     # do NOT skip this method if is_nonlocal_foraging is false
+    #
+    # If specified_patch_list is given (e.g. those patches repathed after a perturbation), then only the interactions
+    # involving the local populations of these patches are rebuilt - see rebuild_specified_interactions().
 
     # initialise if running for the first time
     for species in species_list:
@@ -420,6 +439,12 @@ def build_interacting_populations_list(patch_list, species_list, is_nonlocal_for
                 species.predation_para, "PREDATION_FOCUS", None, time)
             species.current_predation_rate = temporal_function(species.predation_para, "PREDATION_RATE", None, time)
 
+    if specified_patch_list is not None:
+        rebuild_specified_interactions(patch_list=patch_list, specified_patch_list=specified_patch_list,
+                                       is_nonlocal_foraging=is_nonlocal_foraging,
+                                       is_local_foraging_ensured=is_local_foraging_ensured)
+        return
+
     # reset interacting population lists
     for patch in patch_list:
         for local_pop in patch.local_populations.values():
@@ -427,20 +452,8 @@ def build_interacting_populations_list(patch_list, species_list, is_nonlocal_for
     # Build list of dictionaries of all the populations that each population can interact with (in either way)
     for patch in patch_list:
         for local_pop in patch.local_populations.values():
-            this_patch_species_traversal = patch.this_habitat_species_traversal[local_pop.species.name]
-            this_patch_species_feeding = patch.this_habitat_species_feeding[local_pop.species.name]
-
             # store home range score for this local population
-            if is_local_foraging_ensured:
-                # with this global option set to true, within-patch feeding is always set to 1.0 for any species
-                local_pop.home_range_score = 1.0
-            else:
-                # normally, within-patch search score is species_mu * this_habitat_traversal / patch.size
-                if local_pop.species.current_foraging_mobility is None:
-                    local_pop.home_range_score = None
-                else:
-                    local_pop.home_range_score = (local_pop.species.current_foraging_mobility *
-                                                  this_patch_species_traversal / patch.size)
+            set_home_range_score(local_pop=local_pop, patch=patch, is_local_foraging_ensured=is_local_foraging_ensured)
 
             # now loop over all possible target patches
             for patch_to_num in patch.adjacency_lists[local_pop.name]:
@@ -453,89 +466,240 @@ def build_interacting_populations_list(patch_list, species_list, is_nonlocal_for
                         # we need to include both, as there may be a local population who can reach but cannot be
                         # reached, and we need to note them as interacting with the other the adjacency lists may not
                         # be symmetric, so it is insufficient to just have one of these
-
-                        # now account for species-specific limitations and foraging path length limits
-                        local_pop_score = 0.0
-                        local_pop_to_score = 0.0
-                        patch_to_species_traversal = patch_to.this_habitat_species_traversal[local_pop_to.species.name]
-                        patch_to_species_feeding = patch_to.this_habitat_species_feeding[local_pop_to.species.name]
-
-                        path_to_length = 0
-                        path_from_length = 0
-                        if patch_to_num == patch.number:
-                            # for WITHIN-PATCH FEEDING:
-                            if is_local_foraging_ensured:
-                                local_pop_score = 1.0
-                                local_pop_to_score = 1.0
-                            else:
-                                local_pop_score = local_pop.home_range_score
-                                # and for the other population to reach this one:
-                                if local_pop_to.species.current_foraging_mobility is None:
-                                    local_pop_to_score = None
-                                else:
-                                    local_pop_to_score = (local_pop_to.species.current_foraging_mobility *
-                                                          patch_to_species_traversal / patch.size)
-                        else:
-                            if local_pop.species.is_nonlocal_foraging:
-                                # score dictionary for THIS species' local population to THAT patch
-                                z = patch.species_movement_scores[local_pop.name][patch_to_num]
-                                local_pop_score, path_to_length = find_best_actual_scores(
-                                    local_pop=local_pop, target=z,
-                                    query_attr="is_foraging_path_restricted",
-                                    max_path_attr="current_max_foraging_path_length",
-                                    mobility_scaling_attr="current_foraging_mobility",
-                                    is_heaviside_manual=False,
-                                    heaviside_manual_value=None,
-                                    heaviside_threshold_attr="current_foraging_kappa",
-                                    home_patch_traversal_score=this_patch_species_traversal,
-                                )
-                                if local_pop_score < local_pop.species.current_minimum_link_strength_foraging:
-                                    local_pop_score = 0.0
-
-                            if local_pop_to.species.is_nonlocal_foraging:
-                                # score dictionary for THAT species' local population to THIS patch
-                                z = patch_to.species_movement_scores[local_pop_to.name][patch.number]
-                                local_pop_to_score, path_from_length = find_best_actual_scores(
-                                    local_pop=local_pop_to, target=z,
-                                    query_attr="is_foraging_path_restricted",
-                                    max_path_attr="current_max_foraging_path_length",
-                                    mobility_scaling_attr="current_foraging_mobility",
-                                    is_heaviside_manual=False,
-                                    heaviside_manual_value=None,
-                                    heaviside_threshold_attr="current_foraging_kappa",
-                                    home_patch_traversal_score=patch_to_species_traversal,
-                                )
-                                if local_pop_to_score < local_pop_to.species.current_minimum_link_strength_foraging:
-                                    local_pop_to_score = 0.0
-
-                        # Only actual interactions (at least one-way) get added to the list, and only if the in-patch
-                        # feeding score of that species was non-zero
-                        if (local_pop_score != 0.0 and this_patch_species_feeding > 0.0) or \
-                                (local_pop_to_score != 0.0 and patch_to_species_feeding > 0.0):
-                            local_pop.interacting_populations.append({"object": local_pop_to,
-                                                                      "score_to": local_pop_score,
-                                                                      "score_from": local_pop_to_score,
-                                                                      "is_same_patch": patch_to_num == patch.number,
-                                                                      "path_to_length": path_to_length,
-                                                                      "path_from_length": path_from_length,
-                                                                      })
-                            local_pop_to.interacting_populations.append({"object": local_pop,
-                                                                         "score_to": local_pop_to_score,
-                                                                         "score_from": local_pop_score,
-                                                                         "is_same_patch": patch_to_num == patch.number,
-                                                                         "path_to_length": path_from_length,
-                                                                         "path_from_length": path_to_length,
-                                                                         })
+                        entries = interaction_entries(local_pop=local_pop, patch=patch, local_pop_to=local_pop_to,
+                                                      patch_to=patch_to,
+                                                      is_local_foraging_ensured=is_local_foraging_ensured)
+                        if entries is not None:
+                            local_pop.interacting_populations.append(entries[0])
+                            local_pop_to.interacting_populations.append(entries[1])
 
     # check that there are no duplicates - this will be caused by two populations who CAN both reach each other,
     # and this leads to inconsistencies in the predation calculations
     for patch in patch_list:
         for local_pop in patch.local_populations.values():
-            temp_list = []
+            local_pop.interacting_populations = unique_interactions(local_pop.interacting_populations)
+
+
+def set_home_range_score(local_pop, patch, is_local_foraging_ensured):
+    if is_local_foraging_ensured:
+        # with this global option set to true, within-patch feeding is always set to 1.0 for any species
+        local_pop.home_range_score = 1.0
+    else:
+        # normally, within-patch search score is species_mu * this_habitat_traversal / patch.size
+        if local_pop.species.current_foraging_mobility is None:
+            local_pop.home_range_score = None
+        else:
+            local_pop.home_range_score = (local_pop.species.current_foraging_mobility *
+                                          patch.this_habitat_species_traversal[local_pop.species.name] / patch.size)
+
+
+def interaction_entries(local_pop, patch, local_pop_to, patch_to, is_local_foraging_ensured):
+    # For a local population and one in a patch that it can reach, returns the pair of entries for their respective
+    # interacting populations lists, or None if they do not interact.
+    this_patch_species_traversal = patch.this_habitat_species_traversal[local_pop.species.name]
+    this_patch_species_feeding = patch.this_habitat_species_feeding[local_pop.species.name]
+
+    # now account for species-specific limitations and foraging path length limits
+    local_pop_score = 0.0
+    local_pop_to_score = 0.0
+    patch_to_species_traversal = patch_to.this_habitat_species_traversal[local_pop_to.species.name]
+    patch_to_species_feeding = patch_to.this_habitat_species_feeding[local_pop_to.species.name]
+
+    path_to_length = 0
+    path_from_length = 0
+    if patch_to.number == patch.number:
+        # for WITHIN-PATCH FEEDING:
+        if is_local_foraging_ensured:
+            local_pop_score = 1.0
+            local_pop_to_score = 1.0
+        else:
+            local_pop_score = local_pop.home_range_score
+            # and for the other population to reach this one:
+            if local_pop_to.species.current_foraging_mobility is None:
+                local_pop_to_score = None
+            else:
+                local_pop_to_score = (local_pop_to.species.current_foraging_mobility *
+                                      patch_to_species_traversal / patch.size)
+    else:
+        if local_pop.species.is_nonlocal_foraging:
+            # score dictionary for THIS species' local population to THAT patch
+            z = movement_scores_to(patch=patch, species_name=local_pop.name, patch_to_num=patch_to.number)
+            local_pop_score, path_to_length = find_best_actual_scores(
+                local_pop=local_pop, target=z,
+                query_attr="is_foraging_path_restricted",
+                max_path_attr="current_max_foraging_path_length",
+                mobility_scaling_attr="current_foraging_mobility",
+                is_heaviside_manual=False,
+                heaviside_manual_value=None,
+                heaviside_threshold_attr="current_foraging_kappa",
+                home_patch_traversal_score=this_patch_species_traversal,
+            )
+            if local_pop_score < local_pop.species.current_minimum_link_strength_foraging:
+                local_pop_score = 0.0
+
+        if local_pop_to.species.is_nonlocal_foraging:
+            # score dictionary for THAT species' local population to THIS patch
+            z = movement_scores_to(patch=patch_to, species_name=local_pop_to.name, patch_to_num=patch.number)
+            local_pop_to_score, path_from_length = find_best_actual_scores(
+                local_pop=local_pop_to, target=z,
+                query_attr="is_foraging_path_restricted",
+                max_path_attr="current_max_foraging_path_length",
+                mobility_scaling_attr="current_foraging_mobility",
+                is_heaviside_manual=False,
+                heaviside_manual_value=None,
+                heaviside_threshold_attr="current_foraging_kappa",
+                home_patch_traversal_score=patch_to_species_traversal,
+            )
+            if local_pop_to_score < local_pop_to.species.current_minimum_link_strength_foraging:
+                local_pop_to_score = 0.0
+
+    # Only actual interactions (at least one-way) get added to the list, and only if the in-patch
+    # feeding score of that species was non-zero
+    if (local_pop_score != 0.0 and this_patch_species_feeding > 0.0) or \
+            (local_pop_to_score != 0.0 and patch_to_species_feeding > 0.0):
+        return ({"object": local_pop_to,
+                 "score_to": local_pop_score,
+                 "score_from": local_pop_to_score,
+                 "is_same_patch": patch_to.number == patch.number,
+                 "path_to_length": path_to_length,
+                 "path_from_length": path_from_length,
+                 },
+                {"object": local_pop,
+                 "score_to": local_pop_to_score,
+                 "score_from": local_pop_score,
+                 "is_same_patch": patch_to.number == patch.number,
+                 "path_to_length": path_from_length,
+                 "path_from_length": path_to_length,
+                 })
+    return None
+
+
+def rebuild_specified_interactions(patch_list, specified_patch_list, is_nonlocal_foraging, is_local_foraging_ensured):
+    # Rebuild the interacting populations lists after the paths of the specified patches have been rebuilt, such that
+    # the lists are identical to those of the full build_interacting_populations_list().
+    #
+    # In the full build, the entries of each list are appended in the order of the "event" that generated them, which
+    # is (source patch, position of the local population in it, position of the target patch in its adjacency list,
+    # position of the target local population in that patch), and any duplicates are then removed. Here only the
+    # events with a specified source or target patch are recalculated - the latter are found from the reverse index of
+    # the adjacency lists, so no other patch is searched. Only the lists of the local populations that had or now have
+    # an interaction with a specified patch are changed: their other entries are kept, and merged with the new entries
+    # in the order of their events.
+    specified_patch_nums = set(specified_patch_list)
+    population_positions = {}  # id(local population): (patch number, position in the patch), filled as required
+
+    # the lists to be merged are those of the local populations of the specified patches, and of all of those which
+    # previously interacted with them (as the lists are symmetric)
+    merge_pops = {}  # id(local population): local population
+    for patch_num in specified_patch_nums:
+        for local_pop in patch_list[patch_num].local_populations.values():
+            merge_pops[id(local_pop)] = local_pop
             for x in local_pop.interacting_populations:
-                if x not in temp_list:
-                    temp_list.append(x)
-            local_pop.interacting_populations = temp_list
+                merge_pops[id(x["object"])] = x["object"]
+
+    # recalculate the events involving the specified patches - firstly those from a specified source patch
+    new_entries = {}  # id(local population): list of (event, entry)
+    for patch_num in specified_patch_nums:
+        patch = patch_list[patch_num]
+        for pop_position, local_pop in enumerate(patch.local_populations.values()):
+            set_home_range_score(local_pop=local_pop, patch=patch,
+                                 is_local_foraging_ensured=is_local_foraging_ensured)
+            for target_position, patch_to_num in enumerate(patch.adjacency_lists[local_pop.name]):
+                if is_nonlocal_foraging or patch_to_num == patch.number:
+                    add_interaction_events(local_pop=local_pop, patch=patch, patch_to=patch_list[patch_to_num],
+                                           event_prefix=(patch.number, pop_position, target_position),
+                                           new_entries=new_entries, merge_pops=merge_pops,
+                                           is_local_foraging_ensured=is_local_foraging_ensured)
+    # and then those from the other patches that can reach a specified patch (so only if non-local foraging)
+    if is_nonlocal_foraging:
+        for patch_to_num in specified_patch_nums:
+            patch_to = patch_list[patch_to_num]
+            for species_name, source_positions in patch_to.reverse_adjacency_lists.items():
+                for patch_num, target_position in source_positions.items():
+                    if patch_num not in specified_patch_nums:
+                        patch = patch_list[patch_num]
+                        local_pop = patch.local_populations[species_name]
+                        pop_position = population_position(local_pop=local_pop, patch_list=patch_list,
+                                                           population_positions=population_positions)[1]
+                        add_interaction_events(local_pop=local_pop, patch=patch, patch_to=patch_to,
+                                               event_prefix=(patch.number, pop_position, target_position),
+                                               new_entries=new_entries, merge_pops=merge_pops,
+                                               is_local_foraging_ensured=is_local_foraging_ensured)
+
+    # merge with the kept entries of each list
+    for local_pop in merge_pops.values():
+        if local_pop.patch_num in specified_patch_nums:
+            kept_entries = []
+        else:
+            kept_entries = [x for x in local_pop.interacting_populations
+                            if x["object"].patch_num not in specified_patch_nums]
+        event_entries = []
+        num_previous_entries = {}
+        for entry in kept_entries:
+            # the first entry for another population is from the earliest of the (up to two) events between
+            # them, and any second (non-duplicate) entry is from the later event
+            events = interaction_events(local_pop=local_pop, local_pop_to=entry["object"], patch_list=patch_list,
+                                        population_positions=population_positions,
+                                        is_nonlocal_foraging=is_nonlocal_foraging)
+            num_previous = num_previous_entries.get(id(entry["object"]), 0)
+            num_previous_entries[id(entry["object"])] = num_previous + 1
+            event_entries.append((events[min(num_previous, len(events) - 1)], entry))
+        event_entries.extend(new_entries.get(id(local_pop), []))
+        event_entries.sort(key=lambda x: x[0])
+        local_pop.interacting_populations = unique_interactions([x for _, x in event_entries])
+
+
+def add_interaction_events(local_pop, patch, patch_to, event_prefix, new_entries, merge_pops,
+                           is_local_foraging_ensured):
+    # record the entries (if any) from the event of the local population reaching each of those in the target patch
+    for pop_to_position, local_pop_to in enumerate(patch_to.local_populations.values()):
+        entries = interaction_entries(local_pop=local_pop, patch=patch, local_pop_to=local_pop_to, patch_to=patch_to,
+                                      is_local_foraging_ensured=is_local_foraging_ensured)
+        if entries is not None:
+            event = event_prefix + (pop_to_position,)
+            new_entries.setdefault(id(local_pop), []).append((event, entries[0]))
+            new_entries.setdefault(id(local_pop_to), []).append((event, entries[1]))
+            merge_pops[id(local_pop)] = local_pop
+            merge_pops[id(local_pop_to)] = local_pop_to
+
+
+def unique_interactions(interacting_populations):
+    # Remove any duplicates, keeping the first of each. These are caused by two populations who CAN both reach each
+    # other, and lead to inconsistencies in the predation calculations.
+    unique_list = []
+    entry_keys = set()
+    for x in interacting_populations:
+        entry_key = (id(x["object"]), x["score_to"], x["score_from"], x["is_same_patch"], x["path_to_length"],
+                     x["path_from_length"])
+        if entry_key not in entry_keys:
+            entry_keys.add(entry_key)
+            unique_list.append(x)
+    return unique_list
+
+
+def population_position(local_pop, patch_list, population_positions):
+    # (patch number, position in the patch) of the local population - recorded for all of its patch when first needed
+    if id(local_pop) not in population_positions:
+        for pop_position, patch_pop in enumerate(patch_list[local_pop.patch_num].local_populations.values()):
+            population_positions[id(patch_pop)] = (local_pop.patch_num, pop_position)
+    return population_positions[id(local_pop)]
+
+
+def interaction_events(local_pop, local_pop_to, patch_list, population_positions, is_nonlocal_foraging):
+    # the sorted list of the events (with either as the source) that would generate an interaction between the two
+    events = []
+    for source_pop, target_pop in [(local_pop, local_pop_to), (local_pop_to, local_pop)]:
+        source_patch_num, source_position = population_position(local_pop=source_pop, patch_list=patch_list,
+                                                                population_positions=population_positions)
+        target_patch_num, target_position = population_position(local_pop=target_pop, patch_list=patch_list,
+                                                                population_positions=population_positions)
+        if is_nonlocal_foraging or source_patch_num == target_patch_num:
+            # the position of the target patch in the adjacency list of the source, if it is included
+            list_position = patch_list[target_patch_num].reverse_adjacency_lists.get(
+                source_pop.name, {}).get(source_patch_num)
+            if list_position is not None:
+                events.append((source_patch_num, source_position, list_position, target_position))
+    return sorted(events)
 
 
 def checker(output_attribute, input_temporal, is_change):
@@ -0,0 +1,74 @@
+from source_code.system_state_functions import complexity_scaling_vector_analysis, run_parallel_tasks
+from copy import deepcopy
+import numpy as np
+
+
+class Power_law_fitter:
+    # Conducts the power law fits (via complexity_scaling_vector_analysis()) to the complexity vectors of each
+    # sub-network in complexity_analysis(), which is repeated every time that the distance metrics are recorded.
+    #
+    # - The results are cached by the input vectors and the initial guess of the dual fit, so that unchanged vectors
+    #   (e.g. of a meta-community which has not changed since the previous analysis) fitted from the same starting
+    #   point are not fitted again, and results are identical to fitting without the cache. At most max_cached_fits
+    #   results are held, and the oldest are discarded first.
+    # - The dual power law fit for each fit key (identifying the analysis, sub-network and complexity type) is started
+    #   from the previous successful dual fit for the same key, as the complexity of a sub-network tends to change
+    #   gradually between analyses.
+    # - Given their initial guesses, the fits of a batch are independent, so can be conducted in a pool of processes
+    #   with results identical to serial execution.
+
+    def __init__(self, max_cached_fits=1024):
+        self.max_cached_fits = max_cached_fits
+        self.fit_cache = {}
+        self.previous_dual_para = {}
+
+    @staticmethod
+    def cache_key(x_val, y_val, dual_initial_guess):
+        # the fit found depends on the initial guess as well as on the vectors
+        x_val = np.asarray(x_val, dtype=float)
+        y_val = np.asarray(y_val, dtype=float)
+        if dual_initial_guess is not None:
+            dual_initial_guess = np.asarray(dual_initial_guess, dtype=float).tobytes()
+        return len(x_val), x_val.tobytes(), y_val.tobytes(), dual_initial_guess
+
+    def fit_batch(self, fit_tasks, num_processes=1):
+        # fit_tasks is a list of (fit_key, x_val, y_val), and the list of the results of
+        # complexity_scaling_vector_analysis() is returned in the same order
+        results = [None for _ in fit_tasks]
+        pending_indices = []
+        pending_cache_keys = []
+        pending_kwargs_list = []
+        for task_index, (fit_key, x_val, y_val) in enumerate(fit_tasks):
+            dual_initial_guess = self.previous_dual_para.get(fit_key)
+            cache_key = self.cache_key(x_val, y_val, dual_initial_guess)
+            if cache_key in self.fit_cache:
+                # copy so that the reports of different analyses do not share nested objects
+                results[task_index] = deepcopy(self.fit_cache[cache_key])
+            else:
+                pending_indices.append(task_index)
+                pending_cache_keys.append(cache_key)
+                pending_kwargs_list.append({
+                    "x_val": x_val,
+                    "y_val": y_val,
+                    "dual_initial_guess": dual_initial_guess,
+                })
+
+        if num_processes > 1 and len(pending_kwargs_list) > 1:
+            pending_results = run_parallel_tasks(task_function=complexity_scaling_vector_analysis,
+                                                 task_kwargs_list=pending_kwargs_list, num_processes=num_processes)
+        else:
+            pending_results = [complexity_scaling_vector_analysis(**task_kwargs)
+                               for task_kwargs in pending_kwargs_list]
+
+        for task_index, cache_key, result in zip(pending_indices, pending_cache_keys, pending_results):
+            if len(self.fit_cache) >= self.max_cached_fits:
+                del self.fit_cache[next(iter(self.fit_cache))]
+            self.fit_cache[cache_key] = deepcopy(result)
+            results[task_index] = result
+
+        # record the successful dual fits as the initial guesses for the next analysis
+        for (fit_key, _, _), result in zip(fit_tasks, results):
+            graphical_results = result[1]
+            if graphical_results.get("is_dual_fit_success", 0):
+                self.previous_dual_para[fit_key] = np.array(graphical_results["dual_para"], dtype=float)
+        return results
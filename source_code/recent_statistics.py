@@ -0,0 +1,79 @@
+from source_code.running_statistics import Running_statistics
+import numpy as np
+
+
+class Recent_statistics:
+    # Online accumulation of the statistics of a local population over the record window at the end of the simulation,
+    # so that these can be finalised by build_recent_time_averages_batch() without the full histories. Each record of
+    # the histories (the initial record is number 0) is passed to update() as it is made.
+    #
+    # The windows are the same as those of the post hoc calculation, where the final step is current_step:
+    # - the averages (and the st. dev. of the population) are over records [current_step - back_steps, current_step).
+    # - the maximum deviation, occupancy changes and source/sink are over records (current_step - back_steps,
+    #   current_step].
+    # The sums are accumulated sequentially, so these may differ from the post hoc values by rounding.
+
+    def __init__(self, current_step, back_steps, minimum_population_size):
+        self.average_window = (current_step - back_steps, current_step)
+        self.variation_window = (current_step - back_steps + 1, current_step + 1)
+        self.minimum_population_size = minimum_population_size
+        # average window
+        self.population_statistics = Running_statistics()
+        self.sum_population = 0.0
+        self.sum_internal_change = 0.0
+        self.sum_population_leave = 0.0
+        self.sum_population_enter = 0.0
+        self.sum_net_enter = 0.0
+        self.sum_abs_internal_change = 0.0
+        self.sum_abs_net_enter = 0.0
+        # variation window
+        self.max_population = None
+        self.min_population = None
+        self.previous_population = None
+        self.num_occupancy_changes = 0
+        self.sum_sink_change = 0.0
+        self.sum_source_change = 0.0
+        self.is_zero_potential_dispersal = False
+
+    def update(self, record_number, population, internal_change, population_enter, population_leave,
+               potential_dispersal):
+        if self.average_window[0] <= record_number < self.average_window[1]:
+            self.population_statistics.update(population)
+            self.sum_population += population
+            self.sum_internal_change += internal_change
+            self.sum_population_leave += population_leave
+            self.sum_population_enter += population_enter
+            self.sum_net_enter += population_enter - population_leave
+            self.sum_abs_internal_change += np.abs(internal_change)
+            self.sum_abs_net_enter += np.abs(population_enter - population_leave)
+
+        if self.variation_window[0] <= record_number < self.variation_window[1]:
+            if self.max_population is None:
+                self.max_population = population
+                self.min_population = population
+            else:
+                self.max_population = max(self.max_population, population)
+                self.min_population = min(self.min_population, population)
+                # did the occupancy change?
+                min_pop = self.minimum_population_size
+                if (self.previous_population < min_pop <= population) or (
+                        self.previous_population >= min_pop > population):
+                    self.num_occupancy_changes += 1
+            self.previous_population = population
+            # sink and source
+            positive_change = max(0.0, population_enter - population_leave) + max(0.0, internal_change)
+            if positive_change > 0.0:
+                self.sum_sink_change += max(0.0, population_enter - population_leave) / positive_change
+            if potential_dispersal == 0.0:
+                self.is_zero_potential_dispersal = True
+            else:
+                self.sum_source_change += max(0.0, population_leave - population_enter) / potential_dispersal
+
+    def st_dev_population(self):
+        return np.sqrt(self.population_statistics.variance(ddof=0))
+
+    def max_abs_population(self, average_population):
+        # greatest absolute deviation of the population from the given average
+        if self.max_population is None:
+            return 0.0
+        return max(np.abs(self.max_population - average_population), np.abs(self.min_population - average_population))
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class Running_statistics:
+    # Running (online) mean and variance of a stream of samples by Welford's method, so that the precision of an
+    # estimate can be checked after every new sample without storing or re-summing the samples. Used to stop drawing
+    # samples once the mean has converged, e.g. in the adaptive sampling of complexity_analysis() and of the SAR.
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sum_squared_deviation = 0.0
+
+    def update(self, value):
+        self.count += 1
+        deviation = value - self.mean
+        self.mean += deviation / self.count
+        self.sum_squared_deviation += deviation * (value - self.mean)
+
+    def variance(self, ddof=1):
+        # unbiased sample variance by default, or the population variance (as np.var) if ddof=0
+        if self.count <= max(ddof, 0):
+            return 0.0
+        return self.sum_squared_deviation / (self.count - ddof)
+
+    def standard_error(self):
+        if self.count < 2:
+            return float('inf')
+        return np.sqrt(self.variance() / self.count)
+
+    def relative_ci_width(self, z_score=1.96):
+        # half-width of the (default 95%) confidence interval of the mean, relative to the magnitude of the mean
+        if self.count < 2:
+            return float('inf')
+        half_width = z_score * self.standard_error()
+        if half_width == 0.0:
+            return 0.0
+        elif self.mean == 0.0:
+            return float('inf')
+        return half_width / np.abs(self.mean)
+
+    def is_converged(self, relative_ci_width, min_samples):
+        return self.count >= max(2, min_samples) and self.relative_ci_width() <= relative_ci_width
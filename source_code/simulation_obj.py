@@ -4,7 +4,9 @@ from source_code.data_manager import (save_all_data, generate_simulation_number,
 from source_code.data_core_functions import create_adjacency_path_list
 from sample_spatial_data import run_sample_spatial_data
 from source_code.patch import Patch
-from source_code.local_population import Local_population
+from source_code.patch_adjacency import Patch_adjacency, load_patch_adjacency
+from source_code.local_population import Local_population, build_recent_time_averages_batch
+from source_code.hurst_functions import hurst_exponents
 from source_code.species import Species
 from source_code.population_dynamics import *
 from source_code.system_state import System_state
@@ -55,6 +57,8 @@ class Simulation_obj:
         dir_path = f'spatial_data_files/test_{test_set}/'
         # first, check that all .CSV files are present and strip any trailing commas!
         habitat_type_dictionary = self.parameters["main_para"]["HABITAT_TYPES"]
+        # (defaults to sparse for the parameters of simulations saved before this option existed)
+        is_dense_adjacency = self.parameters["main_para"].get("IS_DENSE_ADJACENCY", False)
         try:
             for filename in os.listdir(dir_path):
                 filepath = dir_path + filename
@@ -75,7 +79,8 @@ class Simulation_obj:
             patch_quality_array = load_dataset(f'{dir_path}/patch_quality.csv', force_dimension=1)
             patch_size_array = load_dataset(f'{dir_path}/patch_size.csv', force_dimension=1)
             patch_position_array = load_dataset(f'{dir_path}/patch_position.csv')
-            patch_adjacency_array = load_dataset(f'{dir_path}/patch_adjacency.csv')
+            patch_adjacency_matrix = load_patch_adjacency(f'{dir_path}/patch_adjacency.csv',
+                                                          is_dense=is_dense_adjacency)
             clique_membership = load_dataset(f'{dir_path}/clique_membership.csv')
 
             # A test set has been successfully loaded - but we must check that it is suitable for this parameter setup.
@@ -98,6 +103,10 @@ class Simulation_obj:
             patch_quality_array = np.ndarray.flatten(patch_quality_array)
             patch_size_array = np.ndarray.flatten(patch_size_array)
             patch_habitat_type_array = np.ndarray.flatten(patch_habitat_type_array)
+            if np.ndim(patch_adjacency_array) < 2:
+                patch_adjacency_array = np.array([[patch_adjacency_array, 0.0], [0.0, 0.0]])
+            patch_adjacency_matrix = Patch_adjacency(adjacency_array=patch_adjacency_array,
+                                                     is_dense=is_dense_adjacency)
 
         # If there is only one patch and/or habitat, extend the arrays so they can be correctly sliced in the call
         if np.ndim(patch_position_array) == 1:
@@ -116,8 +125,6 @@ class Simulation_obj:
             habitat_species_traversal_array = np.array([[habitat_species_traversal_array, 0.0], [0.0, 0.0]])
         elif np.ndim(habitat_species_traversal_array) == 1:
             habitat_species_traversal_array = np.array([habitat_species_traversal_array, [0.0, 0.0]])
-        if np.ndim(patch_adjacency_array) < 2:
-            patch_adjacency_array = np.array([[patch_adjacency_array, 0.0], [0.0, 0.0]])
         # Record the maximum x and y values in the spatial network:
         dimensions = np.max(patch_position_array, axis=0)
 
@@ -189,7 +196,7 @@ class Simulation_obj:
         system_state = System_state(patch_list=patch_list,
                                     species_set=species_set,
                                     step=0,
-                                    patch_adjacency_matrix=patch_adjacency_array,
+                                    patch_adjacency_matrix=patch_adjacency_matrix,
                                     habitat_type_dictionary=habitat_type_dictionary,
                                     habitat_species_traversal=habitat_species_traversal_array,
                                     habitat_species_feeding=habitat_species_feeding_array,
@@ -210,6 +217,8 @@ class Simulation_obj:
             try:
                 load_adj_variables(patch_list=self.system_state.patch_list,
                                    spatial_set_number=self.parameters["graph_para"]["SPATIAL_TEST_SET"])
+                for patch in self.system_state.patch_list:
+                    self.system_state.update_reverse_adjacency_lists(patch=patch, is_add=True)
                 is_generate_fresh = False
                 print("Successfully loaded pre-existing adjacency variables.")
             except (FileNotFoundError, json.decoder.JSONDecodeError):
@@ -376,6 +385,12 @@ class Simulation_obj:
                                current_patch_list=self.system_state.current_patch_list,
                                is_ode_recordings=self.parameters["plot_save_para"]["IS_ODE_RECORDINGS"],
                                )
+            if self.parameters["main_para"].get("IS_DEBUG_CHECK_REMOVED_PATCHES", False):
+                self.system_state.check_removed_patches_unpopulated()
+
+            # the end-of-step perturbations are applied together, with a single rebuild of the paths, interactions and
+            # dispersal targets when the transaction is closed
+            open_perturbation_transaction(system_state=self.system_state)
 
             # ---- Check for species-induced perturbations ---- #
             if self.parameters["pop_dyn_para"]["IS_SPECIES_PERTURBS_ENVIRONMENT"]:
@@ -385,6 +400,8 @@ class Simulation_obj:
             if self.parameters["graph_para"]["IS_ENVIRONMENT_NATURAL_RESTORATION"]:
                 self.environment_natural_restoration()
 
+            close_perturbation_transaction(system_state=self.system_state, parameters=self.parameters)
+
             # ---- Update the history of the number of available patches and biodiversity every time-step ---- #
             self.system_state.update_current_patch_history()
             self.system_state.update_biodiversity_history()
@@ -410,32 +427,32 @@ class Simulation_obj:
         # FINAL CALCULATIONS FOR THE LOCAL_POPULATION OBJECTS
         #
         # normalise average populations
-        for patch in self.system_state.patch_list:
-            for local_population in patch.local_populations.values():
-
-                # build averages from recent histories - note that if there are M = M1 + M2 total steps, then the
-                # population history indexes are from 0 to M-1, thus the "final step" (in terms of
-                # history list indices) should be M-1:
-                local_population.build_recent_time_averages(current_step=self.total_steps - 1,
-                                                            back_steps=self.parameters["main_para"]["NUM_RECORD_STEPS"])
-
-                if self.parameters["main_para"]["IS_CALCULATE_HURST"]:
-                    import hurst
-                    import warnings
-                    warnings.filterwarnings(action='error',
-                                            category=RuntimeWarning)
-                    # this is used because of Hurst Exp throwing warnings, even for parts of the code not being
-                    # executed because of the failure (constant time-series not suitable for Hurst).
-                    # warnings.resetwarnings()  - you will need to run this if Warnings break the program!
-                    # Calculate Hurst Exponent of each local population history time-series:
-                    try:
-                        local_population.population_history_hurst_exponent = hurst.compute_Hc(
-                            series=local_population.population_history,
-                            kind="random_walk", simplified=True)
-                    except (RuntimeWarning, ValueError):
-                        local_population.population_history_hurst_exponent = None
-
-                # ??? Correlation dimension here ???
+        #
+        # build averages from recent histories (for all local populations together) - note that if there are
+        # M = M1 + M2 total steps, then the population history indexes are from 0 to M-1, thus the "final step" (in
+        # terms of history list indices) should be M-1:
+        all_local_populations = [local_population for patch in self.system_state.patch_list
+                                 for local_population in patch.local_populations.values()]
+        build_recent_time_averages_batch(
+            local_populations=all_local_populations,
+            current_step=self.total_steps - 1, back_steps=self.parameters["main_para"]["NUM_RECORD_STEPS"])
+
+        if self.parameters["main_para"]["IS_CALCULATE_HURST"]:
+            # Calculate Hurst Exponent of each local population history time-series (all together, and possibly in a
+            # pool of processes). Series unsuitable for Hurst (e.g. too short or constant) have None and the reason.
+            hurst_results = hurst_exponents(series_list=[x.population_history for x in all_local_populations],
+                                            num_processes=self.parameters["main_para"].get("HURST_NUM_PROCESSES", 1))
+            num_failures = 0
+            for local_population, (hurst_result, hurst_failure) in zip(all_local_populations, hurst_results):
+                local_population.population_history_hurst_exponent = hurst_result
+                local_population.population_history_hurst_failure = hurst_failure
+                if hurst_failure is not None:
+                    num_failures += 1
+            if num_failures > 0:
+                print(f"Hurst exponent could not be calculated for {num_failures} of {len(all_local_populations)} "
+                      f"local populations.")
+
+        # ??? Correlation dimension here ???
 
         # ??? Calculate Hurst Exponent of the global and average local diversity time-series:
 
@@ -509,150 +526,140 @@ class Simulation_obj:
                          )
 
     def species_induced_perturbations(self):
+        patch_list = self.system_state.patch_list
+        neighbour_arrays = {}  # (attribute name, is_exclude_self): CSR arrays, as cached by the system state
+        # the events of all species, in the order that they are drawn
+        removal_patches = []
+        habitat_patches = []
+        habitat_values = []
+        quality_patches = []
+        quality_values = []
+        adjacency_pairs = []
+        adjacency_values = []
         perturbation_has_occurred = False
-        # reset
-        self.system_state.perturbation_holding = {"remove": set({}),  # set of removed patches
-                                                  "habitat_change": {},  # dictionary of patch: list habitat changes
-                                                  "adjacency_change": {},  # dictionary of pair: list of adj changes
-                                                  "quality_change": {},  # dict of patch: sum value quality changes
-                                                  }
+
         for species in self.system_state.species_set["list"]:
             if species.is_perturbs_environment:
                 perturbation_para = species.perturbation_para["PERTURBATION"]
                 is_adjacency_pert = perturbation_para["IS_ADJACENCY_CHANGE"]
                 # if there needs to be a possibility of making new connections, we draw against all (x,y)-neighbours.
-                is_inc_adjacency_pert = (perturbation_para["ABSOLUTE_ADJACENCY_CHANGE"] > 0.0)
+                is_inc_adjacency_pert = is_adjacency_pert and (perturbation_para["ABSOLUTE_ADJACENCY_CHANGE"] > 0.0)
                 is_patch_pert = perturbation_para["IS_REMOVAL"] or perturbation_para[
                     "IS_HABITAT_TYPE_CHANGE"] or perturbation_para["IS_QUALITY_CHANGE"]
+                if not (is_patch_pert or is_adjacency_pert):
+                    continue
+
+                # the neighbour arrays required by this species
+                required_arrays = []
+                if "adjacent" in species.perturbation_para["TO_IMPACT"]:
+                    required_arrays.append(("set_of_adjacent_patches", False))
+                if "xy-adjacent" in species.perturbation_para["TO_IMPACT"]:
+                    required_arrays.append(("set_of_xy_adjacent_patches", False))
+                if is_adjacency_pert:
+                    if is_inc_adjacency_pert:
+                        link_arrays_key = ("set_of_xy_adjacent_patches", True)
+                    else:
+                        link_arrays_key = ("set_of_adjacent_patches", True)
+                    required_arrays.append(link_arrays_key)
+                else:
+                    link_arrays_key = None
+                for arrays_key in required_arrays:
+                    if arrays_key not in neighbour_arrays:
+                        neighbour_arrays[arrays_key] = self.system_state.neighbour_arrays(
+                            attribute_name=arrays_key[0], is_exclude_self=arrays_key[1])
+
+                draws = species_perturbation_draws(species=species, patch_list=patch_list,
+                                                   neighbour_arrays=neighbour_arrays, is_patch_pert=is_patch_pert,
+                                                   link_arrays_key=link_arrays_key)
+                if draws is None:
+                    continue
+                perturbed_patches, perturbed_pairs = draws
+                if len(perturbed_patches) + len(perturbed_pairs) > 0:
+                    perturbation_has_occurred = True
+                if len(perturbed_patches) > 0:
+                    if perturbation_para["IS_REMOVAL"]:
+                        # removal overwrites all other effects, simply record all patches to remove
+                        removal_patches.append(perturbed_patches)
+                    else:
+                        if perturbation_para["IS_HABITAT_TYPE_CHANGE"]:
+                            # record all habitat types to change each patch to (will choose one at random)
+                            habitat_patches.append(perturbed_patches)
+                            habitat_values.extend([perturbation_para["HABITAT_TYPE_NUM_TO_CHANGE_TO"]
+                                                   for _ in range(len(perturbed_patches))])
+                        if perturbation_para["IS_QUALITY_CHANGE"]:
+                            # sum all the relative quality changes for each patch
+                            quality_patches.append(perturbed_patches)
+                            quality_values.append(np.full(len(perturbed_patches),
+                                                          perturbation_para["RELATIVE_QUALITY_CHANGE"], dtype=float))
+                if len(perturbed_pairs) > 0:
+                    # {0, 1} adjacency changes for each (lower, higher) patch pair (will check if mean >= 0.5)
+                    adjacency_pairs.append(perturbed_pairs)
+                    adjacency_values.append(np.full(len(perturbed_pairs),
+                                                    perturbation_para["ABSOLUTE_ADJACENCY_CHANGE"], dtype=float))
 
-                for patch in self.system_state.patch_list:
-                    for local_pop in patch.local_populations.values():
-                        if local_pop.species == species:
-                            # enact for this local population
-                            if "same" in species.perturbation_para["TO_IMPACT"]:
-                                patch_num = patch.number
-                                if is_patch_pert and draw_perturbation(local_pop=local_pop, patch_relation="SAME"):
-                                    # draw once for this patch for within-patch properties
-                                    perturbation_has_occurred = True
-                                    self.record_perturbation(patch_num=patch_num, perturbation_para=perturbation_para)
-                                if is_adjacency_pert:
-                                    if is_inc_adjacency_pert:
-                                        list_to_check = patch.set_of_xy_adjacent_patches
-                                    else:
-                                        list_to_check = patch.set_of_adjacent_patches
-                                    # draw separately for every individual link between this patch and neighbours
-                                    for other_patch_num in list_to_check:
-                                        if other_patch_num != patch_num:
-                                            if draw_perturbation(local_pop=local_pop, patch_relation="SAME"):
-                                                perturbation_has_occurred = True
-                                                self.record_adj_perturbation(patch_nums=[patch_num, other_patch_num],
-                                                                             perturbation_para=perturbation_para)
-                            # enact for any directly connected patches to this one
-                            if "adjacent" in species.perturbation_para["TO_IMPACT"]:
-                                for patch_num in patch.set_of_adjacent_patches:
-                                    if is_patch_pert and draw_perturbation(local_pop=local_pop,
-                                                                           patch_relation="ADJACENT"):
-                                        perturbation_has_occurred = True
-                                        self.record_perturbation(patch_num=patch_num,
-                                                                 perturbation_para=perturbation_para)
-                                    if is_adjacency_pert:
-                                        if is_inc_adjacency_pert:
-                                            list_to_check = self.system_state.patch_list[
-                                                patch_num].set_of_xy_adjacent_patches
-                                        else:
-                                            list_to_check = self.system_state.patch_list[
-                                                patch_num].set_of_adjacent_patches
-                                        for other_patch_num in list_to_check:
-                                            if other_patch_num != patch_num:
-                                                # now look at patches connected to this neighbour (inc the original)
-                                                if draw_perturbation(local_pop=local_pop, patch_relation="ADJACENT"):
-                                                    perturbation_has_occurred = True
-                                                    self.record_adj_perturbation(
-                                                        patch_nums=[patch_num, other_patch_num],
-                                                        perturbation_para=perturbation_para)
-                            # enact for any patches with distance exactly 1.0 to this patch
-                            if "xy-adjacent" in species.perturbation_para["TO_IMPACT"]:
-                                for patch_num in patch.set_of_xy_adjacent_patches:
-                                    if is_patch_pert and draw_perturbation(local_pop=local_pop,
-                                                                           patch_relation="XY_ADJACENT"):
-                                        perturbation_has_occurred = True
-                                        self.record_perturbation(patch_num=patch_num,
-                                                                 perturbation_para=perturbation_para)
-                                    if is_adjacency_pert:
-                                        if is_inc_adjacency_pert:
-                                            list_to_check = self.system_state.patch_list[
-                                                patch_num].set_of_xy_adjacent_patches
-                                        else:
-                                            list_to_check = self.system_state.patch_list[
-                                                patch_num].set_of_adjacent_patches
-                                        for other_patch_num in list_to_check:
-                                            if other_patch_num != patch_num:
-                                                # now look at patches directly connected to this xy-neighbour
-                                                if draw_perturbation(local_pop=local_pop, patch_relation="XY_ADJACENT"):
-                                                    perturbation_has_occurred = True
-                                                    self.record_adj_perturbation(
-                                                        patch_nums=[patch_num, other_patch_num],
-                                                        perturbation_para=perturbation_para)
         if perturbation_has_occurred:
             # resolve final outcomes and implement them with the (up to four) patch perturbations
-            if len(self.system_state.perturbation_holding["remove"]) != 0:
+            if len(removal_patches) != 0:
                 # removal first as a single perturbation
                 perturbation(system_state=self.system_state, parameters=self.parameters,
                              pert_paras={
                                  "perturbation_type": "patch_perturbation",
-                                 "perturbation_subtype": "patch_removal",
-                                 "patch_list_overwrite": self.system_state.perturbation_holding["remove"],
+                                 "perturbation_subtype": "remove_patch",
+                                 "patch_list_overwrite": first_occurrence_groups(
+                                     np.concatenate(removal_patches))[1].tolist(),
                              },
                              perturbation_name="species_induced_patch_removal",
                              )
             # for habitat change
-            if len(self.system_state.perturbation_holding["habitat_change"]) != 0:
-                final_patch_num_list = []  # build this simultaneously to ensure ordering preserved
-                final_habitat_change_list = []
-                for patch_num in self.system_state.perturbation_holding["habitat_change"]:
-                    final_patch_num_list.append(patch_num)
-                    final_habitat_change_list.append(random.choice(
-                        self.system_state.perturbation_holding["habitat_change"][patch_num]))
-                perturbation(system_state=self.system_state, parameters=self.parameters,
-                             pert_paras={
-                                 "perturbation_type": "patch_perturbation",
-                                 "perturbation_subtype": "change_habitat",
-                                 "patch_list_overwrite": final_patch_num_list,
-                                 "habitat_nums_to_change_to": final_habitat_change_list,
-                             },
-                             perturbation_name="species_induced_habitat_change",
-                             )
+            if len(habitat_patches) != 0:
+                # the patches are ordered by their first event, and the habitat type chosen at random from their events
+                group_index, final_patch_nums = first_occurrence_groups(np.concatenate(habitat_patches))
+                group_members = np.split(np.argsort(group_index, kind="stable"),
+                                         np.cumsum(np.bincount(group_index))[:-1])
+                final_habitat_change_list = [random.choice([habitat_values[x] for x in members])
+                                             for members in group_members]
+                # patches removed above are not changed further (filtered after the draws, so that these are unchanged)
+                is_current = self.system_state.current_patch_mask[final_patch_nums]
+                final_patch_nums = final_patch_nums[is_current]
+                final_habitat_change_list = [x for x, y in zip(final_habitat_change_list, is_current) if y]
+                if len(final_patch_nums) != 0:
+                    perturbation(system_state=self.system_state, parameters=self.parameters,
+                                 pert_paras={
+                                     "perturbation_type": "patch_perturbation",
+                                     "perturbation_subtype": "change_habitat",
+                                     "patch_list_overwrite": final_patch_nums.tolist(),
+                                     "habitat_nums_to_change_to": final_habitat_change_list,
+                                 },
+                                 perturbation_name="species_induced_habitat_change",
+                                 )
             # for quality change
-            if len(self.system_state.perturbation_holding["quality_change"]) != 0:
-                final_patch_num_list = []  # build this simultaneously to ensure ordering preserved
-                final_quality_change_list = []
-                for patch_num in self.system_state.perturbation_holding["quality_change"]:
-                    final_patch_num_list.append(patch_num)
-                    final_quality_change_list.append(self.system_state.perturbation_holding[
-                                                         "quality_change"][patch_num])
-                perturbation(system_state=self.system_state, parameters=self.parameters,
-                             pert_paras={
-                                 "perturbation_type": "patch_perturbation",
-                                 "perturbation_subtype": "change_quality",
-                                 "patch_list_overwrite": final_patch_num_list,
-                                 "quality_change": final_quality_change_list,
-                                 "is_absolute": False,
-                                 "is_relative_add": True,
-                             },
-                             perturbation_name="species_induced_quality_change",
-                             )
+            if len(quality_patches) != 0:
+                group_index, final_patch_nums = first_occurrence_groups(np.concatenate(quality_patches))
+                final_quality_change_list = np.bincount(group_index, weights=np.concatenate(quality_values))
+                is_current = self.system_state.current_patch_mask[final_patch_nums]
+                final_patch_nums = final_patch_nums[is_current]
+                final_quality_change_list = final_quality_change_list[is_current]
+                if len(final_patch_nums) != 0:
+                    perturbation(system_state=self.system_state, parameters=self.parameters,
+                                 pert_paras={
+                                     "perturbation_type": "patch_perturbation",
+                                     "perturbation_subtype": "change_parameter",
+                                     "patch_list_overwrite": final_patch_nums.tolist(),
+                                     "parameter_change": final_quality_change_list.tolist(),
+                                     "parameter_change_type": "relative_add",
+                                     "parameter_change_attr": "quality",
+                                 },
+                                 perturbation_name="species_induced_quality_change",
+                                 )
             # for adjacency change
-            if len(self.system_state.perturbation_holding["adjacency_change"]) != 0:
-                final_pair_list = []
-                final_adjacency_change_list = []
-                for pair in self.system_state.perturbation_holding["adjacency_change"]:
-                    mean_change = np.mean(self.system_state.perturbation_holding["adjacency_change"][pair])
-                    if mean_change >= 0.5:
-                        actual_change = 1
-                    else:
-                        actual_change = 0
-                    final_pair_list.append(pair)
-                    final_adjacency_change_list.append(actual_change)
+            if len(adjacency_pairs) != 0:
+                all_pairs = np.concatenate(adjacency_pairs)
+                group_index, final_pair_keys = first_occurrence_groups(all_pairs[:, 0] * len(patch_list)
+                                                                       + all_pairs[:, 1])
+                mean_change = np.bincount(group_index, weights=np.concatenate(adjacency_values)) / np.bincount(
+                    group_index)
+                final_pair_list = [(x // len(patch_list), x % len(patch_list)) for x in final_pair_keys.tolist()]
+                final_adjacency_change_list = [1 if x >= 0.5 else 0 for x in mean_change]
                 perturbation(system_state=self.system_state, parameters=self.parameters,
                              pert_paras={
                                  "perturbation_type": "patch_perturbation",
@@ -664,41 +671,6 @@ class Simulation_obj:
                              perturbation_name="species_induced_adjacency_change",
                              )
 
-    def record_perturbation(self, patch_num, perturbation_para):
-        # for a given patch and the species-specific perturbation parameters, update the running lists of how this patch
-        # is being impacted in this time-step (excluding adjacency changes, which require a dedicated function)
-        if perturbation_para["IS_REMOVAL"]:
-            # removal overwrites all other effects, simply record a set of all patches to remove
-            self.system_state.perturbation_holding["remove"].add(patch_num)
-        else:
-            if perturbation_para["IS_HABITAT_TYPE_CHANGE"]:
-                # record a list of all habitat types to change this patch to (will choose one at random)
-                if patch_num in self.system_state.perturbation_holding["habitat_change"]:
-                    self.system_state.perturbation_holding["habitat_change"][patch_num].append(
-                        perturbation_para["HABITAT_TYPE_NUM_TO_CHANGE_TO"])
-                else:
-                    self.system_state.perturbation_holding["habitat_change"][patch_num] = [
-                        perturbation_para["HABITAT_TYPE_NUM_TO_CHANGE_TO"]]
-            if perturbation_para["IS_QUALITY_CHANGE"]:
-                # sum all the relative quality changes for this patch (will take the mean)
-                if patch_num in self.system_state.perturbation_holding["quality_change"]:
-                    self.system_state.perturbation_holding["quality_change"][patch_num] += \
-                        perturbation_para["RELATIVE_QUALITY_CHANGE"]
-                else:
-                    self.system_state.perturbation_holding["quality_change"][patch_num] = \
-                        perturbation_para["RELATIVE_QUALITY_CHANGE"]
-
-    def record_adj_perturbation(self, patch_nums, perturbation_para):
-        # update list of {0, 1} adj changes for this patch pair (will check if mean >= 0.5)
-        pair = (min(patch_nums), max(patch_nums))  # consistent order
-        if pair in self.system_state.perturbation_holding["adjacency_change"]:
-            # the (,) pair can indeed be used as a dictionary key
-            self.system_state.perturbation_holding["adjacency_change"][pair].append(
-                perturbation_para["ABSOLUTE_ADJACENCY_CHANGE"])
-        else:
-            self.system_state.perturbation_holding["adjacency_change"][pair] = [
-                perturbation_para["ABSOLUTE_ADJACENCY_CHANGE"]]
-
     def build_minimal_initial_patch_list(self):
         # this creates a simplified copy of the initial patch list with a minimal record of the essential physical
         # properties (creating a deepcopy of the entire patch list after local population objects added leads to an
@@ -724,14 +696,101 @@ class Simulation_obj:
         return initial_patch_list
 
 
-def draw_perturbation(local_pop, patch_relation):
-    # for a given local population and affected patch, determine if a species-induced perturbation probabilistically
-    # occurs based on the population density and the species-specific coefficient parameters
-    coefficients = local_pop.species.perturbation_para[
-        "IMPLEMENTATION_PROBABILITY_COEFFICIENTS"][patch_relation]
-    density = local_pop.population / local_pop.carrying_capacity
-    # build the probability function
-    probability = coefficients[0] * np.heaviside(density, 0.0) + coefficients[
-        1] * density + coefficients[2] * density ** 2.0 + coefficients[3] * density ** 3.0
-    # draw value and return it
-    return np.random.binomial(1, probability)
+def gather_csr_rows(csr_arrays, rows):
+    # the concatenated neighbours of each of the given rows, and the index (in rows) that each one belongs to
+    row_starts, neighbours = csr_arrays
+    row_lengths = row_starts[rows + 1] - row_starts[rows]
+    row_index = np.repeat(np.arange(len(rows)), row_lengths)
+    positions = np.arange(np.sum(row_lengths)) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+    return neighbours[row_starts[rows][row_index] + positions], row_index
+
+
+def first_occurrence_groups(keys):
+    # the group index of each key, with the groups numbered in order of the first occurrence of their key, and the
+    # distinct keys in that order
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    group_rank = np.empty(len(first_index), dtype=int)
+    group_rank[np.argsort(first_index)] = np.arange(len(first_index))
+    return group_rank[inverse], keys[np.sort(first_index)]
+
+
+def species_perturbation_draws(species, patch_list, neighbour_arrays, is_patch_pert, link_arrays_key):
+    # For a species which perturbs the environment, determine probabilistically (based on the population density and
+    # the species-specific coefficient parameters) which of the patches and links impacted by each of its local
+    # populations are perturbed in this time-step. All the Bernoulli trials are drawn in a single call, in the same
+    # order as drawing for each local population in turn, and for each impacted patch (same, then adjacent, then
+    # xy-adjacent) the patch itself and then each of its links (to the neighbours given by link_arrays_key).
+    # Returns the array of perturbed patch numbers and the (N x 2) array of perturbed (lower, higher) patch pairs, both
+    # in the order drawn, or None if there are no local populations of the species.
+    source_patches = []
+    densities = []
+    for patch_num, patch in enumerate(patch_list):
+        if species.name in patch.local_populations:
+            local_pop = patch.local_populations[species.name]
+            source_patches.append(patch_num)
+            densities.append(local_pop.population / local_pop.carrying_capacity)
+    if len(source_patches) == 0:
+        return None
+    source_patches = np.array(source_patches, dtype=int)
+
+    # probability of each relation for each local population, occurring with X_0*chi(x) + X_1*x + X_2*x^2 + X_3*x^3
+    # (the powers are of the scalar densities so that the values match those of the individual calculation)
+    density = np.array(densities, dtype=float)
+    density_squared = np.array([x ** 2.0 for x in densities], dtype=float)
+    density_cubed = np.array([x ** 3.0 for x in densities], dtype=float)
+    relation_probability = []
+    for patch_relation in ["SAME", "ADJACENT", "XY_ADJACENT"]:
+        coefficients = species.perturbation_para["IMPLEMENTATION_PROBABILITY_COEFFICIENTS"].get(
+            patch_relation, [0, 0, 0, 0])
+        relation_probability.append(coefficients[0] * np.heaviside(density, 0.0) + coefficients[1] * density
+                                    + coefficients[2] * density_squared + coefficients[3] * density_cubed)
+    relation_probability = np.array(relation_probability)
+
+    # the impacted patches: (local population index, relation, target patch number), ordered by local population
+    unit_source = [np.zeros(0, dtype=int)]
+    unit_relation = [np.zeros(0, dtype=int)]
+    unit_target = [np.zeros(0, dtype=int)]
+    for relation_index, (impact_str, arrays_key) in enumerate([("same", None),
+                                                               ("adjacent", ("set_of_adjacent_patches", False)),
+                                                               ("xy-adjacent", ("set_of_xy_adjacent_patches", False))]):
+        if impact_str in species.perturbation_para["TO_IMPACT"]:
+            if arrays_key is None:
+                targets, sources = source_patches, np.arange(len(source_patches))
+            else:
+                targets, sources = gather_csr_rows(csr_arrays=neighbour_arrays[arrays_key], rows=source_patches)
+            unit_source.append(sources)
+            unit_relation.append(np.full(len(targets), relation_index, dtype=int))
+            unit_target.append(targets)
+    unit_source = np.concatenate(unit_source)
+    unit_relation = np.concatenate(unit_relation)
+    unit_order = np.argsort(unit_source * 3 + unit_relation, kind="stable")
+    unit_source = unit_source[unit_order]
+    unit_relation = unit_relation[unit_order]
+    unit_target = np.concatenate(unit_target)[unit_order]
+
+    # the individual draws: once for each impacted patch for within-patch properties, then each of its links
+    draw_unit = [np.zeros(0, dtype=int)]
+    draw_other = [np.zeros(0, dtype=int)]
+    if is_patch_pert:
+        draw_unit.append(np.arange(len(unit_target)))
+        draw_other.append(np.full(len(unit_target), -1, dtype=int))
+    if link_arrays_key is not None:
+        others, units = gather_csr_rows(csr_arrays=neighbour_arrays[link_arrays_key], rows=unit_target)
+        draw_unit.append(units)
+        draw_other.append(others)
+    draw_unit = np.concatenate(draw_unit)
+    draw_other = np.concatenate(draw_other)
+    draw_order = np.argsort(draw_unit * 2 + (draw_other >= 0), kind="stable")
+    draw_unit = draw_unit[draw_order]
+    draw_other = draw_other[draw_order]
+    if len(draw_unit) == 0:
+        return np.zeros(0, dtype=int), np.zeros((0, 2), dtype=int)
+
+    is_success = np.random.binomial(1, relation_probability[unit_relation[draw_unit],
+                                                           unit_source[draw_unit]]) == 1
+    is_link = draw_other >= 0
+    perturbed_patches = unit_target[draw_unit[is_success & ~is_link]]
+    link_patches = unit_target[draw_unit[is_success & is_link]]
+    link_others = draw_other[is_success & is_link]
+    perturbed_pairs = np.column_stack((np.minimum(link_patches, link_others), np.maximum(link_patches, link_others)))
+    return perturbed_patches, perturbed_pairs
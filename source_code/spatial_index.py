@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class Spatial_index:
+    # KD-tree of the patch positions (which never change), built once so that radius, nearest-neighbour and distance
+    # queries no longer require comparing every pair of patches. The patch positions are only used for the layout of
+    # the lattice and for the "position_box" cluster and "prev_weighting" perturbation options, since the adjacency
+    # (not the position) is what represents the physical connections between patches.
+    #
+    # Patches are referred to by their position in the list that built the index, which is the patch number for the
+    # system_state.patch_list.
+
+    def __init__(self, positions):
+        self.positions = np.asarray([np.ravel(position) for position in positions], dtype=float)
+        if len(self.positions) == 0:
+            self.positions = np.zeros([0, 2])
+        self.kd_tree = cKDTree(self.positions)
+
+    def patches_within(self, position, radius):
+        # sorted list of all patches within (inclusive) the given Euclidean distance of a position
+        return sorted(self.kd_tree.query_ball_point(np.ravel(position), r=radius))
+
+    def nearest_patches(self, position, num_nearest=1):
+        # list of the num_nearest patches to a position, nearest first
+        num_nearest = min(num_nearest, len(self.positions))
+        if num_nearest == 0:
+            return []
+        _, patch_nums = self.kd_tree.query(np.ravel(position), k=num_nearest)
+        return list(np.atleast_1d(patch_nums))
+
+    def pairs_at_distance(self, distance):
+        # sorted list of the pairs (x, y) with x < y of patches separated by exactly this distance (e.g. 1 for the
+        # lattice neighbours). The KD-tree finds candidates within a small tolerance, and these are then checked exactly.
+        candidate_pairs = self.kd_tree.query_pairs(r=distance * (1.0 + 1e-9) + 1e-12, output_type='ndarray')
+        if len(candidate_pairs) == 0:
+            return []
+        candidate_pairs = candidate_pairs[np.lexsort((candidate_pairs[:, 1], candidate_pairs[:, 0]))]
+        separation = self.distances_between(candidate_pairs[:, 0], candidate_pairs[:, 1])
+        return [tuple(x) for x in candidate_pairs[separation == distance].tolist()]
+
+    def distances_between(self, patch_nums_1, patch_nums_2):
+        # element-wise Euclidean distances between two equal-length lists of patches
+        difference = self.positions[np.asarray(patch_nums_1, dtype=int)] - self.positions[
+            np.asarray(patch_nums_2, dtype=int)]
+        return np.sqrt(np.sum(difference * difference, axis=1))
+
+    def summed_distances(self, patch_nums, reference_patch_nums):
+        # for each patch in patch_nums, the total Euclidean distance to all of the reference patches. The sum over the
+        # references is accumulated in their given order, so that tied totals are identical to those of a loop.
+        patch_nums = np.asarray(patch_nums, dtype=int)
+        summed_distance = np.zeros(len(patch_nums))
+        for reference_patch_num in reference_patch_nums:
+            summed_distance += self.distances_between(patch_nums, np.full(len(patch_nums), reference_patch_num))
+        return summed_distance
@@ -1,12 +1,19 @@
 from source_code.degree_distribution import power_law_curve_fit
 from source_code.data_save_functions import update_local_population_nets
-from source_code.system_state_functions import (tuple_builder, linear_model_report, determine_complexity,
-                                    rank_abundance, inter_species_predictions_correlation_coefficients,
-                                    complexity_scaling_vector_analysis)
-from source_code.cluster_functions import generate_fast_cluster, draw_partition, partition_analysis
+from source_code.system_state_functions import (tuple_builder, linear_model_report, linear_model_reports,
+                                    rank_abundance, inter_species_correlation_coefficients_batch, species_pair_store,
+                                    undirected_sparse_graph,
+                                    harmonic_centrality_sums, patches_within_path_length, local_clustering_counts,
+                                    count_cluster_diversity, complexity_cluster_sums, analysis_sub_network,
+                                    run_parallel_tasks, spawn_task_seeds, neighbour_csr_arrays)
+from source_code.cluster_functions import partition_draw_results
+from source_code.spatial_index import Spatial_index
+from source_code.difference_cache import Difference_cache
+from source_code.power_law_fitter import Power_law_fitter
 import numpy as np
 from copy import deepcopy
 from collections import Counter
+import heapq
 
 
 class System_state:
@@ -26,11 +33,17 @@ class System_state:
         # will still match with the corresponding row and column in the adjacency matrix following deletions from both.
         self.initial_patch_list = None
         self.species_set = species_set
-        self.current_patch_list = current_patch_list
+        self.current_patch_list = current_patch_list  # ordered list of the patch numbers currently present
+        self.current_patch_mask = None  # boolean array: is each patch (by number) currently present?
+        self.current_patch_position = None  # position of each patch in the current_patch_list (-1 if removed)
+        self.update_current_patch_index()
         self.dimensions = dimensions
+        self.spatial_index = Spatial_index(positions=[patch.position for patch in patch_list])  # positions are fixed
+        self.neighbour_arrays_cache = {}  # (attribute name, is_exclude_self): CSR arrays of the patch neighbour sets
+        self.power_law_fitter = Power_law_fitter()  # caches and warm-starts the complexity power law fits
         self.reserve_list = []
         self.perturbation_history = {}
-        self.perturbation_holding = None
+        self.perturbation_transaction = None  # while open, holds the patches awaiting the rebuild after perturbations
         self.distance_metrics_store = {}  # will hold a very deep nested dictionary of measures
         self.complexity_parameters = parameters["main_para"]["COMPLEXITY_ANALYSIS"]
         self.is_record_lesser_lm = parameters["plot_save_para"]["IS_RECORD_AND_PLOT_LESSER_LM"]
@@ -53,11 +66,13 @@ class System_state:
         self.habitat_amounts_history = {_: {} for _ in habitat_type_dictionary}  # dict of dict (of time/values)
         self.habitat_spatial_auto_correlation_history = {}  # normalised by the expectation given habitat amounts
         self.habitat_regular_auto_correlation_history = {}  # plain ratio of same-habitat : any-habitat links
+        self.habitat_join_counts = None  # current habitat amounts and numbers of links, kept for incremental updates
         self.num_perturbations = 0
         self.num_restorations = 0
         self.num_perturbations_history = {0: 0}
         self.num_restorations_history = {0: 0}
         self.patch_centrality_history = {}
+        self.patch_harmonic_sums = None  # un-normalised harmonic centrality sums of ALL patches, kept for re-use
         self.patch_degree_history = {}
         self.patch_lcc_history = {_: {} for _ in ['all', 'same', 'different'] + list(habitat_type_dictionary.keys())}
         self.degree_distribution_history = {}
@@ -133,10 +148,11 @@ class System_state:
         self.degree_dist_power_law_fit_history[self.step] = power_law_curve_fit(
             degree_distribution_list=degree_distribution_list)
 
-    def update_centrality_history(self, parameters):
+    def update_centrality_history(self, parameters, affected_patch_nums=None):
         # update the history of tuples of the average centrality of CURRENT patches (but for all patches in their
         # individual attributes)
-        current_centrality_list = self.calculate_all_patches_centrality(parameters=parameters)
+        current_centrality_list = self.calculate_all_patches_centrality(parameters=parameters,
+                                                                        affected_patch_nums=affected_patch_nums)
         self.patch_centrality_history[self.step] = tuple_builder(current_centrality_list)
 
     def increment_num_perturbations(self):
@@ -156,9 +172,56 @@ class System_state:
             for local_population in patch.local_populations.values():
                 local_population.record_carrying_capacity_history(step=self.step)
 
-    def update_habitat_distributions_history(self):
+    def count_habitat_joins(self):
+        # count the amount of each habitat type amongst the current patches, and the join counts: the number of links
+        # (adjacency of 1.0 from a current patch to a later patch in the current_patch_list, so each current pair is
+        # considered once) in total and between patches of the same habitat type.
+        habitat_array = np.asarray([patch.habitat_type_num for patch in self.patch_list], dtype=int)
+        current_habitats = habitat_array[self.current_patch_list]
+        habitat_counts = {habitat_type_num: int(np.sum(current_habitats == habitat_type_num))
+                          for habitat_type_num in self.habitat_type_dictionary}
+
+        # edge list of eligible links from the sparse adjacency
+        adjacency_csr = self.patch_adjacency_matrix.to_csr()
+        row_nums = np.repeat(np.arange(adjacency_csr.shape[0]), np.diff(adjacency_csr.indptr))
+        column_nums = adjacency_csr.indices
+        row_positions = self.current_patch_position[row_nums]
+        is_join = (adjacency_csr.data == 1.0) & (row_positions >= 0) & (
+                self.current_patch_position[column_nums] > row_positions)
+        # bincount over the (habitat, habitat) pairs of the joins
+        num_habitat_labels = int(max(np.max(habitat_array, initial=0), max(self.habitat_type_dictionary)) + 1)
+        join_matrix = np.bincount(habitat_array[row_nums[is_join]] * num_habitat_labels + habitat_array[
+            column_nums[is_join]], minlength=num_habitat_labels ** 2).reshape(num_habitat_labels, num_habitat_labels)
+        return {"habitat_counts": habitat_counts, "all": int(np.sum(join_matrix)), "same": int(np.trace(join_matrix))}
+
+    def relabel_habitat_join_counts(self, patch_num, old_habitat_type_num):
+        # O(degree) update of the stored join counts after the habitat type of a single patch has been changed. This
+        # must be called after each patch is changed (before any others), and the history is then recorded by calling
+        # update_habitat_distributions_history(is_recount=False).
+        position = self.current_patch_position[patch_num]
+        if self.habitat_join_counts is None or position < 0:
+            return
+        new_habitat_type_num = self.patch_list[patch_num].habitat_type_num
+        self.habitat_join_counts["habitat_counts"][old_habitat_type_num] -= 1
+        self.habitat_join_counts["habitat_counts"][new_habitat_type_num] += 1
+        # joins to later current patches, and from earlier current patches
+        joined_patch_nums = [other_num for other_num, adjacency_value in self.patch_adjacency_matrix.row_items(
+            patch_num).items() if adjacency_value == 1.0 and self.current_patch_position[other_num] > position]
+        joined_patch_nums.extend([other_num for other_num, adjacency_value in self.patch_adjacency_matrix.column_items(
+            patch_num).items() if adjacency_value == 1.0 and 0 <= self.current_patch_position[other_num] < position])
+        for other_num in joined_patch_nums:
+            other_habitat_type_num = self.patch_list[other_num].habitat_type_num
+            if other_habitat_type_num == old_habitat_type_num:
+                self.habitat_join_counts["same"] -= 1
+            if other_habitat_type_num == new_habitat_type_num:
+                self.habitat_join_counts["same"] += 1
+
+    def update_habitat_distributions_history(self, is_recount=True):
         # count the amount of each habitat and the spatial auto-correlation (essentially the a-posteriori probability
-        # that two neighbours have the same habitat type) and store history of each.
+        # that two neighbours have the same habitat type) and store history of each. Unless is_recount, the join counts
+        # that have been incrementally updated since the last call are used.
+        if is_recount or self.habitat_join_counts is None:
+            self.habitat_join_counts = self.count_habitat_joins()
         norm_sum = 0.0
         auto_cor_sum = 0.0
         temp_habitat_counts = {}
@@ -169,18 +232,9 @@ class System_state:
             regular_auto_correlation = 0.0
         else:
             # more than one habitat type
-            for habitat_type_num in self.habitat_type_dictionary:
-                temp_habitat_counts[habitat_type_num] = 0
-            for starting_index, patch_num_1 in enumerate(self.current_patch_list):
-                # only consider patches that are currently present
-                temp_habitat_counts[self.patch_list[patch_num_1].habitat_type_num] += 1
-                # consider neighbours
-                for patch_num_2 in self.current_patch_list[starting_index + 1:]:
-                    if self.patch_adjacency_matrix[patch_num_1, patch_num_2] == 1.0:
-                        norm_sum += 1.0
-                        if self.patch_list[patch_num_1].habitat_type_num == \
-                                self.patch_list[patch_num_2].habitat_type_num:
-                            auto_cor_sum += 1.0
+            temp_habitat_counts = dict(self.habitat_join_counts["habitat_counts"])
+            norm_sum = float(self.habitat_join_counts["all"])
+            auto_cor_sum = float(self.habitat_join_counts["same"])
 
             if norm_sum == 0.0:
                 # if norm_sum is zero (i.e.the graph is fully disconnected)
@@ -217,125 +271,155 @@ class System_state:
     def update_current_patch_history(self):
         self.current_num_patches_history.append(len(self.current_patch_list))
 
+    def update_current_patch_index(self):
+        # (re)build the mask and position index of the current patches, for O(1) membership tests and look-up of the
+        # row of a patch in arrays restricted to the current patches (where the position may not match the number).
+        num_patches = len(self.patch_list)
+        self.current_patch_mask = np.zeros(num_patches, dtype=bool)
+        self.current_patch_mask[self.current_patch_list] = True
+        self.current_patch_position = np.full(num_patches, -1, dtype=int)
+        self.current_patch_position[self.current_patch_list] = np.arange(len(self.current_patch_list))
+
+    def is_current_patch(self, patch_num):
+        return bool(self.current_patch_mask[patch_num])
+
+    def remove_current_patch(self, patch_num):
+        # remove from the current_patch_list, keeping the mask and position index in sync
+        position = self.current_patch_position[patch_num]
+        if position < 0:
+            raise Exception(f"Patch {patch_num} is not currently present.")
+        del self.current_patch_list[position]
+        self.current_patch_mask[patch_num] = False
+        self.current_patch_position[patch_num] = -1
+        self.current_patch_position[self.current_patch_position > position] -= 1
+
+    def check_removed_patches_unpopulated(self):
+        # removed patches are no longer adjacent to any others, so no population can reach them or survive in them -
+        # anything else indicates that some patch still holds a stale path, interaction or dispersal target to them
+        for patch_num in np.flatnonzero(~self.current_patch_mask).tolist():
+            for local_population in self.patch_list[patch_num].local_populations.values():
+                if local_population.population != 0.0:
+                    raise Exception(f"Removed patch {patch_num} has a non-zero population of {local_population.name} "
+                                    f"at step {self.step}.")
+
     def calculate_all_patches_degree(self):
-        # calculate the degree of each patch and update the set of adjacent patches, and THEN SUBSEQUENTLY we use that
-        # to determine the local clustering coefficient
+        # calculate the degree of each patch and update the set of adjacent patches, and the local clustering
+        # coefficients, all in bulk from the sparse adjacency graph restricted to the current patches.
+        is_current = self.current_patch_mask
+        habitat_array = np.asarray([patch.habitat_type_num for patch in self.patch_list])
+        neighbour_graph, all_pairs, all_closed, same_pairs, same_closed = local_clustering_counts(
+            adjacency_graph=undirected_sparse_graph(self.patch_adjacency_matrix.to_csr()), is_current=is_current,
+            habitat_array=habitat_array)
+        # a patch counts itself as adjacent (and in its degree) if it has non-zero self-adjacency and is current
+        is_self_adjacent = (self.patch_adjacency_matrix.diagonal() != 0.0) & is_current
+
+        self.invalidate_neighbour_arrays(attribute_name="set_of_adjacent_patches")
         degree_list = []
+        lcc_list = []
         for patch in self.patch_list:
-            degree = self.calculate_patch_degree(patch=patch)
-            if patch.number in self.current_patch_list:
+            neighbour_nums = neighbour_graph.indices[
+                neighbour_graph.indptr[patch.number]: neighbour_graph.indptr[patch.number + 1]].tolist()
+            if is_self_adjacent[patch.number]:
+                neighbour_nums.append(patch.number)
+            set_of_adjacent_patches = set(sorted(neighbour_nums))
+            degree = len(set_of_adjacent_patches)
+            patch.degree = degree
+            patch.degree_history[self.step] = degree
+            patch.set_of_adjacent_patches = set_of_adjacent_patches
+            patch.set_of_adjacent_patches_history[self.step] = list(set_of_adjacent_patches)
+            if len(self.current_patch_list) > 0:
+                # LCC for all triangles, those with all-same habitats, and those with at least two habitat types
+                lcc = {"all": 0.0, "same": 0.0, "different": 0.0}
+                num_triangles = [all_pairs[patch.number], same_pairs[patch.number],
+                                 all_pairs[patch.number] - same_pairs[patch.number]]
+                num_closed_triangles = [all_closed[patch.number], same_closed[patch.number],
+                                        all_closed[patch.number] - same_closed[patch.number]]
+                for key_index, key in enumerate(["all", "same", "different"]):
+                    if num_triangles[key_index] > 0:
+                        lcc[key] = float(num_closed_triangles[key_index]) / float(num_triangles[key_index])
+                patch.local_clustering = lcc
+                patch.local_clustering_history[self.step] = lcc
+            if is_current[patch.number]:
                 degree_list.append(degree)
-        # This must be AFTER updating all calculate_patch_degree() because of reliance of patch.set_of_adjacent_patches
-        lcc_list = []
-        if len(self.current_patch_list) > 0:
-            for patch in self.patch_list:
-                lcc = self.calculate_lcc(patch=patch)
-                if patch.number in self.current_patch_list:
-                    lcc_list.append(lcc)  # this is a (patch-length) list of the [all, same, different] LCC's
+                if len(self.current_patch_list) > 0:
+                    lcc_list.append(patch.local_clustering)  # a (patch-length) list of the [all, same, different] LCC's
         return degree_list, lcc_list
 
-    def calculate_all_patches_centrality(self, parameters):
-        # calculate the harmonic centrality of the patch
-        # use the full patch list to avoid errors
+    def calculate_all_patches_centrality(self, parameters, affected_patch_nums=None):
+        # calculate the harmonic centrality of the patch from breadth-first shortest path lengths, truncated at
+        # MAX_CENTRALITY_MEASURE steps. Use the full patch list to avoid errors (removed patches have no edges).
+        # If affected_patch_nums is given (all sources whose paths may have changed - i.e. those within the maximum
+        # path length of the perturbed patches), then only their sums are recalculated and the rest are re-used.
         num_patches = int(len(self.patch_list))
         maximal_iterations = min(int(parameters["main_para"]["MAX_CENTRALITY_MEASURE"]), num_patches)
-        minimum_distance_matrix = np.identity(num_patches)
         patch_centrality_vector = np.zeros([num_patches])
         if maximal_iterations > 1:
-            path_matrix = deepcopy(self.patch_adjacency_matrix)
-            for path_length in range(maximal_iterations):
-                for patch_x in range(num_patches):
-                    for patch_y in range(num_patches):
-                        # matmul causes number of walks to grow so normalise - only need to know when non-zero
-                        if path_matrix[patch_x, patch_y] != 0.0:
-                            path_matrix[patch_x, patch_y] = 1.0
-                            # all this relies on patch_adjacency_matrix always being undirected so [x,y] suffices.
-                            if minimum_distance_matrix[patch_x, patch_y] == 0.0:
-                                # have found a new connection between previously unreached paths
-                                minimum_distance_matrix[patch_x, patch_y] = path_length + 1
-
-                path_matrix = np.matmul(path_matrix, path_matrix)
-
-            # sum reciprocal of non-zero elements (excluding self)
-            for patch_x in range(num_patches):
-                for patch_y in range(num_patches):
-                    if patch_x != patch_y and minimum_distance_matrix[patch_x, patch_y] != 0.0:
-                        patch_centrality_vector[patch_x] += 1.0 / minimum_distance_matrix[patch_x, patch_y]
-            patch_centrality_vector *= (1.0 / (len(self.current_patch_list) - 1.0))
+            adjacency_graph = undirected_sparse_graph(self.patch_adjacency_matrix.to_csr())
+            if affected_patch_nums is None or self.patch_harmonic_sums is None:
+                self.patch_harmonic_sums = harmonic_centrality_sums(
+                    adjacency_graph=adjacency_graph, source_patch_nums=np.arange(num_patches),
+                    max_path_length=maximal_iterations)
+            elif len(affected_patch_nums) > 0:
+                affected_patch_nums = np.asarray(sorted(affected_patch_nums), dtype=int)
+                self.patch_harmonic_sums[affected_patch_nums] = harmonic_centrality_sums(
+                    adjacency_graph=adjacency_graph, source_patch_nums=affected_patch_nums,
+                    max_path_length=maximal_iterations)
+            patch_centrality_vector = self.patch_harmonic_sums * (1.0 / (len(self.current_patch_list) - 1.0))
 
         centrality_list = []  # to be used for mean, s.d. for the system level history
         for patch in self.patch_list:
             # make sure to iterate through ALL patches as non-current are all still part of the main patch_list
             patch.centrality = patch_centrality_vector[patch.number]
             patch.centrality_history[self.step] = patch_centrality_vector[patch.number]
-            if patch.number in self.current_patch_list:
+            if self.current_patch_mask[patch.number]:
                 centrality_list.append(patch.centrality)
         return centrality_list
 
+    def find_centrality_affected_patches(self, parameters, patch_nums):
+        # which patches have harmonic centrality sums that could change if the given patches are altered? This must be
+        # called on the network BEFORE a removal (and also after, for an addition of edges).
+        maximal_iterations = min(int(parameters["main_para"]["MAX_CENTRALITY_MEASURE"]), len(self.patch_list))
+        return set(patches_within_path_length(adjacency_graph=undirected_sparse_graph(
+            self.patch_adjacency_matrix.to_csr()),
+                                              source_patch_nums=patch_nums,
+                                              max_path_length=maximal_iterations))
+
     def build_all_patches_species_paths_and_adjacency(self, parameters, specified_patch_list=None):
         for patch in self.patch_list:
             if specified_patch_list is None or patch.number in specified_patch_list:
                 # By default, rebuild scores and paths for ALL patches
                 self.build_species_paths_and_adjacency(patch=patch, parameters=parameters)
 
-    def calculate_lcc(self, patch):
-        # determine the lcc of the given patch. This should only be called after all patches have had
-        # their .set_of_adjacent_patches updated by calling calculate_patch_degree() for EACH OF THEM
-        list_of_neighbours = list(patch.set_of_adjacent_patches)
-        num_triangles = [0, 0, 0]  # all, same, different
-        num_closed_triangles = [0, 0, 0]  # all, same, different
-        lcc = {"all": 0.0, "same": 0.0, "different": 0.0}
-        if len(list_of_neighbours) > 1:
-            for n_1_index, neighbour_1 in enumerate(list_of_neighbours):
-                if neighbour_1 in self.current_patch_list and neighbour_1 != patch.number:
-                    for neighbour_2 in list_of_neighbours[n_1_index + 1:]:  # necessarily n_1 not same as n_2
-                        if neighbour_2 in self.current_patch_list and neighbour_2 != patch.number:
-                            # count this triangle in 'all'
-                            num_triangles[0] += 1
-                            # now check 'same' or different' habitats
-                            is_same_habitats = (patch.habitat_type_num == self.patch_list[neighbour_1].habitat_type_num
-                                                == self.patch_list[neighbour_2].habitat_type_num)
-                            if is_same_habitats:
-                                num_triangles[1] += 1
-                            else:
-                                num_triangles[2] += 1
-                            # now determine if the triangle is closed
-                            if neighbour_2 in self.patch_list[neighbour_1].set_of_adjacent_patches:
-                                num_closed_triangles[0] += 1
-                                if is_same_habitats:
-                                    num_closed_triangles[1] += 1
-                                else:
-                                    num_closed_triangles[2] += 1
-            for key_index, key in enumerate(["all", "same", "different"]):
-                if num_triangles[key_index] > 0:
-                    lcc[key] = float(num_closed_triangles[key_index]) / float(num_triangles[key_index])
-        # update patch records with this list
-        patch.local_clustering = lcc
-        patch.local_clustering_history[self.step] = lcc
-        return lcc
-
-    def calculate_patch_degree(self, patch):
-        # calculate the degree centrality of the patch
-        degree = 0
-        set_of_adjacent_patches = set({})
-        for patch_number in range(np.size(self.patch_adjacency_matrix, 0)):
-            if self.patch_adjacency_matrix[patch.number, patch_number] != 0.0 \
-                    or self.patch_adjacency_matrix[patch_number, patch.number] != 0.0:
-                if patch_number in self.current_patch_list:
-                    degree += 1
-                    set_of_adjacent_patches.add(patch_number)
-        patch.degree = degree
-        patch.degree_history[self.step] = degree
-        patch.set_of_adjacent_patches = set_of_adjacent_patches
-        patch.set_of_adjacent_patches_history[self.step] = list(set_of_adjacent_patches)
-        return degree
+    def update_reverse_adjacency_lists(self, patch, is_add):
+        # Add (or remove) the adjacency lists of this patch to the reverse index of each patch it reaches, so that the
+        # patches that can reach a given patch are found without searching the adjacency lists of every patch.
+        for species_name, reachable_patch_nums in patch.adjacency_lists.items():
+            for list_position, patch_num in enumerate(reachable_patch_nums):
+                reverse_adjacency_list = self.patch_list[patch_num].reverse_adjacency_lists.setdefault(species_name, {})
+                if is_add:
+                    reverse_adjacency_list[patch.number] = list_position
+                else:
+                    reverse_adjacency_list.pop(patch.number, None)
+
+    def neighbour_arrays(self, attribute_name, is_exclude_self=False):
+        # CSR arrays of the given neighbour set of every patch, only rebuilt after those sets have been changed
+        arrays_key = (attribute_name, is_exclude_self)
+        if arrays_key not in self.neighbour_arrays_cache:
+            self.neighbour_arrays_cache[arrays_key] = neighbour_csr_arrays(
+                patch_list=self.patch_list, attribute_name=attribute_name, is_exclude_self=is_exclude_self)
+        return self.neighbour_arrays_cache[arrays_key]
+
+    def invalidate_neighbour_arrays(self, attribute_name):
+        # must be called whenever the given neighbour set of any patch is changed
+        for arrays_key in [x for x in self.neighbour_arrays_cache if x[0] == attribute_name]:
+            del self.neighbour_arrays_cache[arrays_key]
 
     def record_xy_adjacency(self):
-        for patch_1_num, patch_1 in enumerate(self.patch_list):
-            for patch_2 in self.patch_list[patch_1_num + 1:]:
-                if np.linalg.norm(patch_1.position - patch_2.position) == 1:
-                    patch_1.set_of_xy_adjacent_patches.add(patch_2.number)
-                    patch_2.set_of_xy_adjacent_patches.add(patch_1_num)
+        # patches at unit distance, found from the spatial index rather than by comparing every pair
+        self.invalidate_neighbour_arrays(attribute_name="set_of_xy_adjacent_patches")
+        for patch_1_num, patch_2_num in self.spatial_index.pairs_at_distance(distance=1.0):
+            self.patch_list[patch_1_num].set_of_xy_adjacent_patches.add(self.patch_list[patch_2_num].number)
+            self.patch_list[patch_2_num].set_of_xy_adjacent_patches.add(patch_1_num)
 
     def update_patch_habitat_based_properties(self, patch):
         # this simply builds/resets the dictionary of the species-specific feeding and traversal scores in this
@@ -372,6 +456,10 @@ class System_state:
         # Really what we calculate here, and store in the .species_movement_scores, are a set of potential (subject to
         # maximum path length and kappa - for foraging) TRAVEL COSTS to which search cost will later be added, and
         # then conversion to foraging or dispersal score will take place.
+        #
+        # The adjacency lists are also indexed in reverse (in the reverse_adjacency_lists of each reachable patch), so
+        # the previous lists of this patch are first removed from the index and the new ones are added once built.
+        self.update_reverse_adjacency_lists(patch=patch, is_add=False)
         patch.adjacency_lists = {}
         patch.stepping_stone_list = []
         stepping_stone_set = set()
@@ -380,77 +468,69 @@ class System_state:
             species_name = species.name
 
             # use Dijkstra's algorithm for weighted undirected graphs
-            # create dictionary of final patch costs for different path step-lengths [from this current patch]
-            routes_template = {"routes": {"best": (float('inf'), float('inf'), 0.0, [])}}
-            patch_costs = {x: deepcopy(routes_template) for x in range(len(self.patch_list))}
+            # create dictionary of final patch costs for different path step-lengths [from this current patch] - but
+            # only for the patches actually reached, as any missing patch is unreachable (at infinite cost) when read
+            patch_costs = {}
 
             # zero cost to travel to self (i.e. this patch) for any species
-            patch_costs[patch.number]["routes"]["best"] = (0, 0.0, [])  # 0 steps, 0.0 cost, no intermediate steps
-            patch_costs[patch.number]["routes"][0] = (0.0, [])
+            patch_costs[patch.number] = {"routes": {"best": (0, 0.0, []),  # 0 steps, 0.0 cost, no intermediate steps
+                                                    0: (0.0, [])},
+                                         "target_patch_size": patch.size,
+                                         "target_patch_traversal": patch.this_habitat_species_traversal[species_name]}
 
-            # list of patches whose shortest path has been found
-            visited = []
-            not_visited = [x for x in range(len(self.patch_list))]
+            # set of patches whose shortest path has been found, and a heap of (tentative cost, patch) to select the
+            # next (ties broken by the lower patch number) - entries superseded by a lower cost are skipped when popped
+            visited = set()
+            tentative_heap = [(0.0, patch.number)]
 
-            while len(not_visited) > 0:
+            while len(tentative_heap) > 0:
 
                 # identify the shortest tentative cost/distance to reach a currently-unvisited (in this cycle) node
-                best_tentative_cost = float('inf')
-                best_tentative_length = float('inf')
-                best_tentative_path = []
-                next_vertex_num = 0
-                for possible_next_patch_num in not_visited:
-                    tentative_length = patch_costs[possible_next_patch_num]["routes"]["best"][0]
-                    tentative_cost = patch_costs[possible_next_patch_num]["routes"]["best"][1]
-                    tentative_path = patch_costs[possible_next_patch_num]["routes"]["best"][2]
-                    if tentative_cost < best_tentative_cost:
-                        next_vertex_num = possible_next_patch_num
-                        best_tentative_length = tentative_length
-                        best_tentative_cost = tentative_cost
-                        best_tentative_path = tentative_path
-
-                # if this cost is still infinity, then quit algorithm as the graph is disconnected
-                if best_tentative_cost == float('inf'):
-                    break
-                else:
-                    visited.append(next_vertex_num)
-                    not_visited.remove(next_vertex_num)  # this deletion does not occur within "for _ in not_visited"
-                    next_patch = self.patch_list[next_vertex_num]
-                    # now see if a better score to other patches can be achieved through this one
-                    for other_patch_num, other_patch in enumerate(self.patch_list):
-                        if next_vertex_num != other_patch_num:
-                            # not self!
-                            if self.patch_adjacency_matrix[next_vertex_num, other_patch_num] == 0.0 \
-                                    or other_patch.this_habitat_species_traversal[species_name] <= 0.0:
-                                new_path_cost = float('inf')
-                                new_path_length = float('inf')
-                                new_path = []
-                            else:
-                                new_path_length = best_tentative_length + 1
-                                new_path = best_tentative_path + [next_vertex_num]
-                                # single-path-cost = patch-size / ( habitat-species-traversal * adjacency-border)
-                                new_path_cost = best_tentative_cost + next_patch.size / (
-                                        next_patch.this_habitat_species_traversal[
-                                            species_name] * self.patch_adjacency_matrix[
-                                            next_vertex_num, other_patch_num])
-                                # Note: patch_adjacency_matrix is currently binary, so if this branch is reached
-                                # then part of this function will be 1/1;
-                                # However it is included because in the future we may wish to alter this matrix
-                                # such that there are non-uniform size of borders between patch pairs (separately
-                                # from the role of patch size).
-
-                            # is best overall?
-                            if new_path_cost < patch_costs[other_patch_num]["routes"]["best"][1]:
-                                patch_costs[other_patch_num]["routes"]["best"] = (
-                                    new_path_length, new_path_cost, new_path)
-                            # is best for this length?
-                            if new_path_length not in patch_costs[other_patch_num]["routes"] or \
-                                    new_path_cost < patch_costs[other_patch_num]["routes"][new_path_length][0]:
-                                patch_costs[other_patch_num]["routes"][new_path_length] = (new_path_cost, new_path)
+                best_tentative_cost, next_vertex_num = heapq.heappop(tentative_heap)
+                if next_vertex_num in visited or \
+                        best_tentative_cost != patch_costs[next_vertex_num]["routes"]["best"][1]:
+                    continue
+                best_tentative_length = patch_costs[next_vertex_num]["routes"]["best"][0]
+                best_tentative_path = patch_costs[next_vertex_num]["routes"]["best"][2]
+                visited.add(next_vertex_num)
+                next_patch = self.patch_list[next_vertex_num]
+                next_patch_adjacency = self.patch_adjacency_matrix.row_items(next_vertex_num)
+                # now see if a better score to other patches can be achieved through this one - only those adjacent to
+                # it need be considered, as any other would have infinite cost
+                for other_patch_num, adjacency_value in next_patch_adjacency.items():
+                    other_patch = self.patch_list[other_patch_num]
+                    if next_vertex_num != other_patch_num and \
+                            other_patch.this_habitat_species_traversal[species_name] > 0.0:
+                        # not self!
+                        new_path_length = best_tentative_length + 1
+                        new_path = best_tentative_path + [next_vertex_num]
+                        # single-path-cost = patch-size / ( habitat-species-traversal * adjacency-border)
+                        new_path_cost = best_tentative_cost + next_patch.size / (
+                                next_patch.this_habitat_species_traversal[species_name] * adjacency_value)
+                        # Note: patch_adjacency_matrix is currently binary, so if this branch is reached
+                        # then part of this function will be 1/1;
+                        # However it is included because in the future we may wish to alter this matrix
+                        # such that there are non-uniform size of borders between patch pairs (separately
+                        # from the role of patch size).
+
+                        if other_patch_num not in patch_costs:
                             # store the target patch size and traversal score for this species
-                            patch_costs[other_patch_num]["target_patch_size"] = other_patch.size
-                            patch_costs[other_patch_num][
-                                "target_patch_traversal"] = other_patch.this_habitat_species_traversal[species_name]
+                            patch_costs[other_patch_num] = {
+                                "routes": {"best": (float('inf'), float('inf'), 0.0, [])},
+                                "target_patch_size": other_patch.size,
+                                "target_patch_traversal": other_patch.this_habitat_species_traversal[species_name]}
+                        # is best overall?
+                        if new_path_cost < patch_costs[other_patch_num]["routes"]["best"][1]:
+                            patch_costs[other_patch_num]["routes"]["best"] = (
+                                new_path_length, new_path_cost, new_path)
+                            heapq.heappush(tentative_heap, (new_path_cost, other_patch_num))
+                        # is best for this length?
+                        if new_path_length not in patch_costs[other_patch_num]["routes"] or \
+                                new_path_cost < patch_costs[other_patch_num]["routes"][new_path_length][0]:
+                            patch_costs[other_patch_num]["routes"][new_path_length] = (new_path_cost, new_path)
+
+            # in order of the patch numbers, as for the reachable patches below
+            patch_costs = {x: patch_costs[x] for x in sorted(patch_costs)}
 
             # save
             patch.species_movement_scores[species_name] = patch_costs
@@ -473,6 +553,7 @@ class System_state:
                         if 0 < len(path_list) <= parameters["main_para"]["ASSUMED_MAX_PATH_LENGTH"] + 1:
                             stepping_stone_set = stepping_stone_set.union(set(path_list + [int(target)]))
         patch.stepping_stone_list = list(stepping_stone_set)
+        self.update_reverse_adjacency_lists(patch=patch, is_add=True)
         print(f"...{self.step}: Paths built for patch {patch.number}/{len(self.patch_list) - 1}")
 
     # --------------------------- SPECIES / COMMUNITY DISTRIBUTION ANALYSIS ----------------------------------------- #
@@ -568,17 +649,21 @@ class System_state:
         community_state_population_array = np.zeros([num_patches, num_species])
         time_averaged_population_array = np.zeros([num_patches, num_species])  # prediction analysis for ave populations
         for species_index, species_name in enumerate(species_list):
-            for patch_num in self.current_patch_list:
+            for patch_index, patch_num in enumerate(self.current_patch_list):
+                # rows are the position in the current_patch_list (not the patch number)
                 # presence/absence
-                community_state_presence_array[patch_num, species_index] = \
+                community_state_presence_array[patch_index, species_index] = \
                     self.patch_list[patch_num].local_populations[species_name].occupancy
                 # final population
-                community_state_population_array[patch_num, species_index] = self.patch_list[
+                community_state_population_array[patch_index, species_index] = self.patch_list[
                     patch_num].local_populations[species_name].population
                 # average population
-                time_averaged_population_array[patch_num, species_index] = self.patch_list[
+                time_averaged_population_array[patch_index, species_index] = self.patch_list[
                     patch_num].local_populations[species_name].average_population
 
+        # the undirected edges between current patches, shared by all of the network analyses
+        neighbour_edges = self.current_neighbour_edges(patch_neighbours=patch_neighbours)
+
         # per species distance metrics - and species presence probabilities (overall and per habitat type)
         network_analysis_species = {}
         for species_index, species_name in enumerate(species_list):
@@ -591,45 +676,34 @@ class System_state:
                     "species_presence": self.network_analysis(
                         patch_value_array=community_state_presence_array[:, species_index],
                         patch_habitat=patch_habitat, patch_neighbours=patch_neighbours,
-                        is_presence=True, is_distribution=False),
+                        is_presence=True, is_distribution=False, neighbour_edges=neighbour_edges),
 
                     "species_population": self.network_analysis(
                         patch_value_array=norm_species_pop_vector,
                         patch_habitat=patch_habitat, patch_neighbours=patch_neighbours,
-                        is_presence=True, is_distribution=False),
+                        is_presence=True, is_distribution=False, neighbour_edges=neighbour_edges),
                 }
 
         # community distance metrics
         network_analysis_community_distance = self.network_analysis(
             patch_value_array=community_state_presence_array,
             patch_habitat=patch_habitat, patch_neighbours=patch_neighbours,
-            is_presence=False, is_distribution=True)
+            is_presence=False, is_distribution=True, neighbour_edges=neighbour_edges)
 
         # each community state probabilities (overall and per habitat type)
         #
         # for each state determine a unique binary identifier
-        community_state_binary = np.zeros(num_patches)
-        for row_index, row in enumerate(community_state_presence_array):
-            binary_identifier = 0
-            for column_index, column_value in enumerate(row):
-                binary_identifier += column_value * 2.0 ** column_index
-            community_state_binary[row_index] = binary_identifier
+        community_state_binary = community_state_presence_array @ (2.0 ** np.arange(num_species))
         # how many UNIQUE states were identified?
-        extant_state_set = set({})
-        for state in community_state_binary:
-            extant_state_set.add(state)
+        ordered_state_list, patch_state_index = np.unique(community_state_binary, return_inverse=True)
         # then set the patch-vector by presence-absence just based on presence of each state and analyse
-        ordered_state_list = list(extant_state_set)
-        ordered_state_list.sort()
         network_analysis_state_probability = {}
-        for state in ordered_state_list:
-            state_array = np.zeros(num_patches)
-            for patch_index, patch_state in enumerate(community_state_binary):
-                if patch_state == state:
-                    state_array[patch_index] = 1.0
+        for state_index, state in enumerate(ordered_state_list.tolist()):
+            state_array = (patch_state_index == state_index).astype(float)
             network_analysis_state_probability[state] = self.network_analysis(
                 patch_value_array=state_array, patch_habitat=patch_habitat,
-                patch_neighbours=patch_neighbours, is_presence=True, is_distribution=False)
+                patch_neighbours=patch_neighbours, is_presence=True, is_distribution=False,
+                neighbour_edges=neighbour_edges)
             state_species_list = []
             for species_index in range(len(species_list)):
                 if np.mod(state, int(2.0 ** (species_index + 1))) >= int(2.0 ** species_index):
@@ -647,18 +721,23 @@ class System_state:
         habitat_type_nums = list(self.habitat_type_dictionary.keys())
         habitat_type_nums.sort()
 
-        # generate sub-networks
+        # generate sub-networks (all three share the same topology, so this is built only once)
+        sub_network_topology = self.generate_sub_network_topology(patch_habitat=patch_habitat,
+                                                                  habitat_type_nums=habitat_type_nums)
         community_presence_sub_networks = self.generate_sub_networks(population_array=community_state_presence_array,
                                                                      patch_habitat=patch_habitat,
-                                                                     habitat_type_nums=habitat_type_nums)
+                                                                     habitat_type_nums=habitat_type_nums,
+                                                                     sub_network_topology=sub_network_topology)
 
         community_state_sub_networks = self.generate_sub_networks(population_array=community_state_population_array,
                                                                   patch_habitat=patch_habitat,
-                                                                  habitat_type_nums=habitat_type_nums)
+                                                                  habitat_type_nums=habitat_type_nums,
+                                                                  sub_network_topology=sub_network_topology)
 
         time_averaged_sub_networks = self.generate_sub_networks(population_array=time_averaged_population_array,
                                                                 patch_habitat=patch_habitat,
-                                                                habitat_type_nums=habitat_type_nums)
+                                                                habitat_type_nums=habitat_type_nums,
+                                                                sub_network_topology=sub_network_topology)
 
         # use the non-normalised final population (returns five dictionaries)
         presence_store, similarity_store, prediction_store, correlation_store, linear_model_store = \
@@ -694,6 +773,7 @@ class System_state:
             is_record_lm_vectors=is_record_lm_vectors,
             num_species=num_species,
             is_record_partition=True,
+            analysis_key="final",
         )
         print(f"Completed complexity-final analysis.")
         print(f"Begin complexity-average analysis.")
@@ -703,6 +783,7 @@ class System_state:
             is_record_lm_vectors=is_record_lm_vectors,
             num_species=num_species,
             is_record_partition=False,
+            analysis_key="average",
         )
         print(f"Completed complexity-average analysis.")
 
@@ -720,8 +801,29 @@ class System_state:
                 sar_final, sar_average, complexity_final, complexity_average, partition_final, partition_average,
                 rank_abundance_final, rank_abundance_average]
 
-    def network_analysis(self, patch_value_array, patch_habitat, patch_neighbours, is_presence, is_distribution):
+    def current_neighbour_edges(self, patch_neighbours):
+        # the undirected edges between the current patches, as two arrays of positions (lower, upper) in the
+        # current_patch_list. These are ordered by the lower patch and then by its set of adjacent patches, so that sums
+        # accumulated over the edges are the same as those from iterating over the patches and their neighbours.
+        edge_lower = []
+        edge_upper = []
+        for patch_index in range(len(patch_neighbours)):
+            for patch_neighbour in patch_neighbours[patch_index]:
+                # neighbours are given by patch number, so look up their position in the current_patch_list
+                neighbour_index = self.current_patch_position[patch_neighbour]
+                # avoid double counting (and removed patches, at position -1)
+                if neighbour_index > patch_index:
+                    edge_lower.append(patch_index)
+                    edge_upper.append(neighbour_index)
+        return np.asarray(edge_lower, dtype=int), np.asarray(edge_upper, dtype=int)
+
+    def network_analysis(self, patch_value_array, patch_habitat, patch_neighbours, is_presence, is_distribution,
+                         neighbour_edges=None):
         # need value, habitat type, and neighbours of each patch for presence, auto_correlation, clustering analysis
+        #
+        # The differences are calculated together for all of the edges (which can be given, if already built by
+        # current_neighbour_edges(), as this is called repeatedly for the same network), and then accumulated for each
+        # group of edges by bincount over the encoded habitat pairs.
         num_patches = len(self.current_patch_list)
         if np.ndim(patch_value_array) == 1:
             max_difference = 1
@@ -732,6 +834,11 @@ class System_state:
         if len(patch_value_array) != num_patches:
             # how many ROWS in the array? Should match length of current_patch_list
             raise Exception("Incorrect dimensions of value array.")
+        if neighbour_edges is None:
+            neighbour_edges = self.current_neighbour_edges(patch_neighbours=patch_neighbours)
+        edge_lower, edge_upper = neighbour_edges
+        patch_value_array = np.asarray(patch_value_array)
+        patch_habitat = np.asarray(patch_habitat, dtype=int)
 
         # set up the required nested dictionaries to hold results
         template_auto_corr = {"all": np.array([0.0, 0.0]),  # (matching pairs, eligible pairs)
@@ -764,60 +871,65 @@ class System_state:
             # i.e. skip this for full community states
             template_presence["all"] = np.array([np.mean(patch_value_array), np.std(patch_value_array)])
             for habitat_type_num_1 in habitat_type_nums:
-                habitat_subnet = [patch_value_array[x] for x in range(
-                    num_patches) if patch_habitat[x] == habitat_type_num_1]
+                habitat_subnet = patch_value_array[patch_habitat == habitat_type_num_1]
                 if len(habitat_subnet) > 0:
                     template_presence[habitat_type_num_1] = np.array([np.mean(habitat_subnet), np.std(habitat_subnet)])
 
         # auto-correlation
-        for patch_num in range(num_patches):
-            this_patch_habitat = patch_habitat[patch_num]
-            # note that we do *NOT* also calculate this separately for each community state (0-2^N) or
-            # species state (0-1, i.e. we do not restrict to counting only over patches where the species was present,
-            # but we should be able to easily obtain this average instead if desired since we also store the probability
-            # of species presence, and of each community state).
-            for patch_neighbour in patch_neighbours[patch_num]:
-
-                # avoid double counting
-                if patch_neighbour > patch_num:
-
-                    neighbouring_patch_habitat = self.patch_list[patch_neighbour].habitat_type_num
-                    # taxicab / manhattan norm:
-                    difference_vector = patch_value_array[patch_num] - patch_value_array[patch_neighbour]
-                    if np.ndim(difference_vector) == 0:
-                        difference_vector = [difference_vector]
-                    l1_difference = np.linalg.norm(difference_vector, ord=1)
-                    integer_difference = int(l1_difference)  # only for degree distributions
-                    normalised_difference = float(l1_difference) / max_difference
-                    similarity = 1.0 - normalised_difference
-
-                    # community difference distributions
-                    if is_distribution:
-                        # the taxi cab norm (for presence/absence state values) has the advantage of being a
-                        # finite set of possible values
-                        difference_modifier = 1
-                    else:
-                        difference_modifier = 0
-
-                    # all
-                    template_auto_corr['all'] += [similarity, 1.0]
-                    # same
-                    if this_patch_habitat == neighbouring_patch_habitat:
-                        template_auto_corr['same'] += [similarity, 1.0]
-                        if is_distribution:
-                            difference_distribution['same'][integer_difference] += difference_modifier
-                    else:
-                        template_auto_corr['different'] += [similarity, 1.0]
-                        if is_distribution:
-                            difference_distribution['different'][integer_difference] += difference_modifier
-                    # specific habitat combinations
-                    small_habitat = min(this_patch_habitat, neighbouring_patch_habitat)  # order them
-                    large_habitat = max(this_patch_habitat, neighbouring_patch_habitat)
-                    template_auto_corr[(small_habitat, large_habitat)] += [similarity, 1.0]
-                    if is_distribution:
-                        difference_distribution['all'][integer_difference] += difference_modifier
-                        difference_distribution[(small_habitat, large_habitat)][
-                            integer_difference] += difference_modifier
+        #
+        # note that we do *NOT* also calculate this separately for each community state (0-2^N) or
+        # species state (0-1, i.e. we do not restrict to counting only over patches where the species was present,
+        # but we should be able to easily obtain this average instead if desired since we also store the probability
+        # of species presence, and of each community state).
+        #
+        # taxicab / manhattan norm across each edge:
+        difference_array = np.abs(patch_value_array[edge_lower] - patch_value_array[edge_upper])
+        if np.ndim(difference_array) == 1:
+            l1_difference = difference_array
+        else:
+            l1_difference = np.sum(difference_array, axis=1)
+        integer_difference = l1_difference.astype(int)  # only for degree distributions
+        similarity = 1.0 - l1_difference / max_difference
+        edge_count = np.ones(len(similarity))
+
+        # all (summed in order of the edges)
+        if len(similarity) > 0:
+            template_auto_corr['all'] += [np.cumsum(similarity)[-1], len(similarity)]
+        # same and different (in order of the edges)
+        lower_habitat = patch_habitat[edge_lower]
+        upper_habitat = patch_habitat[edge_upper]
+        is_different = (lower_habitat != upper_habitat).astype(int)
+        for group_key, group_sums in zip(["same", "different"], np.transpose(
+                [np.bincount(is_different, weights=similarity, minlength=2),
+                 np.bincount(is_different, weights=edge_count, minlength=2)])):
+            template_auto_corr[group_key] += group_sums
+        # specific habitat combinations, ordered and encoded as a single pair id
+        num_habitat_codes = max(habitat_type_nums + [-1]) + 1
+        pair_id = (np.minimum(lower_habitat, upper_habitat) * num_habitat_codes
+                   + np.maximum(lower_habitat, upper_habitat))
+        pair_similarity = np.bincount(pair_id, weights=similarity, minlength=num_habitat_codes ** 2)
+        pair_count = np.bincount(pair_id, weights=edge_count, minlength=num_habitat_codes ** 2)
+        for habitat_pair in np.unique(pair_id):
+            small_habitat, large_habitat = divmod(int(habitat_pair), num_habitat_codes)
+            template_auto_corr[(small_habitat, large_habitat)] += [pair_similarity[habitat_pair],
+                                                                   pair_count[habitat_pair]]
+
+        # community difference distributions
+        if is_distribution:
+            # the taxi cab norm (for presence/absence state values) has the advantage of being a
+            # finite set of possible values
+            num_bins = max_difference + 1
+            difference_distribution['all'] += np.bincount(integer_difference, minlength=num_bins)
+            group_distribution = np.bincount(is_different * num_bins + integer_difference,
+                                             minlength=2 * num_bins).reshape(2, num_bins)
+            difference_distribution['same'] += group_distribution[0, :]
+            difference_distribution['different'] += group_distribution[1, :]
+            pair_distribution = np.bincount(pair_id * num_bins + integer_difference,
+                                            minlength=num_habitat_codes ** 2 * num_bins
+                                            ).reshape(num_habitat_codes ** 2, num_bins)
+            for habitat_pair in np.unique(pair_id):
+                small_habitat, large_habitat = divmod(int(habitat_pair), num_habitat_codes)
+                difference_distribution[(small_habitat, large_habitat)] += pair_distribution[habitat_pair, :]
 
         output_dict = {
             "auto_correlation": template_auto_corr,
@@ -841,44 +953,31 @@ class System_state:
             raise Exception("Incorrect dimensions of value array.")
 
         # need to convert patch_binary_vector to just the simplest index of achieved states (up to num_patches)
-        found_states = set({})
-        for state in patch_binary_vector:
-            found_states.add(state)
-        found_state_list = list(found_states)
-        found_state_list.sort()
-        reduced_patch_binary_vector = np.zeros(num_patches)
-        for patch_index in range(num_patches):
-            reduced_patch_binary_vector[patch_index] = found_state_list.index(patch_binary_vector[patch_index])
+        found_state_list, reduced_patch_binary_vector = np.unique(patch_binary_vector, return_inverse=True)
         max_state_difference = int(len(found_state_list))
         max_biodiversity = np.shape(patch_state_array)[1] + 1  # add +1 for 'zero' biodiversity
+        # identify the state of each patch, for bio_diversity and for the full system state
+        patch_biodiversity = np.sum(patch_state_array, axis=1).astype(int)
+        patch_habitat = np.asarray(patch_habitat, dtype=int)
 
         # add keys for each habitat
         habitat_type_nums = list(self.habitat_type_dictionary.keys())
         habitat_type_nums.sort()
 
-        # this will hold the frequency distributions
-        shannon_array = {'all': {
-            'total': 0, 'dist_state': np.zeros(max_state_difference), 'dist_biodiversity': np.zeros(max_biodiversity)}}
+        # this will hold the frequency distributions, for all patches and for those of each habitat type
+        shannon_array = {'all': {'total': num_patches,
+                                 'dist_state': np.bincount(reduced_patch_binary_vector,
+                                                           minlength=max_state_difference).astype(float),
+                                 'dist_biodiversity': np.bincount(patch_biodiversity,
+                                                                  minlength=max_biodiversity).astype(float)}}
         for habitat_type_num in habitat_type_nums:
-            shannon_array[habitat_type_num] = {'total': 0,
-                                               'dist_state': np.zeros(max_state_difference),
-                                               'dist_biodiversity': np.zeros(max_biodiversity)}
-
-        # iterate only once over the patches
-        for temp_patch_index, patch_row in enumerate(patch_state_array):
-            # increment counter for all and for this patch's habitat type
-            shannon_array['all']['total'] += 1
-            shannon_array[patch_habitat[temp_patch_index]]['total'] += 1
-            # identify the state of each patch
-            #
-            # for bio_diversity
-            biodiversity = int(np.sum(patch_row))
-            # for full system state
-            state_value = int(reduced_patch_binary_vector[temp_patch_index])
-            shannon_array['all']['dist_state'][state_value] += 1
-            shannon_array['all']['dist_biodiversity'][biodiversity] += 1
-            shannon_array[patch_habitat[temp_patch_index]]['dist_state'][state_value] += 1
-            shannon_array[patch_habitat[temp_patch_index]]['dist_biodiversity'][biodiversity] += 1
+            is_habitat = patch_habitat == habitat_type_num
+            shannon_array[habitat_type_num] = {'total': int(np.sum(is_habitat)),
+                                               'dist_state': np.bincount(reduced_patch_binary_vector[is_habitat],
+                                                                         minlength=max_state_difference).astype(float),
+                                               'dist_biodiversity': np.bincount(patch_biodiversity[is_habitat],
+                                                                                minlength=max_biodiversity
+                                                                                ).astype(float)}
 
         # Now calculate the shannon entropy for each distribution. This is done for 2 x (num_habitats+1) configurations.
         shannon_entropy = {}
@@ -886,14 +985,10 @@ class System_state:
             state_entropy_sum = 0.0
             biodiversity_entropy_sum = 0.0
             if value['total'] > 0.0:
-                for state_frequency in value['dist_state']:
-                    if state_frequency > 0.0:
-                        state_entropy_sum += (state_frequency / value['total']
-                                              ) * np.log(state_frequency / value['total'])
-                for biodiversity_frequency in value['dist_biodiversity']:
-                    if biodiversity_frequency > 0.0:
-                        biodiversity_entropy_sum += (biodiversity_frequency / value['total']
-                                                     ) * np.log(biodiversity_frequency / value['total'])
+                state_probability = value['dist_state'][value['dist_state'] > 0.0] / value['total']
+                state_entropy_sum += np.cumsum(state_probability * np.log(state_probability))[-1]
+                biodiversity_probability = value['dist_biodiversity'][value['dist_biodiversity'] > 0.0] / value['total']
+                biodiversity_entropy_sum += np.cumsum(biodiversity_probability * np.log(biodiversity_probability))[-1]
             shannon_entropy[key] = {'state': -state_entropy_sum, 'biodiversity': -biodiversity_entropy_sum}
         return shannon_entropy
 
@@ -918,32 +1013,20 @@ class System_state:
         species_list = [x.name for x in self.species_set["list"]]
 
         # Prepare the nested storage structures:
-        inner_species_val = {species_name: {radius: 0.0 for radius in range(3)} for species_name in species_list}
-        outer_species_val = {species_name: {radius: deepcopy(inner_species_val) for radius in range(3)}
-                             for species_name in species_list}
-        inner_species_dict = {species_name: {radius: {} for radius in range(3)} for species_name in species_list}
-        outer_species_dict = {species_name: {radius: deepcopy(inner_species_dict) for radius in range(3)}
-                              for species_name in species_list}
-
-        presence_store = {'all': deepcopy(outer_species_val)}
-        similarity_store = {'all': deepcopy(outer_species_val)}
-        prediction_store = {'all': deepcopy(outer_species_val)}
-        correlation_store = {'all': deepcopy(outer_species_dict)}
-
+        store_keys = ['all'] + list(habitat_type_nums)
+        presence_store = {key: species_pair_store(species_list, lambda: 0.0) for key in store_keys}
+        similarity_store = {key: species_pair_store(species_list, lambda: 0.0) for key in store_keys}
+        prediction_store = {key: species_pair_store(species_list, lambda: 0.0) for key in store_keys}
+        correlation_store = {key: species_pair_store(species_list, dict) for key in store_keys}
         # a deeper nest for the linear models:
-        linear_nest = {x: {y: {} for y in ["lin-lin", "log-lin", "log-log"]} for x in ["base", "nz", "nm"]}
-        inner_species_dict_lm = {species_name: {radius: deepcopy(linear_nest) for radius in range(3)}
-                                 for species_name in species_list}
-        outer_species_dict_lm = {species_name: {radius: deepcopy(inner_species_dict_lm) for radius in range(3)} for
-                                 species_name in species_list}
-        linear_model_store = {'all': deepcopy(outer_species_dict_lm)}
+        linear_model_store = {key: species_pair_store(species_list, lambda: {
+            x: {y: {} for y in ["lin-lin", "log-lin", "log-log"]} for x in ["base", "nz", "nm"]})
+                              for key in store_keys}
 
-        for habitat_type_num in habitat_type_nums:
-            presence_store[habitat_type_num] = deepcopy(outer_species_val)
-            similarity_store[habitat_type_num] = deepcopy(outer_species_val)
-            prediction_store[habitat_type_num] = deepcopy(outer_species_val)
-            correlation_store[habitat_type_num] = deepcopy(outer_species_dict)
-            linear_model_store[habitat_type_num] = deepcopy(outer_species_dict_lm)
+        # the (species, radius) columns of the stacked population arrays, in the order of iteration over both
+        column_keys = [(species_index, species_name, ball_radius) for species_index, species_name in enumerate(
+            species_list) for ball_radius in range(3)]
+        minimum_fraction = 0.05
 
         # Now for each subnetwork:
         for network_key in sub_networks.keys():
@@ -952,160 +1035,124 @@ class System_state:
             current_num_patches = sub_networks[network_key]["num_patches"]
             if current_num_patches > 0:
                 current_norm_pop_arrays = sub_networks[network_key]["normalised_population_arrays"]
-
-                # iterate predictor species
-                for species_1_index, species_1_name in enumerate(species_list):
-
-                    # iterate ball radius
-                    for species_1_ball_radius in range(3):
-                        species_1_pop_vector = current_norm_pop_arrays[species_1_ball_radius][:, species_1_index]
-
-                        # check for non-zero predictor population IN TOTAL (given this ball size)
-                        if np.sum(species_1_pop_vector) > 0.0:
-
-                            # iterate response species (including self)
-                            for species_2_index, species_2_name in enumerate(species_list):
-
-                                # iterate ball radius
-                                for species_2_ball_radius in range(3):
-                                    species_2_pop_vector = current_norm_pop_arrays[
-                                                               species_2_ball_radius][:, species_2_index]
-
-                                    # ANALYSIS:
-                                    #
-
-                                    # A. Presence prediction
-                                    species_1_pres_vector = np.zeros(current_num_patches)
-                                    species_2_pres_vector = np.zeros(current_num_patches)
-                                    for patch_index in range(current_num_patches):
-                                        species_1_pres_vector[patch_index] = int(
-                                            species_1_pop_vector[patch_index] > 0.0)
-                                        species_2_pres_vector[patch_index] = int(
-                                            species_2_pop_vector[patch_index] > 0.0)
-                                    presence = np.dot(
-                                        species_1_pres_vector, species_2_pres_vector) / np.sum(species_1_pres_vector)
-                                    presence_store[network_key][species_1_name][
-                                        species_1_ball_radius][species_2_name][species_2_ball_radius] = presence
-
-                                    # B. Similarity
-                                    # sum(sqrt(vector element-wise multiplication))/(sqrt(sum(predictor)*sum(response)))
-                                    if np.sum(species_1_pop_vector) == 0.0 or np.sum(species_2_pop_vector) == 0.0:
-                                        similarity = 0.0
+                stacked_pop_array = np.column_stack([current_norm_pop_arrays[ball_radius][:, species_index]
+                                                     for species_index, _, ball_radius in column_keys])
+                column_sums = np.sum(stacked_pop_array, axis=0)
+
+                # A, B and C are determined for all pairs of (species, radius) columns together:
+                #
+                # A. Presence prediction
+                stacked_pres_array = (stacked_pop_array > 0.0).astype(float)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    presence_matrix = (stacked_pres_array.T @ stacked_pres_array
+                                       ) / np.sum(stacked_pres_array, axis=0)[:, np.newaxis]
+                    # B. Similarity
+                    # sum(sqrt(vector element-wise multiplication))/(sqrt(sum(predictor)*sum(response)))
+                    sqrt_pop_array = np.sqrt(stacked_pop_array)
+                    overlap_matrix = sqrt_pop_array.T @ sqrt_pop_array
+                    similarity_matrix = np.where(np.outer(column_sums, column_sums) == 0.0, 0.0, overlap_matrix / (
+                        np.sqrt(np.outer(column_sums, column_sums))))
+                    # the matrix product rounds differently to the per-pair sums, so could otherwise leave [0, 1] in the
+                    # last bit, and a column compared with itself takes the exact per-pair value (i.e. 1 if non-zero)
+                    similarity_matrix = np.clip(similarity_matrix, 0.0, 1.0)
+                    for column_num in np.flatnonzero(column_sums > 0.0):
+                        column_pop_vector = stacked_pop_array[:, column_num]
+                        column_sum = np.sum(column_pop_vector)
+                        similarity_matrix[column_num, column_num] = np.sum(np.sqrt(np.multiply(
+                            column_pop_vector, column_pop_vector))) / np.sqrt(column_sum * column_sum)
+                    # C. Prediction
+                    # sum(sqrt(vector element-wise multiplication))/sum(predictor)
+                    prediction_matrix = overlap_matrix / column_sums[:, np.newaxis]
+
+                # iterate predictor (species, radius)
+                for column_1, (species_1_index, species_1_name, species_1_ball_radius) in enumerate(column_keys):
+                    species_1_pop_vector = stacked_pop_array[:, column_1]
+
+                    # check for non-zero predictor population IN TOTAL (given this ball size)
+                    if column_sums[column_1] > 0.0:
+
+                        # record A, B, C for each response (species, radius), including self
+                        for column_2, (_, species_2_name, species_2_ball_radius) in enumerate(column_keys):
+                            presence_store[network_key][species_1_name][species_1_ball_radius][species_2_name][
+                                species_2_ball_radius] = presence_matrix[column_1, column_2]
+                            similarity_store[network_key][species_1_name][species_1_ball_radius][species_2_name][
+                                species_2_ball_radius] = similarity_matrix[column_1, column_2]
+                            prediction_store[network_key][species_1_name][species_1_ball_radius][species_2_name][
+                                species_2_ball_radius] = prediction_matrix[column_1, column_2]
+
+                        #
+                        # Build non-zero input versions for D-II, E-II and non-minimum for D-III, E-III:
+                        #
+                        # exclude patches with zero predictor, or with (normalised) predictor <= 5%.
+                        # Recall that these vectors are all normalised!
+                        vector_set = {"base": np.ones(current_num_patches, dtype=bool),
+                                      "nz": species_1_pop_vector != 0.0,
+                                      "nm": species_1_pop_vector > minimum_fraction, }
+
+                        for vector_choice, is_included in vector_set.items():
+                            predictor_vector = species_1_pop_vector[is_included]
+                            response_array = stacked_pop_array[is_included, :]
+
+                            # D. (Two) correlation coefficients, against every response (species, radius) together
+                            # for CCs we always collect all three types (base, _nz, _nm)
+                            correlation_list = inter_species_correlation_coefficients_batch(
+                                species_1_vector=predictor_vector, species_2_array=response_array)
+                            for column_2, (_, species_2_name, species_2_ball_radius) in enumerate(column_keys):
+                                correlation_store[network_key][species_1_name][species_1_ball_radius][
+                                    species_2_name][species_2_ball_radius][vector_choice] = correlation_list[column_2]
+
+                            # E. Linear model
+                            # (Note that we could use curve_fit() for a more general model specification here.)
+                            # E-I. full data; E-II. non-zero predictor; E-III. non-(spec) minimum predictor.
+                            if vector_choice == "nm" or self.is_record_lesser_lm:
+                                # only collect the base and NZ data for LMs if requested in plot_save para,
+                                # that is: Only E-III is collected by default.
+                                is_response_small = np.any(response_array < 0.0000000001, axis=0)
+                                is_predictor_small = np.any(predictor_vector < 0.0000000001)
+                                for model_type in ["lin-lin", "log-lin", "log-log"]:
+                                    # the columns to fit without and (if lesser models are recorded) with the shift
+                                    # of both vectors up to avoid zeros before taking logs, and the transformed data
+                                    if model_type == "lin-lin":
+                                        is_shifted_column = np.zeros(len(column_keys), dtype=bool)
+                                        model_data = {False: (predictor_vector, response_array)}
+                                    elif model_type == "log-lin":
+                                        is_shifted_column = is_response_small
+                                        model_data = {False: (predictor_vector, np.log(
+                                            response_array[:, ~is_shifted_column]))}
+                                        if self.is_record_lesser_lm:
+                                            model_data[True] = (predictor_vector + minimum_fraction, np.log(
+                                                response_array[:, is_shifted_column] + minimum_fraction))
+                                    elif model_type == "log-log":
+                                        is_shifted_column = is_response_small | is_predictor_small
+                                        if not is_predictor_small:
+                                            model_data = {False: (np.log(predictor_vector), np.log(
+                                                response_array[:, ~is_shifted_column]))}
+                                        else:
+                                            model_data = {}
+                                        if self.is_record_lesser_lm:
+                                            model_data[True] = (np.log(predictor_vector + minimum_fraction), np.log(
+                                                response_array[:, is_shifted_column] + minimum_fraction))
                                     else:
-                                        similarity = np.sum(np.sqrt(np.multiply(
-                                            species_1_pop_vector, species_2_pop_vector))) / (
-                                                         np.sqrt(np.sum(species_1_pop_vector) * np.sum(
-                                                             species_2_pop_vector)))
-                                    similarity_store[network_key][species_1_name][
-                                        species_1_ball_radius][species_2_name][species_2_ball_radius] = similarity
-
-                                    # C. Prediction
-                                    # sum(sqrt(vector element-wise multiplication))/sum(predictor)
-                                    prediction = np.sum(np.sqrt(np.multiply(species_1_pop_vector, species_2_pop_vector))
-                                                        ) / np.sum(species_1_pop_vector)
-                                    prediction_store[network_key][species_1_name][
-                                        species_1_ball_radius][species_2_name][species_2_ball_radius] = prediction
-
-                                    #
-                                    # Build non-zero input versions for D-II, E-II and non-minimum for D-III, E-III:
-                                    #
-                                    # list zero-element indices, and indices with (normalised) element <= 5%,
-                                    # then delete all at once.
-                                    # Recall that these vectors are all normalised!
-                                    zero_index_list = []
-                                    min_index_list = []
-                                    minimum_fraction = 0.05
-                                    for _ in range(len(species_1_pop_vector)):
-                                        if species_1_pop_vector[_] == 0.0:
-                                            zero_index_list.append(_)
-                                        if species_1_pop_vector[_] <= minimum_fraction:
-                                            min_index_list.append(_)
-                                    species_1_pop_vector_nz = np.delete(species_1_pop_vector, zero_index_list)
-                                    species_2_pop_vector_nz = np.delete(species_2_pop_vector, zero_index_list)
-                                    species_1_pop_vector_nm = np.delete(species_1_pop_vector, min_index_list)
-                                    species_2_pop_vector_nm = np.delete(species_2_pop_vector, min_index_list)
-
-                                    # now store in a dictionary to enable iterating through them
-                                    vector_set = {"base": [species_1_pop_vector, species_2_pop_vector],
-                                                  "nz": [species_1_pop_vector_nz, species_2_pop_vector_nz],
-                                                  "nm": [species_1_pop_vector_nm, species_2_pop_vector_nm], }
-
-                                    # D. (Two) correlation coefficients
-                                    # for CCs we always collect all three types (base, _nz, _nm)
-                                    for vector_choice, vector_list in vector_set.items():
-                                        correlation_store[network_key][species_1_name][species_1_ball_radius][
-                                            species_2_name][species_2_ball_radius][vector_choice] = \
-                                            inter_species_predictions_correlation_coefficients(
-                                                vector_list[0], vector_list[1])
-
-                                    # E. Linear model
-                                    # (Note that we could use curve_fit() for a more general model specification here.)
-                                    # E-I. full data; E-II. non-zero predictor; E-III. non-(spec) minimum predictor.
-                                    for vector_choice, vector_list in vector_set.items():
-                                        if vector_choice == "nm" or self.is_record_lesser_lm:
-                                            # only collect the base and NZ data for LMs if requested in plot_save para,
-                                            # that is: Only E-III is collected by default.
-                                            for model_type in ["lin-lin", "log-lin", "log-log"]:
-                                                is_success = False
-                                                is_shifted = False
-
-                                                if model_type == "lin-lin":
-                                                    use_vector = vector_list
-                                                    is_success = True
-
-                                                elif model_type == "log-lin":
-                                                    if any(element < 0.0000000001 for element in vector_list[1]):
-                                                        is_shifted = True
-                                                        if self.is_record_lesser_lm:
-                                                            # shift both vectors up
-                                                            is_success = True
-                                                            use_vector = [deepcopy(vector_list[0]) + minimum_fraction,
-                                                                          np.log(deepcopy(vector_list[1]
-                                                                                          ) + minimum_fraction)]
-                                                        else:
-                                                            is_success = False
-                                                            use_vector = None
-                                                    else:
-                                                        is_success = True
-                                                        use_vector = [vector_list[0], np.log(deepcopy(vector_list[1]))]
-
-                                                elif model_type == "log-log":
-                                                    if (any(element < 0.0000000001 for element in vector_list[0]) or
-                                                        any(element < 0.0000000001 for element in vector_list[1])):
-                                                        is_shifted = True
-                                                        if self.is_record_lesser_lm:
-                                                            # shift both vectors up
-                                                            is_success = True
-                                                            use_vector = [np.log(deepcopy(vector_list[0]
-                                                                                          ) + minimum_fraction),
-                                                                          np.log(deepcopy(vector_list[1]
-                                                                                          ) + minimum_fraction)]
-                                                        else:
-                                                            is_success = False
-                                                            use_vector = None
-                                                    else:
-                                                        is_success = True
-                                                        use_vector = [np.log(deepcopy(vector_list[0])),
-                                                                      np.log(deepcopy(vector_list[1]))]
-                                                else:
-                                                    raise Exception("Error in model choice.")
-
-                                                # conduct the analysis and store
-                                                if is_success:
-                                                    # only include lesser models if specified in plot_save para
-                                                    linear_model_store[network_key][species_1_name][
-                                                        species_1_ball_radius][species_2_name][species_2_ball_radius][
-                                                        vector_choice][model_type] = \
-                                                        linear_model_report(x_val=use_vector[0], y_val=use_vector[1],
-                                                                            is_record_vectors=is_record_lm_vectors,
-                                                                            model_type_str=model_type,
-                                                                            is_shifted=is_shifted)
+                                        raise Exception("Error in model choice.")
+
+                                    # conduct the analysis and store
+                                    for is_shifted, (x_val, y_array) in model_data.items():
+                                        model_columns = np.flatnonzero(is_shifted_column == is_shifted)
+                                        model_reports = linear_model_reports(x_val=x_val, y_array=y_array,
+                                                                             is_record_vectors=is_record_lm_vectors,
+                                                                             model_type_str=model_type,
+                                                                             is_shifted=is_shifted)
+                                        for column_2, linear_model in zip(model_columns, model_reports):
+                                            _, species_2_name, species_2_ball_radius = column_keys[column_2]
+                                            linear_model_store[network_key][species_1_name][species_1_ball_radius][
+                                                species_2_name][species_2_ball_radius][vector_choice][
+                                                model_type] = linear_model
 
         # output FIVE nested dictionaries of results
         return presence_store, similarity_store, prediction_store, correlation_store, linear_model_store
 
     def complexity_analysis(self, sub_networks, corresponding_binary, is_record_lm_vectors,
-                            num_species, is_record_partition):
+                            num_species, is_record_partition, analysis_key):
         # This function takes a set of sub_network partitions and, if it is possible to do so with sufficient data
         # points after organised iterative sampling (multiple attempts for each) of box clusters of highly-connected
         # patch within the sub_network, analyses:
@@ -1150,6 +1197,89 @@ class System_state:
         partition_report = {}
         is_partition_analysis = self.complexity_parameters["IS_PARTITION_ANALYSIS"]
         max_comp_binary_lookup = None
+        species_minimum = np.asarray([species.minimum_population_size for species in self.species_set["list"]])
+
+        # The (sub-network, delta) cluster draws are independent, so can be conducted in a pool of processes before
+        # the sub-networks are analysed in turn. Each has its own random seed, so the results will not be identical to
+        # those of serial execution (but will be reproducible for the same initial random state and NUM_PROCESSES).
+        parallel_cluster_sums = None
+        num_processes = self.complexity_parameters.get("NUM_PROCESSES", 1)
+        # if adaptive, the cluster draws for each delta stop once the means are within this relative precision
+        if self.complexity_parameters.get("IS_ADAPTIVE_SAMPLING", False):
+            relative_ci_width = self.complexity_parameters.get("ADAPTIVE_CI_WIDTH", 0.05)
+        else:
+            relative_ci_width = None
+        if num_processes > 1:
+            task_keys = []
+            task_kwargs_list = []
+            for network_key in sub_networks.keys():
+                current_num_patches = sub_networks[network_key]["num_patches"]
+                max_delta = int(min(current_num_patches / 2, self.complexity_parameters["MAX_DELTA"]))
+                if current_num_patches < 1 or max_delta <= 2:
+                    continue
+                cluster_per_patch = max(1, int(np.floor(self.complexity_parameters[
+                                                              "NUM_CLUSTER_DRAWS"] / current_num_patches)))
+                if corresponding_binary is not None:
+                    binary_sub_network = analysis_sub_network(corresponding_binary[network_key])
+                else:
+                    binary_sub_network = None
+                for delta in range(1, max_delta + 1):
+                    task_keys.append((network_key, delta))
+                    task_kwargs_list.append({
+                        "sub_network": analysis_sub_network(sub_networks[network_key]),
+                        "binary_sub_network": binary_sub_network,
+                        "delta": delta,
+                        "cluster_per_patch": cluster_per_patch,
+                        "max_attempts": self.complexity_parameters["NUM_CLUSTER_DRAW_ATTEMPTS"],
+                        "num_species": num_species,
+                        "species_minimum": species_minimum,
+                        "relative_ci_width": relative_ci_width,
+                        "min_samples": self.complexity_parameters.get("ADAPTIVE_MIN_CLUSTER_DRAWS", 20),
+                    })
+            for task_kwargs, seed in zip(task_kwargs_list, spawn_task_seeds(len(task_kwargs_list))):
+                task_kwargs["seed"] = seed
+            parallel_cluster_sums = dict(zip(task_keys, run_parallel_tasks(
+                task_function=complexity_cluster_sums, task_kwargs_list=task_kwargs_list,
+                num_processes=num_processes)))
+
+        # Likewise the sets of partitions drawn for each (sub-network, base type, delta) are independent.
+        parallel_partition_results = None
+        if num_processes > 1 and is_partition_analysis:
+            task_keys = []
+            task_kwargs_list = []
+            for network_key in sub_networks.keys():
+                current_num_patches = sub_networks[network_key]["num_patches"]
+                max_delta = int(min(current_num_patches / 2, self.complexity_parameters["MAX_DELTA"]))
+                if current_num_patches < 1 or max_delta <= 2:
+                    continue
+                base_networks = {"pw": (sub_networks[network_key], True)}
+                if corresponding_binary is not None:
+                    base_networks["binary"] = (corresponding_binary[network_key], False)
+                for base_type, (base_network, is_normalised) in base_networks.items():
+                    base_network = analysis_sub_network(base_network)
+                    for delta in range(2, max_delta + 1):
+                        task_keys.append((network_key, base_type, delta))
+                        task_kwargs_list.append({
+                            "sub_network": base_network,
+                            "delta": delta,
+                            "num_species": num_species,
+                            "is_normalised": is_normalised,
+                            "partition_success_threshold": self.complexity_parameters["PARTITION_SUCCESS_THRESHOLD"],
+                            "num_reg_partitions": self.complexity_parameters["NUM_REG_PARTITIONS"],
+                            "num_evo_partitions": self.complexity_parameters["NUM_EVO_PARTITIONS"],
+                        })
+            for task_kwargs, seed in zip(task_kwargs_list, spawn_task_seeds(len(task_kwargs_list))):
+                task_kwargs["seed"] = seed
+            parallel_partition_results = dict(zip(task_keys, run_parallel_tasks(
+                task_function=partition_draw_results, task_kwargs_list=task_kwargs_list,
+                num_processes=num_processes)))
+
+        # The power law fits to the complexity vectors of every sub-network are collected and conducted together (in a
+        # pool of processes if NUM_PROCESSES > 1) after the sub-networks have been analysed, and the results are then
+        # inserted into the complexity reports. The fits are keyed by (analysis_key, network_key, complexity type) so
+        # that each is warm-started from the previous analysis of the same sub-network.
+        fit_tasks = []
+        fit_report_keys = []
 
         # need to treat each sub_network entirely separately
         for network_key in sub_networks.keys():
@@ -1161,6 +1291,15 @@ class System_state:
             max_delta = int(min(current_num_patches / 2, self.complexity_parameters["MAX_DELTA"]))
             num_clusters = self.complexity_parameters["NUM_CLUSTER_DRAWS"]  # how many samples we try to draw?
             cluster_per_patch = max(1, int(np.floor(num_clusters / current_num_patches)))
+            # pairwise differences of the patch states, shared by the cluster complexity and the partition analysis
+            difference_caches = {"pw": Difference_cache(
+                target_array=sub_networks[network_key]["normalised_population_arrays"][0])}
+            if corresponding_binary is not None:
+                binary_sub_network = corresponding_binary[network_key]
+                difference_caches["binary"] = Difference_cache(
+                    target_array=binary_sub_network["population_arrays"][0])
+            else:
+                binary_sub_network = None
 
             #
             #
@@ -1172,66 +1311,28 @@ class System_state:
                 species_diversity = np.zeros(max_delta)
                 binary_complexity = np.zeros(max_delta)
                 population_weighted_complexity = np.zeros(max_delta)
+                sampling_precision = np.full(max_delta, np.inf)  # achieved relative CI half-width of the means
 
                 #  iterate over cluster radius, starting at delta=1 and indexing at 0
                 for delta in range(1, max_delta + 1):
-                    # iterate over initial patches from which to begin generating a partition
-                    for i in range(current_num_patches):
-                        for j in range(cluster_per_patch):
-                            cluster, is_success = generate_fast_cluster(
-                                sub_network=sub_networks[network_key],
-                                size=delta,
-                                max_attempts=self.complexity_parameters["NUM_CLUSTER_DRAW_ATTEMPTS"],
-                                admissible_elements=[_ for _ in range(sub_networks[network_key]["num_patches"])],
-                                num_species=num_species,
-                                box_uniform_state="ensure_box",     # for complexity analysis (unlike partition),
-                                is_box=True,                        # PRIORITISE boxes and ignore uniformity
-                                is_uniform=False,
-                                all_elements_admissible=True,
-                                initial_patch=i,
-                                return_undersized_cluster=False,
-                                is_normalised=False,
-                            )[:2]
-
-                            if is_success:
-                                successful_clusters[delta - 1] += 1
-
-                                # determine total diversity in cluster
-                                species_diversity[delta - 1] += self.count_diversity(
-                                    sub_network=sub_networks[network_key], cluster=cluster)
-
-                                # ----- Complexity (information dimension) ----- #
-                                #
-                                # For this we compare all unique pairs of patches within the cluster, and sum the
-                                # total of their differences in state (either binary or weighted relative to the
-                                # sub-network-species-normalised populations).
-                                # Then the complexity dimension examines how the rate of complexity increase compares
-                                # with the rate of the increase in cluster size.
-                                #
-                                # We also check how this grows immediately with cluster size from n to n+1, to
-                                # attempt to (tentatively) identify the most natural clustering unit of the system.
-
-                                # determine binary complexity within cluster
-                                if corresponding_binary is not None:
-                                    # NOTE: we ONLY conduct this analysis for the final and not the time-averaged
-                                    # version, passing in the corresponding final-occupancy-based sub_network
-                                    binary_complexity[delta - 1] += determine_complexity(
-                                        sub_network=corresponding_binary[network_key],
-                                        cluster=cluster,
-                                        is_normalised=False,
-                                        num_species=num_species,
-                                    )
-
-                                # determine population-weighted complexity within cluster
-                                population_weighted_complexity[delta - 1] += determine_complexity(
-                                    sub_network=sub_networks[network_key],
-                                    cluster=cluster,
-                                    is_normalised=True,
-                                    num_species=num_species,
-                                )
-                            else:
-                                # if all NUM_CLUSTER_DRAW_ATTEMPTS starting at this patch failed, move on to next patch
-                                break
+                    # draw clusters from each initial patch (or collect those already drawn in parallel)
+                    if parallel_cluster_sums is not None:
+                        cluster_sums = parallel_cluster_sums[(network_key, delta)]
+                    else:
+                        cluster_sums = complexity_cluster_sums(
+                            sub_network=sub_networks[network_key],
+                            binary_sub_network=binary_sub_network,
+                            delta=delta,
+                            cluster_per_patch=cluster_per_patch,
+                            max_attempts=self.complexity_parameters["NUM_CLUSTER_DRAW_ATTEMPTS"],
+                            num_species=num_species,
+                            species_minimum=species_minimum,
+                            difference_caches=difference_caches,
+                            relative_ci_width=relative_ci_width,
+                            min_samples=self.complexity_parameters.get("ADAPTIVE_MIN_CLUSTER_DRAWS", 20),
+                        )
+                    (successful_clusters[delta - 1], species_diversity[delta - 1], binary_complexity[delta - 1],
+                     population_weighted_complexity[delta - 1], sampling_precision[delta - 1]) = cluster_sums
 
                     # normalise output arrays
                     if successful_clusters[delta - 1] > 0:
@@ -1265,42 +1366,39 @@ class System_state:
 
                 # Binary version is only analysed when actually calculated for the _final (not _average) complexity:
                 if corresponding_binary is not None:
-                    (binary_complexity, binary_dc_graphical, binary_complexity_max
-                     ) = complexity_scaling_vector_analysis(
-                        x_val=x_val, y_val=binary_complexity,
-                    )
-                else:
-                    binary_complexity = {}
-                    binary_dc_graphical = None
-                    binary_complexity_max = None
+                    fit_tasks.append(((analysis_key, network_key, "binary"), x_val, binary_complexity))
+                    fit_report_keys.append((network_key, "binary"))
 
                 # Whilst the population-weighted version is calculated for both the complexity_final and _average vers.
-                (pop_weight_complexity, pop_weight_dc_graphical, pop_weight_complexity_max
-                 ) = complexity_scaling_vector_analysis(
-                    x_val=x_val, y_val=population_weighted_complexity,
-                )
+                fit_tasks.append(((analysis_key, network_key, "pop_weight"), x_val, population_weighted_complexity))
+                fit_report_keys.append((network_key, "pop_weight"))
 
                 # record SAR
                 sar_report[network_key] = {
                     "is_cluster_success": 1,
                     "lm_sar": lm_sar,
+                    "num_successful_clusters": successful_clusters,
+                    "sampling_precision": sampling_precision,
                 }
 
-                # record complexity
+                # record complexity (the fitted values are inserted once the fits are complete)
                 complexity_report[network_key] = {
                     "is_cluster_success": 1,
-                    "binary_complexity": binary_complexity,
-                    "binary_dc_graphical": binary_dc_graphical,
-                    "binary_complexity_max": binary_complexity_max,
-                    "pop_weight_complexity": pop_weight_complexity,
-                    "pop_weight_dc_graphical": pop_weight_dc_graphical,
-                    "pop_weight_complexity_max": pop_weight_complexity_max,
+                    "binary_complexity": {},
+                    "binary_dc_graphical": None,
+                    "binary_complexity_max": None,
+                    "pop_weight_complexity": None,
+                    "pop_weight_dc_graphical": None,
+                    "pop_weight_complexity_max": None,
+                    "sampling_precision": sampling_precision,
                 }
             else:
                 # set the default values
                 sar_report[network_key] = {
                     "is_cluster_success": 0,
                     "lm_sar": {},
+                    "num_successful_clusters": None,
+                    "sampling_precision": None,
                 }
                 complexity_report[network_key] = {
                     "is_cluster_success": 0,
@@ -1310,6 +1408,7 @@ class System_state:
                     "pop_weight_complexity": {},
                     "pop_weight_dc_graphical": None,
                     "pop_weight_complexity_max": None,
+                    "sampling_precision": None,
                 }
 
             #
@@ -1362,36 +1461,28 @@ class System_state:
                     # iterate over cluster radius, starting at delta=2 and indexing at 1
                     for delta in range(2, max_delta + 1):
 
-                        # iterate over multiple attempts to draw successful partitions overall
-                        for i in range(num_reg_partitions + num_evo_partitions):
-                            if i < num_reg_partitions:
-                                # draw some partitions in the regular way, stepping over the starting patches
-                                initial_patch = i * int(current_num_patches / num_reg_partitions)
-                                is_evo = False
-                            else:
-                                # draw some partitions using the evolutionary method
-                                initial_patch = None
-                                is_evo = True
-
-                            (partition, partition_lookup, is_partition_success, partition_intra_complexity
-                             ) = draw_partition(sub_network=base_values["network"], size=delta,
-                                num_species=num_species, is_normalised=base_values["normalised"],
-                                                partition_success_threshold=partition_success_threshold,
-                                                initial_patch=initial_patch,
-                                                is_evo=is_evo
-                                                )
-
+                        # draw the regular and evolutionary partitions (or collect those already drawn in parallel)
+                        if parallel_partition_results is not None:
+                            draw_results = parallel_partition_results[(network_key, base_type, delta)]
+                        else:
+                            draw_results = partition_draw_results(
+                                sub_network=base_values["network"],
+                                delta=delta,
+                                num_species=num_species,
+                                is_normalised=base_values["normalised"],
+                                partition_success_threshold=partition_success_threshold,
+                                num_reg_partitions=num_reg_partitions,
+                                num_evo_partitions=num_evo_partitions,
+                                difference_cache=difference_caches[base_type],
+                            )
+
+                        for (partition_lookup, is_partition_success, partition_intra_complexity, inter_complexity
+                             ) in draw_results:
                             # We require at least half the elements to have been placed in clusters of the desired
                             # size for the partition to be acceptable:
                             if is_partition_success:
                                 base_values["num_successful_partitions"][delta - 1] += 1
 
-                                inter_complexity = partition_analysis(sub_network=base_values["network"],
-                                                                        partition=partition,
-                                                                        partition_lookup=partition_lookup,
-                                                                        num_species=num_species,
-                                                                        is_normalised=base_values["normalised"])
-
                                 # calculate the partitioning value:
                                 partition_delta = inter_complexity[1] * (1.0 - np.mean(partition_intra_complexity))
                                 # then update the partitioning values range for this delta
@@ -1488,105 +1579,120 @@ class System_state:
                 # --- iteration over "pw", "binary" (if applicable) ends.
 
                 if is_record_partition and network_key == "all" and max_comp_binary_lookup is not None:
-                    # Highest-complexity binary partition from the 'all' subnetwork is recorded
+                    # Highest-complexity binary partition from the 'all' subnetwork is recorded (this is indexed by
+                    # position in the current_patch_list, and removed patches are left without a partition code)
                     for patch in self.patch_list:
-                        patch.partition_code = int(max_comp_binary_lookup[patch.number])
+                        patch_index = self.current_patch_position[patch.number]
+                        if patch_index >= 0:
+                            patch.partition_code = int(max_comp_binary_lookup[patch_index])
+                        else:
+                            patch.partition_code = None
 
             partition_dict["is_partition_graphical"] = True  # identifier for plotting
             partition_report[network_key] = partition_dict  # save the results, identified by network key (0, 1, all)
+
+        # conduct the power law fits of the complexity vectors and record them
+        fit_results = self.power_law_fitter.fit_batch(fit_tasks=fit_tasks, num_processes=num_processes)
+        for (network_key, complexity_type), (complexity, dc_graphical, complexity_max) in zip(
+                fit_report_keys, fit_results):
+            complexity_report[network_key][complexity_type + "_complexity"] = complexity
+            complexity_report[network_key][complexity_type + "_dc_graphical"] = dc_graphical
+            complexity_report[network_key][complexity_type + "_complexity_max"] = complexity_max
         return sar_report, complexity_report, partition_report
 
     def count_diversity(self, sub_network, cluster):
         # count the number of species present in the population array of this sub_network, whose relatively-nth patches
         # are indexed by the list "cluster" - cluster does NOT contain inherent patch numbers (unless the sub_network
         # is 'all' and zero patches have been deleted.)
-        found_species_set = set()
-        for patch_index in cluster:
-            population_vector = sub_network["population_arrays"][0][patch_index, :]
-            for possible_species_index in range(len(population_vector)):
-                this_species_min = self.species_set["list"][possible_species_index].minimum_population_size
-                if population_vector[possible_species_index] > this_species_min:
-                    found_species_set.add(possible_species_index)
-        diversity = len(found_species_set)
-        return diversity
-
-    def generate_sub_networks(self, population_array, patch_habitat, habitat_type_nums):
-        # For each subnetwork
-        # 	– Determine the adjacency matrix
-        #   – Determine the vectors of radius-1 and radius-2 population sizes
-        # 	– Determine the network-normalised (by radius-specific local maximum) population vectors
-        #   - Determine the list of neighbours of each patch - IN TERMS OF THE SUB-NETWORK INDEX
-
-        # produce habitat subnetworks first - including adjacency arrays (store them in dict with same network keys)
-        sub_networks = {}
+        species_minimum = np.asarray([species.minimum_population_size for species in self.species_set["list"]])
+        return count_cluster_diversity(sub_network=sub_network, cluster=cluster, species_minimum=species_minimum)
+
+    def generate_sub_network_topology(self, patch_habitat, habitat_type_nums):
+        # For each sub-network determine the parts that depend only on the spatial network (not the population values):
+        #   - the sub-network patches, as their positions in the current_patch_list
+        # 	– the adjacency matrix
+        #   - the radius-1 and radius-2 balls, as binary sparse matrices (so the ball sums are matrix products)
+        #   - the list of neighbours of each patch - IN TERMS OF THE SUB-NETWORK INDEX
+        # This is built once and then re-used by generate_sub_networks() for each of the population arrays.
+        sub_network_topology = {}
         sub_network_list = [x for x in habitat_type_nums]
         sub_network_list.append('all')  # note that if there is just one habitat type, we still generate two
         # sub-networks and conduct any subsequent analysis twice.
         #
         # With two different sample sets for the cluster generation this could lead to slightly different results.
+        current_adjacency = self.patch_adjacency_matrix.to_csr()[self.current_patch_list, :][
+                            :, self.current_patch_list]
+        patch_habitat = np.asarray(patch_habitat)
 
         for network_key in sub_network_list:
-            # need adjacency matrix and population array
-            temp_num_patches = len(self.current_patch_list)
-            temp_adjacency = deepcopy(self.patch_adjacency_matrix)
-            temp_population = deepcopy(population_array)
-            temp_patch_habitat = deepcopy(patch_habitat)
-
-            # if restricting to a single-habitat sub-network, iterate to eliminate unwanted rows and columns
-            if network_key != 'all':
-                is_pass = False
-                while temp_num_patches > 0 and not is_pass:
-                    is_pass = True
-                    for temp_patch_index in range(temp_num_patches):
-                        if temp_patch_habitat[temp_patch_index] != network_key:
-                            # remove
-                            temp_patch_habitat.pop(temp_patch_index)
-                            temp_population = np.delete(temp_population, temp_patch_index, axis=0)
-                            temp_adjacency = np.delete(temp_adjacency, temp_patch_index, axis=0)
-                            temp_adjacency = np.delete(temp_adjacency, temp_patch_index, axis=1)
-                            # failed to cycle uninterrupted
-                            is_pass = False
-                            temp_num_patches -= 1
-                            break
+            # if restricting to a single-habitat sub-network, extract the rows and columns with a mask (keeping order)
+            if network_key == 'all':
+                patch_indices = np.arange(len(self.current_patch_list))
+            else:
+                patch_indices = np.nonzero(patch_habitat == network_key)[0]
+            temp_num_patches = len(patch_indices)
 
             # check for non-zero size of sub-network:
             if temp_num_patches > 0:
+                temp_adjacency = current_adjacency[patch_indices, :][:, patch_indices]
+                temp_adjacency.eliminate_zeros()
+                # balls of radius 1 and 2 (patches reachable in exactly one or two directed steps)
+                ball_operators = {1: (temp_adjacency != 0).astype(float)}
+                composite_adjacency = temp_adjacency @ temp_adjacency
+                composite_adjacency.eliminate_zeros()
+                ball_operators[2] = (composite_adjacency != 0).astype(float)
+                for ball_radius in range(1, 3):
+                    ball_operators[ball_radius].sort_indices()  # ball sums are then accumulated in index order
+
+                # generate a dictionary of sub-network relative STRICT neighbour indices (i.e. not including self)
+                strict_neighbours = ((ball_operators[1] + ball_operators[1].T) != 0).tolil()
+                strict_neighbours.setdiag(False)
+                strict_neighbours = strict_neighbours.tocsr()
+                strict_neighbours.eliminate_zeros()
+                strict_neighbours.sort_indices()
+                temp_neighbours = {host_index: strict_neighbours.indices[strict_neighbours.indptr[
+                    host_index]: strict_neighbours.indptr[host_index + 1]].tolist() for host_index in range(
+                    temp_num_patches)}
+
+                sub_network_topology[network_key] = {
+                    "num_patches": temp_num_patches,
+                    "patch_indices": patch_indices,
+                    "adjacency_array": temp_adjacency.toarray(),
+                    "ball_operators": ball_operators,
+                    "ball_sizes": {x: np.diff(ball_operators[x].indptr) for x in ball_operators},
+                    "neighbour_dict": temp_neighbours,
+                }
+            else:
+                sub_network_topology[network_key] = {"num_patches": 0}
+        return sub_network_topology
+
+    def generate_sub_networks(self, population_array, patch_habitat, habitat_type_nums, sub_network_topology=None):
+        # For each subnetwork
+        # 	– Determine the adjacency matrix
+        #   – Determine the vectors of radius-1 and radius-2 population sizes
+        # 	– Determine the network-normalised (by radius-specific local maximum) population vectors
+        #   - Determine the list of neighbours of each patch - IN TERMS OF THE SUB-NETWORK INDEX
+        #
+        # The topology can be passed in when generating the sub-networks of several population arrays for the same
+        # network, otherwise it is built here.
+        if sub_network_topology is None:
+            sub_network_topology = self.generate_sub_network_topology(patch_habitat=patch_habitat,
+                                                                      habitat_type_nums=habitat_type_nums)
+        sub_networks = {}
+        for network_key, topology in sub_network_topology.items():
+            temp_num_patches = topology["num_patches"]
+            if temp_num_patches > 0:
+                temp_population = np.asarray(population_array)[topology["patch_indices"]]
+
                 # now generate the radius-averaged population vectors for each species in this habitat sub-network
-                radius_one_population_array = np.zeros(np.shape(temp_population))
-                radius_two_population_array = np.zeros(np.shape(temp_population))
-                for temp_patch_index in range(temp_num_patches):
-                    for ball_radius in range(1, 3):
-                        if ball_radius == 1:
-                            # ball (radius 1)
-                            ball_patch_indices = list(np.where(temp_adjacency[temp_patch_index, :] != 0)[0])
-                            ball_size = len(ball_patch_indices)
-                        elif ball_radius == 2:
-                            # ball (radius 2)
-                            composite_adjacency = np.matmul(temp_adjacency, temp_adjacency)
-                            ball_patch_indices = list(np.where(composite_adjacency[temp_patch_index, :] != 0)[0])
-                            ball_size = len(ball_patch_indices)
-                        else:
-                            raise Exception("Invalid ball radius.")
-                        # now iterate over each species and take the average population over the elements of the ball
-                        for species_index in range(np.shape(temp_population)[1]):
-                            ball_population = 0.0
-                            for ball_index in ball_patch_indices:
-                                ball_population += temp_population[ball_index, species_index]
-                            if ball_radius == 1:
-                                radius_one_population_array[
-                                    temp_patch_index, species_index] = ball_population / ball_size
-                            elif ball_radius == 2:
-                                radius_two_population_array[
-                                    temp_patch_index, species_index] = ball_population / ball_size
-                            else:
-                                raise Exception("Invalid ball radius.")
+                population_array_dict = {0: temp_population}
+                for ball_radius in range(1, 3):
+                    # take the average population over the elements of the ball
+                    ball_population = topology["ball_operators"][ball_radius] @ temp_population
+                    population_array_dict[ball_radius] = ball_population / topology["ball_sizes"][ball_radius][
+                                                                           :, np.newaxis]
 
                 # For each radius, identify max local population for each species and create normalised pop. matrix:
-                population_array_dict = {
-                    0: temp_population,
-                    1: radius_one_population_array,
-                    2: radius_two_population_array,
-                }
                 normalised_pop_array_dict = {}
                 for ball_radius in range(3):
                     normalised_pop_array = np.zeros(np.shape(population_array_dict[ball_radius]))
@@ -1595,35 +1701,25 @@ class System_state:
                         if species_max_population > 0.0:
                             normalised_pop_array[:, species_index] = population_array_dict[ball_radius][
                                                                      :, species_index] / species_max_population
-                    normalised_pop_array_dict[ball_radius] = deepcopy(normalised_pop_array)
-
+                    normalised_pop_array_dict[ball_radius] = normalised_pop_array
 
-                # generate a dictionary of sub-network relative STRICT neighbour indices (i.e. not including self)
-                temp_neighbours = {}
-                for host_index in range(temp_num_patches):
-                    host_list = []
-                    for neighbour_index in range(temp_num_patches):
-                        if neighbour_index != host_index:
-                            if temp_adjacency[host_index, neighbour_index
-                            ] != 0 or temp_adjacency[neighbour_index, host_index] != 0:
-                                host_list.append(neighbour_index)
-                        temp_neighbours[host_index] = host_list
-
-                # now store the single-habitat subnetwork
-                sub_networks[network_key] = deepcopy({
+                # now store the single-habitat subnetwork (the adjacency and neighbours are shared, not copied, as
+                # they are not modified by any of the subsequent analysis)
+                sub_networks[network_key] = {
                     "num_patches": temp_num_patches,
-                    "max_actual_population": max(temp_population),
+                    "max_actual_population": np.max(temp_population, axis=0),  # for each species
                     "mean_actual_population": np.mean(temp_population),
                     "population_arrays": population_array_dict,  # vectors of population averaged over radius 0, 1, 2
                     "normalised_population_arrays": normalised_pop_array_dict,  #  contains vectors of the subnetwork's
                     # population aggregated over radius 0, 1, 2, and THEN normalised IN EACH CASE (rather than before).
-                    "adjacency_array": temp_adjacency,
-                    "neighbour_dict": temp_neighbours,
-                })
+                    "adjacency_array": topology["adjacency_array"],
+                    "neighbour_dict": topology["neighbour_dict"],
+                }
             else:
                 sub_networks[network_key] = {"num_patches": 0}
         return sub_networks
 
+
 def distribution_recorder(input_array, update_value, array_index):
     # use this to update the 3xN array holding min, running_sum, max values over a distribution and for the range N
     input_array[0, array_index] = min(float(input_array[0, array_index]), update_value)
@@ -1,6 +1,14 @@
 import numpy as np
+import random
+from concurrent.futures import ProcessPoolExecutor
 from scipy.stats import spearmanr, pearsonr, linregress
 from scipy.optimize import curve_fit
+from scipy.special import stdtr
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.csgraph import dijkstra
+from source_code.difference_cache import Difference_cache
+from source_code.running_statistics import Running_statistics
+from source_code.cluster_functions import generate_fast_cluster
 
 
 # Additional static functions used by system_state methods
@@ -15,18 +23,98 @@ def tuple_builder(property_list):
     return sd_tuple
 
 
+def undirected_sparse_graph(adjacency_matrix):
+    # build the unweighted, undirected CSR graph of the (possibly dense) adjacency matrix - an edge exists if EITHER
+    # direction is non-zero. Self-loops are discarded as they never shorten a path.
+    adjacency_graph = csr_matrix(adjacency_matrix != 0.0, dtype=np.float64)
+    adjacency_graph = ((adjacency_graph + adjacency_graph.T) != 0.0).astype(np.float64)
+    adjacency_graph.setdiag(0.0)
+    adjacency_graph.eliminate_zeros()
+    return adjacency_graph
+
+
+def local_clustering_counts(adjacency_graph, is_current, habitat_array):
+    # for every patch, count the pairs of distinct current neighbours (excluding self) and how many of those pairs are
+    # themselves adjacent (i.e. closed triangles) - both over all pairs and over the pairs for which all three patches
+    # share the same habitat type. The neighbour graph (restricted to current patches) is also returned.
+    current_diagonal = diags(is_current.astype(np.float64))
+    neighbour_graph = (adjacency_graph @ current_diagonal).tocsr()
+    current_graph = (current_diagonal @ neighbour_graph).tocsr()
+    num_neighbours = np.asarray(neighbour_graph.sum(axis=1)).ravel()
+    all_pairs = num_neighbours * (num_neighbours - 1.0) / 2.0
+    all_closed = np.asarray((neighbour_graph @ current_graph).multiply(neighbour_graph).sum(axis=1)).ravel() / 2.0
+    same_pairs = np.zeros(len(habitat_array))
+    same_closed = np.zeros(len(habitat_array))
+    for habitat_type_num in np.unique(habitat_array):
+        is_habitat = habitat_array == habitat_type_num
+        habitat_neighbour_graph = (neighbour_graph @ diags(is_habitat.astype(np.float64))).tocsr()
+        num_habitat_neighbours = np.asarray(habitat_neighbour_graph.sum(axis=1)).ravel()
+        habitat_closed = np.asarray((habitat_neighbour_graph @ current_graph).multiply(
+            habitat_neighbour_graph).sum(axis=1)).ravel() / 2.0
+        # only those patches which are themselves of this habitat type form "same" triangles with these neighbours
+        same_pairs[is_habitat] = (num_habitat_neighbours * (num_habitat_neighbours - 1.0) / 2.0)[is_habitat]
+        same_closed[is_habitat] = habitat_closed[is_habitat]
+    return neighbour_graph, all_pairs, all_closed, same_pairs, same_closed
+
+
+def harmonic_centrality_sums(adjacency_graph, source_patch_nums, max_path_length):
+    # for each source, sum 1/d over all other patches reachable within max_path_length steps, using breadth-first
+    # (unweighted) shortest path lengths. Sources are processed in blocks to bound the memory of the distance rows.
+    source_patch_nums = np.asarray(source_patch_nums, dtype=int)
+    num_patches = adjacency_graph.shape[0]
+    harmonic_sums = np.zeros(len(source_patch_nums))
+    block_size = max(1, 2 ** 22 // max(1, num_patches))
+    for block_start in range(0, len(source_patch_nums), block_size):
+        block_sources = source_patch_nums[block_start: block_start + block_size]
+        distance_rows = np.atleast_2d(dijkstra(adjacency_graph, directed=False, unweighted=True,
+                                               indices=block_sources, limit=max_path_length))
+        is_reached = np.isfinite(distance_rows) & (distance_rows > 0.0)  # exclude self and unreachable
+        reciprocal_rows = np.zeros(np.shape(distance_rows))
+        reciprocal_rows[is_reached] = 1.0 / distance_rows[is_reached]
+        harmonic_sums[block_start: block_start + block_size] = np.sum(reciprocal_rows, axis=1)
+    return harmonic_sums
+
+
+def patches_within_path_length(adjacency_graph, source_patch_nums, max_path_length):
+    # return the array of all patch numbers within max_path_length steps of ANY of the source patches (inclusive)
+    if len(source_patch_nums) == 0:
+        return np.zeros(0, dtype=int)
+    distance_row = dijkstra(adjacency_graph, directed=False, unweighted=True, indices=list(source_patch_nums),
+                            limit=max_path_length, min_only=True)
+    return np.where(np.isfinite(distance_row))[0]
+
+
+def neighbour_csr_arrays(patch_list, attribute_name, is_exclude_self=False):
+    # Compressed sparse row arrays (row_starts, neighbours) of the given neighbour set of every patch (in the iteration
+    # order of the sets), so that the neighbours of patch n are neighbours[row_starts[n]: row_starts[n + 1]].
+    row_starts = np.zeros(len(patch_list) + 1, dtype=int)
+    neighbours = []
+    for patch_num, patch in enumerate(patch_list):
+        patch_neighbours = [x for x in getattr(patch, attribute_name) if not (is_exclude_self and x == patch_num)]
+        neighbours.extend(patch_neighbours)
+        row_starts[patch_num + 1] = row_starts[patch_num] + len(patch_neighbours)
+    return row_starts, np.array(neighbours, dtype=int)
+
+
 def linear_model_report(x_val, y_val, is_record_vectors, model_type_str=None, is_shifted=False):
     # checks for typical causes of error, then if valid conducts a linear regression and returns all results in a
     # dictionary structure
-    lm_slope, lm_intercept, lm_r, lm_p, lm_std_err = [0, 0, 0, 0, 0]
+    lm_values = [0, 0, 0, 0, 0]
     is_lm_success = 0
     if len(x_val) == len(y_val) > 1 and not (x_val == float('inf')).any() and not (x_val == float('-inf')).any() and \
             not (y_val == float('inf')).any() and not (y_val == float('-inf')).any():
         try:
-            lm_slope, lm_intercept, lm_r, lm_p, lm_std_err = linregress(x_val, y_val)
+            lm_values = linregress(x_val, y_val)
             is_lm_success = 1
         except ValueError:
             pass
+    return linear_model_dict(lm_values=lm_values, is_lm_success=is_lm_success, x_val=x_val, y_val=y_val,
+                             is_record_vectors=is_record_vectors, model_type_str=model_type_str, is_shifted=is_shifted)
+
+
+def linear_model_dict(lm_values, is_lm_success, x_val, y_val, is_record_vectors, model_type_str, is_shifted):
+    # the dictionary structure of the results of a single linear regression
+    lm_slope, lm_intercept, lm_r, lm_p, lm_std_err = lm_values
     linear_model = {
         "is_linear_model": True,  # this is for search algorithms to identify that this dictionary is a LM
         "is_success": is_lm_success,
@@ -51,6 +139,53 @@ def linear_model_report(x_val, y_val, is_record_vectors, model_type_str=None, is
     return linear_model
 
 
+def linear_model_reports(x_val, y_array, is_record_vectors, model_type_str=None, is_shifted=False):
+    # The batched version of linear_model_report(), for the regressions of each column of y_array against the same
+    # x_val. The least-squares fits (and the statistics otherwise returned by scipy.stats.linregress) are calculated in
+    # closed form for all columns together, and a list of the result dictionaries is returned in column order.
+    num_points, num_columns = np.shape(y_array)
+    lm_values = [[0, 0, 0, 0, 0] for _ in range(num_columns)]
+    is_lm_success = np.zeros(num_columns, dtype=int)
+    # linregress() fails if all the x values are identical
+    if len(x_val) == num_points > 1 and not np.isinf(x_val).any() and np.max(x_val) != np.min(x_val):
+        is_lm_success = (~np.isinf(y_array).any(axis=0)).astype(int)
+        success_columns = np.flatnonzero(is_lm_success)
+        # each column of y is held as a contiguous row, so that all of the sums below are calculated in the same way
+        # (and e.g. regressing a vector against itself gives r = 1 exactly)
+        x_val = np.ascontiguousarray(x_val, dtype=float)
+        y_rows = np.ascontiguousarray(y_array[:, success_columns].T, dtype=float)
+        x_mean = np.mean(x_val)
+        x_deviation = x_val - x_mean
+        y_mean = np.mean(y_rows, axis=1)
+        y_deviation = y_rows - y_mean[:, np.newaxis]
+        # average sums of square differences from the mean
+        ssxm = np.sum(x_deviation * x_deviation) / num_points
+        ssxym = np.sum(y_deviation * x_deviation, axis=1) / num_points
+        ssym = np.sum(y_deviation * y_deviation, axis=1) / num_points
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lm_r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+            lm_r = np.where(ssym == 0.0, np.where(ssxym == 0.0, np.nan, 0.0), lm_r)
+            lm_slope = ssxym / ssxm
+            lm_intercept = y_mean - lm_slope * x_mean
+            if num_points == 2:
+                # only two points, so the line fits exactly
+                lm_p = np.where(y_array[0, success_columns] == y_array[1, success_columns], 1.0, 0.0)
+                lm_std_err = np.zeros(len(success_columns))
+            else:
+                # two-sided p-value of the t-statistic with n-2 degrees of freedom
+                degrees_freedom = num_points - 2
+                t_statistic = lm_r * np.sqrt(degrees_freedom / ((1.0 - lm_r + 1.0e-20) * (1.0 + lm_r + 1.0e-20)))
+                lm_p = 2.0 * stdtr(degrees_freedom, -np.abs(t_statistic))
+                lm_std_err = np.sqrt((1.0 - lm_r ** 2) * ssym / ssxm / degrees_freedom)
+        for result_index, column_index in enumerate(success_columns):
+            lm_values[column_index] = [lm_slope[result_index], lm_intercept[result_index], lm_r[result_index],
+                                       lm_p[result_index], lm_std_err[result_index]]
+    return [linear_model_dict(lm_values=lm_values[column_index], is_lm_success=int(is_lm_success[column_index]),
+                              x_val=x_val, y_val=y_array[:, column_index], is_record_vectors=is_record_vectors,
+                              model_type_str=model_type_str, is_shifted=is_shifted)
+            for column_index in range(num_columns)]
+
+
 def single_power_law(n, alpha, dc):
     return alpha * (n - 1) ** dc
 
@@ -68,34 +203,62 @@ def get_r_squared(x, y, func, fitted_para):
         r_squared = 0.0
     return r_squared
 
-def complexity_scaling_vector_analysis(x_val, y_val):
+def single_power_law_initial_guess(x_val, y_val):
+    # analytic least-squares fit of log(C) = log(alpha) + dc * log(n - 1) over the points with n > 1 and C > 0, as the
+    # initial guess [alpha, dc] (within the bounds) for the fit of the single power law
+    is_valid = (x_val > 1.0) & (y_val > 0.0)
+    if np.sum(is_valid) < 2:
+        return [1, 2]
+    log_x = np.log(x_val[is_valid] - 1)
+    log_y = np.log(y_val[is_valid])
+    log_x_deviation = log_x - np.mean(log_x)
+    if np.dot(log_x_deviation, log_x_deviation) == 0.0:
+        return [1, 2]
+    dc = np.dot(log_x_deviation, log_y - np.mean(log_y)) / np.dot(log_x_deviation, log_x_deviation)
+    alpha = np.exp(np.mean(log_y) - dc * np.mean(log_x))
+    if not np.isfinite(alpha) or not np.isfinite(dc):
+        return [1, 2]
+    return [alpha, float(np.clip(dc, 0.0, 10.0))]
+
+
+def complexity_scaling_vector_analysis(x_val, y_val, dual_initial_guess=None):
     # executed during system_state.complexity_analysis() separately
     # for _binary and _population_weighted vectors to analyse the scaling and dimensions of complexity,
     # and attempt to estimate the natural occurrences of complexity organisation within the system.
     #
+    # The single power law fits begin from the analytic log-log least-squares estimate (and those of the spectrum from
+    # the fit over the previous interval). The dual power law fit begins from the given dual_initial_guess (e.g. the
+    # previous fit of the same sub-network) if there is one, otherwise from the single power law fit.
+    #
     # Include first entry (cluster size of one patch has zero complexity), but because of "n-1" in power laws, we must
     # offset this with a small correction term for curve fitting algorithm.
     # Check where y_val next contains zero - then slice off the invalid part if necessary.
     y_zero_index = np.where(y_val[1:] == 0)[0]
     if len(y_zero_index) == 0:
         testable_complexity = y_val  # [C(1) = 0, C(2), ... ]
-        testable_x_val = x_val  # [1, 2, 3, ... ]
+        testable_x_val = np.array(x_val, dtype=float)  # [1, 2, 3, ... ]
     else:
         testable_complexity = y_val[0:y_zero_index[0] + 1]
-        testable_x_val = x_val[0:y_zero_index[0] + 1]
-    # add the offset
+        testable_x_val = np.array(x_val[0:y_zero_index[0] + 1], dtype=float)
+    # add the offset (to a copy, as the same x_val is used for each complexity vector)
     testable_x_val[0] = testable_x_val[0] + 0.0000001
+    dual_lower_bounds = (0.0000001, 0.0, 0.0, 0.0, 0.0, -10.0)
+    dual_upper_bounds = (10.0, np.inf, np.inf, 10.0, 10.0, 10.0)
 
     # overall analysis
     if len(testable_complexity) > 2:
 
         # fit a single power law if more than two data points
-        dual_initial_guess = [0.1, 1, 1, 2, 2, 1]
+        is_warm_start = dual_initial_guess is not None
+        if not is_warm_start:
+            dual_initial_guess = [0.1, 1, 1, 2, 2, 1]
         try:
-            single_para = curve_fit(single_power_law, testable_x_val, testable_complexity, p0=[1, 2],
+            single_para = curve_fit(single_power_law, testable_x_val, testable_complexity,
+                                    p0=single_power_law_initial_guess(testable_x_val, testable_complexity),
                                     bounds=((0.0, 0.0),(np.inf, 10.0)))[0]
             is_single_fit_success = 1
-            dual_initial_guess = [0.1, single_para[0], single_para[0], single_para[1], single_para[1], 0.0]
+            if not is_warm_start:
+                dual_initial_guess = [0.1, single_para[0], single_para[0], single_para[1], single_para[1], 0.0]
             # complexity dimension is power
             single_dc_fitted = single_para[1]
             single_r_squared = get_r_squared(x=testable_x_val, y=testable_complexity,
@@ -110,9 +273,9 @@ def complexity_scaling_vector_analysis(x_val, y_val):
             # fit a dual power law if more than six data points
             try:
                 # parameters are: k, alpha_1, alpha_2, dc_1, dc_2, beta
-                dual_para = curve_fit(dual_power_law, testable_x_val, testable_complexity, p0=dual_initial_guess,
-                                      bounds=((0.0000001, 0.0, 0.0, 0.0, 0.0, -10.0),
-                                              (10.0, np.inf, np.inf, 10.0, 10.0, 10.0)))[0]
+                dual_para = curve_fit(dual_power_law, testable_x_val, testable_complexity,
+                                      p0=np.clip(dual_initial_guess, dual_lower_bounds, dual_upper_bounds),
+                                      bounds=(dual_lower_bounds, dual_upper_bounds))[0]
                 is_dual_fit_success = 1
                 dual_r_squared = get_r_squared(x=testable_x_val, y=testable_complexity,
                                                func=dual_power_law, fitted_para=dual_para)
@@ -140,14 +303,19 @@ def complexity_scaling_vector_analysis(x_val, y_val):
 
         # fit incremental power laws and determine spectrum of d_c over interval of [1, M] for M in [3, end]
         dc_fit = np.zeros(len(testable_complexity))
+        dc_fit_initial_guess = None
         for k in range(3, len(dc_fit)):
             # fit dc for C = alpha*(n - 1)^dc over [1, k+1] so at least 3 points
+            if dc_fit_initial_guess is None:
+                dc_fit_initial_guess = single_power_law_initial_guess(testable_x_val[0:k], testable_complexity[0:k])
             try:
-                dc_fit_para = curve_fit(single_power_law, testable_x_val[0:k], testable_complexity[0:k], p0=[1, 2],
-                                        bounds=((0.0, 0.0),(np.inf, 10.0)))[0]
+                dc_fit_para = curve_fit(single_power_law, testable_x_val[0:k], testable_complexity[0:k],
+                                        p0=dc_fit_initial_guess, bounds=((0.0, 0.0),(np.inf, 10.0)))[0]
                 dc_fit[k] = dc_fit_para[1]
+                # warm-start the fit over the next interval from this one
+                dc_fit_initial_guess = dc_fit_para
             except (Warning, RuntimeError, TypeError):
-                pass
+                dc_fit_initial_guess = None
         # record first location of maximum fitted d_c (as possible upper bound)
         dc_fit_max_loc = int(np.where(dc_fit == np.max(dc_fit))[0][0])
         complexity_max_results["dc_largest_fit"] = dc_fit[dc_fit_max_loc]
@@ -181,28 +349,21 @@ def complexity_scaling_vector_analysis(x_val, y_val):
         complexity_max_results = {}
     return single_dc_fitted, graphical_results, complexity_max_results
 
-def determine_complexity(sub_network, cluster, is_normalised, num_species):
-    # sum the absolute state difference values over all unique patch pairs in the cluster
+def determine_complexity(sub_network, cluster, is_normalised, num_species, difference_cache=None):
+    # sum the absolute state difference values over all unique patch pairs in the cluster. The difference_cache (of the
+    # same sub-network and normalisation) should be passed in when this is called repeatedly.
     total_difference = 0
     if num_species > 0:
         if sub_network["num_patches"] > 1:
-            for lower_patch_index in range(len(cluster) - 1):
-                lower_patch_num = cluster[lower_patch_index]
-                for upper_patch_index in range(lower_patch_index + 1, len(cluster)):
-                    upper_patch_num = cluster[upper_patch_index]
-                    # compare pair
-                    if is_normalised:
-                        # for populations - difference should be |x_i - x_j| / max{x}
-                        lower_vector = sub_network["normalised_population_arrays"][0][lower_patch_num, :]
-                        upper_vector = sub_network["normalised_population_arrays"][0][upper_patch_num, :]
-                    else:
-                        # for binary (occupancy) comparison - difference should be 1 or 0
-                        lower_vector = sub_network["population_arrays"][0][lower_patch_num, :]
-                        upper_vector = sub_network["population_arrays"][0][upper_patch_num, :]
-                    difference = 0
-                    for species_index in range(len(lower_vector)):
-                        difference += np.abs(lower_vector[species_index] - upper_vector[species_index])
-                    total_difference += difference
+            if difference_cache is None:
+                if is_normalised:
+                    # for populations - difference should be |x_i - x_j| / max{x}
+                    target_array = sub_network["normalised_population_arrays"][0]
+                else:
+                    # for binary (occupancy) comparison - difference should be 1 or 0
+                    target_array = sub_network["population_arrays"][0]
+                difference_cache = Difference_cache(target_array=target_array, max_cached_patches=0)
+            total_difference = difference_cache.cluster_total(cluster)
             # report the total complexity (rather than the per-patch or per-pair average, as this is then
             # compared with log(cluster size) in the subsequent information dimension calculation)
 
@@ -213,6 +374,171 @@ def determine_complexity(sub_network, cluster, is_normalised, num_species):
     return total_difference
 
 
+def count_cluster_diversity(sub_network, cluster, species_minimum):
+    # count the number of species present (above their minimum population size) in any patch of the cluster
+    cluster_populations = sub_network["population_arrays"][0][cluster, :]
+    return int(np.sum(np.any(cluster_populations > species_minimum, axis=0)))
+
+
+def complexity_cluster_sums(sub_network, binary_sub_network, delta, cluster_per_patch, max_attempts, num_species,
+                            species_minimum, difference_caches=None, seed=None, relative_ci_width=None,
+                            min_samples=0):
+    # One (sub-network, delta) unit of complexity_analysis(): draw box clusters of size delta starting from each patch,
+    # and return the number of successful clusters and the sums over them of species diversity, binary complexity (if
+    # the corresponding binary sub-network is given) and population-weighted complexity, as well as the achieved
+    # precision (the largest relative 95% confidence interval half-width of the means of these quantities).
+    #
+    # If a relative_ci_width is given then the sampling is adaptive: the initial patches are visited in a random order,
+    # and drawing stops as soon as at least min_samples clusters have been drawn and all of the means have converged to
+    # within this precision. Otherwise (or if they never converge) clusters are drawn from every patch.
+    #
+    # If a seed is given then the random draws are re-seeded, for when this is executed in a separate process.
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+    if difference_caches is None:
+        difference_caches = {"pw": Difference_cache(target_array=sub_network["normalised_population_arrays"][0])}
+        if binary_sub_network is not None:
+            difference_caches["binary"] = Difference_cache(
+                target_array=binary_sub_network["population_arrays"][0])
+    num_successful_clusters = 0.0
+    diversity_sum = 0.0
+    binary_complexity_sum = 0.0
+    population_weighted_complexity_sum = 0.0
+    running_statistics = {"diversity": Running_statistics(), "pop_weight_complexity": Running_statistics()}
+    if binary_sub_network is not None:
+        running_statistics["binary_complexity"] = Running_statistics()
+    if relative_ci_width is not None:
+        initial_patches = np.random.permutation(sub_network["num_patches"])
+    else:
+        initial_patches = range(sub_network["num_patches"])
+
+    # iterate over initial patches from which to begin generating a partition
+    is_converged = False
+    for i in initial_patches:
+        for j in range(cluster_per_patch):
+            cluster, is_success = generate_fast_cluster(
+                sub_network=sub_network,
+                size=delta,
+                max_attempts=max_attempts,
+                admissible_elements=[_ for _ in range(sub_network["num_patches"])],
+                num_species=num_species,
+                box_uniform_state="ensure_box",     # for complexity analysis (unlike partition),
+                is_box=True,                        # PRIORITISE boxes and ignore uniformity
+                is_uniform=False,
+                all_elements_admissible=True,
+                initial_patch=int(i),
+                return_undersized_cluster=False,
+                is_normalised=False,
+            )[:2]
+
+            if is_success:
+                num_successful_clusters += 1
+
+                # determine total diversity in cluster
+                cluster_diversity = count_cluster_diversity(sub_network=sub_network, cluster=cluster,
+                                                            species_minimum=species_minimum)
+                diversity_sum += cluster_diversity
+                running_statistics["diversity"].update(cluster_diversity)
+
+                # ----- Complexity (information dimension) ----- #
+                #
+                # For this we compare all unique pairs of patches within the cluster, and sum the
+                # total of their differences in state (either binary or weighted relative to the
+                # sub-network-species-normalised populations).
+                # Then the complexity dimension examines how the rate of complexity increase compares
+                # with the rate of the increase in cluster size.
+                #
+                # We also check how this grows immediately with cluster size from n to n+1, to
+                # attempt to (tentatively) identify the most natural clustering unit of the system.
+
+                # determine binary complexity within cluster
+                if binary_sub_network is not None:
+                    # NOTE: we ONLY conduct this analysis for the final and not the time-averaged
+                    # version, passing in the corresponding final-occupancy-based sub_network
+                    cluster_binary_complexity = determine_complexity(
+                        sub_network=binary_sub_network,
+                        cluster=cluster,
+                        is_normalised=False,
+                        num_species=num_species,
+                        difference_cache=difference_caches["binary"],
+                    )
+                    binary_complexity_sum += cluster_binary_complexity
+                    running_statistics["binary_complexity"].update(cluster_binary_complexity)
+
+                # determine population-weighted complexity within cluster
+                cluster_population_weighted_complexity = determine_complexity(
+                    sub_network=sub_network,
+                    cluster=cluster,
+                    is_normalised=True,
+                    num_species=num_species,
+                    difference_cache=difference_caches["pw"],
+                )
+                population_weighted_complexity_sum += cluster_population_weighted_complexity
+                running_statistics["pop_weight_complexity"].update(cluster_population_weighted_complexity)
+
+                # stop early if adaptive and all of the means are sufficiently precise
+                if relative_ci_width is not None and all([statistics.is_converged(
+                        relative_ci_width=relative_ci_width, min_samples=min_samples)
+                        for statistics in running_statistics.values()]):
+                    is_converged = True
+                    break
+            else:
+                # if all NUM_CLUSTER_DRAW_ATTEMPTS starting at this patch failed, move on to next patch
+                break
+        if is_converged:
+            break
+    sampling_precision = max([statistics.relative_ci_width() for statistics in running_statistics.values()])
+    return (num_successful_clusters, diversity_sum, binary_complexity_sum, population_weighted_complexity_sum,
+            sampling_precision)
+
+
+def analysis_sub_network(sub_network):
+    # the parts of a sub-network that are required for drawing and evaluating clusters, to be sent to another process
+    return {
+        "num_patches": sub_network["num_patches"],
+        "neighbour_dict": sub_network["neighbour_dict"],
+        "population_arrays": {0: sub_network["population_arrays"][0]},
+        "normalised_population_arrays": {0: sub_network["normalised_population_arrays"][0]},
+    }
+
+
+# the keyword arguments common to all tasks of run_parallel_tasks(), as received once by each worker process
+shared_task_kwargs = {}
+
+
+def set_shared_task_kwargs(shared_kwargs):
+    # the pool initializer of run_parallel_tasks(), executed once in each worker process
+    global shared_task_kwargs
+    shared_task_kwargs = shared_kwargs
+
+
+def run_task_chunk(task_function, task_kwargs_chunk):
+    # executed in a worker process for a chunk of the tasks of run_parallel_tasks()
+    return [task_function(**shared_task_kwargs, **task_kwargs) for task_kwargs in task_kwargs_chunk]
+
+
+def run_parallel_tasks(task_function, task_kwargs_list, num_processes, shared_kwargs=None, chunk_size=1):
+    # execute task_function(**shared_kwargs, **task_kwargs) for each of the list of keyword dictionaries in a pool of
+    # processes, and return the list of results in the same order as the tasks (regardless of the order in which they
+    # complete). The shared_kwargs (e.g. large arrays common to all tasks) are sent to each process only once when it
+    # starts, rather than with every task, and the tasks are submitted in chunks of chunk_size.
+    if shared_kwargs is None:
+        shared_kwargs = {}
+    with ProcessPoolExecutor(max_workers=num_processes, initializer=set_shared_task_kwargs,
+                             initargs=(shared_kwargs,)) as executor:
+        futures = [executor.submit(run_task_chunk, task_function,
+                                   task_kwargs_list[chunk_start: chunk_start + chunk_size])
+                   for chunk_start in range(0, len(task_kwargs_list), chunk_size)]
+        return [task_result for future in futures for task_result in future.result()]
+
+
+def spawn_task_seeds(num_tasks):
+    # independent integer seeds for parallel tasks, derived from (and so reproducible with) the global random state
+    seed_sequence = np.random.SeedSequence(np.random.randint(0, 2 ** 31 - 1))
+    return [int(child.generate_state(1)[0]) for child in seed_sequence.spawn(num_tasks)]
+
+
 def rank_abundance(sub_networks, is_record_lm_vectors):
     # for each sub_network, conduct a species rank abundance analysis, fitting species rank (0 - N-1, where N is the
     # number of species with non-zero population in this sub_network) against log(relative abundance). As the y-values
@@ -262,32 +588,45 @@ def rank_abundance(sub_networks, is_record_lm_vectors):
     return rank_abundance_report
 
 
-def inter_species_predictions_correlation_coefficients(species_1_vector, species_2_vector):
-    # must first test for 'nearly constant' vectors to avoid warnings
+def species_pair_store(species_list, leaf_function):
+    # nested dictionary [species_1][radius_1][species_2][radius_2] (for ball radius 0, 1, 2) of new leaf_function()
+    return {species_1_name: {species_1_ball_radius: {species_2_name: {species_2_ball_radius: leaf_function()
+                                                                      for species_2_ball_radius in range(3)}
+                                                     for species_2_name in species_list}
+                             for species_1_ball_radius in range(3)}
+            for species_1_name in species_list}
+
+
+def inter_species_correlation_coefficients_batch(species_1_vector, species_2_array):
+    # The Pearson and Spearman correlation coefficients of the predictor vector with each column of species_2_array,
+    # returned as a list of dictionaries in column order. We must first test for 'nearly constant' vectors to avoid
+    # warnings, and for correlation coefficients to work we need two vectors of at least two pairs and at least some
+    # variance. The coefficients of all of the remaining columns are then calculated together.
+    num_columns = np.shape(species_2_array)[1]
     species_1_near_constant = np.var(species_1_vector) < 1e-13 * abs(np.mean(species_1_vector))
-    species_2_near_constant = np.var(species_2_vector) < 1e-13 * abs(np.mean(species_2_vector))
-    is_cc_auto_fail = (species_1_near_constant or species_2_near_constant or np.var(
-        species_1_vector) <= 0.0 or np.var(species_2_vector) <= 0.0 or
-                       len(species_1_vector) < 2 or len(species_2_vector) < 2)
-    is_cc_success = 0
-    pearson_cc, pearson_p, spearman_rho, spearman_p = [0.0, 0.0, 0.0, 0.0]
-    # for correlation coefficients to work, we need two vectors of at least two pairs and at least some variance
-    if not is_cc_auto_fail:
-        try:
-            pearson_cc, pearson_p = pearsonr(species_1_vector, species_2_vector)
-            spearman_rho, spearman_p = spearmanr(species_1_vector, species_2_vector)
-            is_cc_success = 1
-            if pearson_p == float('NaN') or spearman_p == float('NaN'):
-                is_cc_success = 0
-        except ValueError:
-            is_cc_success = 0
-    if is_cc_success == 0:
-        pearson_cc, pearson_p, spearman_rho, spearman_p = [0.0, 0.0, 0.0, 0.0]
-    corr_coefficients = {
+    species_2_variance = np.var(species_2_array, axis=0)
+    species_2_near_constant = species_2_variance < 1e-13 * np.abs(np.mean(species_2_array, axis=0))
+    is_cc_auto_fail = (species_1_near_constant or np.var(species_1_vector) <= 0.0 or len(species_1_vector) < 2
+                       ) | species_2_near_constant | (species_2_variance <= 0.0)
+    success_columns = np.flatnonzero(~is_cc_auto_fail)
+    correlation_values = [[0, 0.0, 0.0, 0.0, 0.0] for _ in range(num_columns)]
+    if len(success_columns) > 0:
+        pearson_result = pearsonr(species_1_vector[:, np.newaxis], species_2_array[:, success_columns], axis=0)
+        spearman_result = spearmanr(np.column_stack((species_1_vector, species_2_array[:, success_columns])))
+        if len(success_columns) == 1:
+            spearman_rho = np.atleast_1d(spearman_result.statistic)
+            spearman_p = np.atleast_1d(spearman_result.pvalue)
+        else:
+            spearman_rho = spearman_result.statistic[0, 1:]
+            spearman_p = spearman_result.pvalue[0, 1:]
+        for result_index, column_index in enumerate(success_columns):
+            correlation_values[column_index] = [1, pearson_result.statistic[result_index],
+                                                pearson_result.pvalue[result_index],
+                                                spearman_rho[result_index], spearman_p[result_index]]
+    return [{
         'is_success': is_cc_success,
         'pearson_cc': pearson_cc,
         'pearson_p_value': pearson_p,
         'spearman_rho': spearman_rho,
         'spearman_p_value': spearman_p,
-    }
-    return corr_coefficients
+    } for is_cc_success, pearson_cc, pearson_p, spearman_rho, spearman_p in correlation_values]